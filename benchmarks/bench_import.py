@@ -0,0 +1,79 @@
+# benchmarks/bench_import.py
+"""
+Presupuesto de tiempo de importación del pipeline.
+
+Importa cada módulo en un intérprete nuevo (python -X importtime), toma el mejor
+de varias repeticiones y lo compara con su presupuesto. También verifica que
+importar no cargue dependencias pesadas ni con efectos secundarios (SDK de
+Gemini, tkinter, lectura del .env): esas se cargan en el primer uso.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_import.py              # sale con código 1 si algo excede
+    python benchmarks/bench_import.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Presupuesto (ms) por módulo. main/extract incluyen pandas y requests, que
+# dominan su tiempo; los módulos livianos deben importar en pocos milisegundos.
+BUDGETS_MS = {
+    'constants': 5,
+    'settings': 10,
+    'ratelimit': 20,
+    'metrics': 30,
+    'templates': 20,
+    'load': 60,
+    'ia_narrative': 900,
+    'main': 1000,
+}
+
+# Módulos que no deben cargarse solo por importar el pipeline
+FORBIDDEN_MODULES = ('google.genai', 'tkinter', 'turtle', 'dotenv')
+
+
+def measure(module: str) -> tuple:
+    """Tiempo acumulado (ms) de importar `module` y módulos prohibidos que arrastra."""
+    code = (f"import sys; import {module}; "
+            f"print(','.join(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules))")
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    cumulative_us = 0
+    for line in completed.stderr.splitlines():
+        # Formato: "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative_us = int(parts[1])
+    loaded = [m for m in completed.stdout.strip().split(',') if m]
+    return cumulative_us / 1000.0, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Presupuesto de tiempo de importación.")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones por módulo (se toma la mejor).")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'módulo':<14} {'mejor (ms)':>10} {'presupuesto':>12}")
+    for module, budget in BUDGETS_MS.items():
+        runs = [measure(module) for _ in range(args.repeat)]
+        best = min(ms for ms, _ in runs)
+        loaded = runs[0][1]
+        status = "OK" if best <= budget and not loaded else "EXCEDIDO"
+        print(f"{module:<14} {best:10.1f} {budget:12d}  {status}"
+              + (f"  (carga: {', '.join(loaded)})" if loaded else ""))
+        if status != "OK":
+            failures.append(module)
+
+    if failures:
+        print(f"\n--- ALERTA Presupuesto de importación excedido: {', '.join(failures)}")
+        return 1
+    print("\n--- EXITO Todos los módulos dentro del presupuesto.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# benchmarks/bench_pipeline.py
+"""
+Benchmark de extremo a extremo de run_scalable_pipeline, sin red: los proveedores
+de pronóstico, Gemini y el servidor SMTP se reemplazan por servicios locales
+(benchmarks/standins.py) y los datos de entrada son sintéticos (benchmarks/datasets.py).
+
+Cada escenario corre en un proceso aparte (importaciones y cachés en frío) y
+reporta el tiempo total, el throughput (fincas/s) y el tiempo de cada etapa.
+Las etapas del pipeline en flujo se solapan: el tiempo de cada una es su tiempo
+ocupado y la suma puede superar el total.
+Los resultados se comparan con benchmarks/baselines.json para hacer visibles
+las regresiones.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_pipeline.py                        # escenarios small y medium
+    python benchmarks/bench_pipeline.py --scenarios large
+    python benchmarks/bench_pipeline.py --save-baseline        # actualiza baselines.json
+    python benchmarks/bench_pipeline.py --provider-latency 0.2 --provider-error-rate 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+WORK_DIR = os.path.join(BENCH_DIR, '.work')
+BASELINES_PATH = os.path.join(BENCH_DIR, 'baselines.json')
+RESULTS_PATH = os.path.join(WORK_DIR, 'latest_results.json')
+
+SCENARIOS = {
+    'small': {'users': 100, 'history_years': 2},
+    'medium': {'users': 10_000, 'history_years': 10},
+    'large': {'users': 100_000, 'history_years': 30},
+}
+
+# =======================================================================
+# PROCESO HIJO: UN ESCENARIO
+# =======================================================================
+
+def run_scenario(name: str, args) -> dict:
+    from standins import FakeProviderServer, SMTPSink, StubGenaiClient
+
+    scenario = SCENARIOS[name]
+    workdir = os.path.join(WORK_DIR, name)
+    sys.path.insert(0, SRC_DIR)
+
+    with FakeProviderServer(args.provider_latency, args.provider_error_rate) as providers, SMTPSink() as sink:
+        # Configuración antes de importar el pipeline (los módulos la leen al importarse)
+        os.environ.update({
+            'OPENWEATHER_API_KEY': 'benchmark',
+            'EMAIL_USER': 'alertas@example.com',
+            'EMAIL_PASS': '',
+            'SMTP_HOST': '127.0.0.1',
+            'SMTP_PORT': str(sink.port),
+            'SMTP_STARTTLS': '0',
+        })
+        os.environ.pop('GEMINI_API_KEY', None)
+
+        import constants
+        os.chdir(workdir)
+        constants.URL_OPENWEATHER_FORECAST = f"{providers.base_url}/data/2.5/forecast"
+        constants.URL_OPENMETEO_FORECAST = f"{providers.base_url}/v1/forecast"
+        # Los servicios locales no tienen cuotas: solo se limita la concurrencia
+        for limits in constants.PROVIDER_LIMITS.values():
+            limits.update(rate_per_sec=10_000.0, burst=10_000)
+        constants.NARRATIVE_REQUESTS_PER_MINUTE = 600_000
+
+        constants.METRICS_ENABLED = True
+        started = time.perf_counter()
+        import main
+        import ia_narrative
+        import metrics
+        import_seconds = time.perf_counter() - started
+        stub = StubGenaiClient(args.gemini_latency)
+        ia_narrative.set_client(stub)
+
+        log = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            main.run_scalable_pipeline(new_run=True)
+        total = time.perf_counter() - started
+        # Tiempos por etapa de la instrumentación del propio pipeline (metrics.stage_timer)
+        timings = {'importacion': import_seconds, **metrics.stage_durations()}
+
+    return {
+        'scenario': name,
+        'users': scenario['users'],
+        'history_years': scenario['history_years'],
+        'total_seconds': round(total, 4),
+        'farms_per_second': round(scenario['users'] / total, 1),
+        'stages': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        'provider_requests': providers.requests,
+        'gemini_calls': stub.models.calls,
+        'emails_received': sink.received,
+        'log_lines': log.getvalue().count('\n'),
+    }
+
+
+# =======================================================================
+# PROCESO PRINCIPAL: ESCENARIOS, REPORTE Y COMPARACIÓN
+# =======================================================================
+
+def _run_child(name: str, args) -> dict:
+    # Los datos se preparan en el proceso principal para que el hijo mida la
+    # importación del pipeline en frío (sin pandas ya cargado)
+    from datasets import prepare_workdir
+    sys.path.insert(0, SRC_DIR)
+    import constants
+    prepare_workdir(os.path.join(WORK_DIR, name), SCENARIOS[name]['users'], SCENARIOS[name]['history_years'],
+                    constants.DATA_FILE_PATH_USERS, constants.DATA_FILE_PATH_HISTORICAL)
+
+    command = [sys.executable, os.path.abspath(__file__), '--child', name,
+               '--provider-latency', str(args.provider_latency),
+               '--provider-error-rate', str(args.provider_error_rate),
+               '--gemini-latency', str(args.gemini_latency)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"El escenario '{name}' falló:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Etapas (y total) que superan la línea base en más de `tolerance`."""
+    regressions = []
+    pairs = [('total', result['total_seconds'], baseline.get('total_seconds'))]
+    pairs += [(stage, seconds, baseline.get('stages', {}).get(stage)) for stage, seconds in result['stages'].items()]
+    for label, current, reference in pairs:
+        # Por debajo de 50 ms el ruido domina la comparación
+        if reference and current > reference * (1 + tolerance) and current - reference > 0.05:
+            regressions.append(f"{label}: {reference:.2f}s -> {current:.2f}s (+{(current / reference - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print_result(result: dict, baseline: dict) -> None:
+    print(f"\n--- Escenario {result['scenario']}: {result['users']} fincas, "
+          f"{result['history_years']} años de histórico ---")
+    print(f"  Total: {result['total_seconds']:.2f}s ({result['farms_per_second']:.0f} fincas/s)"
+          + (f"  | línea base: {baseline['total_seconds']:.2f}s" if baseline else ""))
+    for stage, seconds in result['stages'].items():
+        reference = (baseline or {}).get('stages', {}).get(stage)
+        print(f"    {stage:<12} {seconds:8.3f}s" + (f"   (base {reference:.3f}s)" if reference is not None else ""))
+    print(f"  Peticiones HTTP: {result['provider_requests']} | llamadas a Gemini: {result['gemini_calls']} "
+          f"| correos recibidos: {result['emails_received']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del pipeline (sin red).")
+    parser.add_argument('--scenarios', default='small,medium',
+                        help=f"Lista separada por comas entre: {', '.join(SCENARIOS)}.")
+    parser.add_argument('--provider-latency', type=float, default=0.02, help="Latencia (s) por petición HTTP.")
+    parser.add_argument('--provider-error-rate', type=float, default=0.0, help="Fracción de respuestas 500.")
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help="Latencia (s) por llamada a Gemini.")
+    parser.add_argument('--save-baseline', action='store_true', help="Guarda los resultados como línea base.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Regresión permitida frente a la línea base.")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args)))
+        return 0
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    results, regressions = {}, []
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        if name not in SCENARIOS:
+            parser.error(f"Escenario desconocido: {name}")
+        result = _run_child(name, args)
+        results[name] = result
+        baseline = baselines.get(name)
+        _print_result(result, baseline)
+        if baseline and not args.save_baseline:
+            for regression in _compare(result, baseline, args.tolerance):
+                regressions.append(f"{name} / {regression}")
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    with open(RESULTS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(BASELINES_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, ensure_ascii=False)
+        print(f"\n--- EXITO Línea base actualizada en {BASELINES_PATH}")
+    elif regressions:
+        print("\n--- ALERTA Regresiones frente a la línea base:")
+        for regression in regressions:
+            print(f"    {regression}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
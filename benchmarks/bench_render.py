@@ -0,0 +1,74 @@
+# benchmarks/bench_render.py
+"""
+Benchmark de la etapa de renderizado: costo por correo (HTML + MIME serializado).
+
+Compara la ruta clásica (generate_alert_html + MIMEMultipart.as_string por correo)
+con la plantilla/MIME precompilados de render.py, en el proceso principal y con
+un pool de procesos.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_render.py --recipients 100000 --processes 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('EMAIL_USER', 'alertas@example.com')
+
+from load import build_alert_message  # noqa: E402
+from render import AlertToRender, render_alert_messages  # noqa: E402
+from templates import generate_alert_html  # noqa: E402
+
+AI_BODY = (
+    "<p><b>I. Resumen:</b> Riesgo ALTO con ITH máximo de 84.3 en [[FINCA]].</p>\n"
+    "<p><b>II. HOY:</b> <b>13:00–17:00</b> (ITH máx: 84.3). Aumente el agua fresca un 20% "
+    "y mueva el ganado a la sombra más densa.</p>\n"
+    "<p><b>III. MAÑANA:</b> <b>12:00–16:00</b> (ITH máx: 82.1). Adelante el ordeño y "
+    "prepare la aspersión en el corral de espera.</p>\n"
+) * 3
+
+
+def build_alerts(n: int):
+    return [
+        AlertToRender(f"u{i}@example.com", f"Alerta ITH: riesgo ALTO en Finca {i} mañana",
+                      f"Finca {i}", 'Leche' if i % 2 else 'Carne', 81.87, AI_BODY)
+        for i in range(n)
+    ]
+
+
+def bench_legacy(alerts):
+    return [(a.recipient, build_alert_message(a.recipient, a.subject,
+                                              generate_alert_html(a.farm_name, a.product_type,
+                                                                  a.ith_threshold, a.ai_generated_body)))
+            for a in alerts]
+
+
+def timed(label, fn, n):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<34} {elapsed:8.2f}s  {elapsed / n * 1e6:8.1f} µs/correo  {n / elapsed:10.0f} correos/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--recipients', type=int, default=100_000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--skip-legacy', action='store_true', help="No medir la ruta MIMEMultipart (lenta).")
+    args = parser.parse_args()
+
+    alerts = build_alerts(args.recipients)
+    print(f"--- Renderizado de {args.recipients} correos ---")
+    if not args.skip_legacy:
+        timed("clásico (f-string + MIMEMultipart)", lambda: bench_legacy(alerts), len(alerts))
+    timed("precompilado (1 proceso)", lambda: render_alert_messages(alerts, processes=1), len(alerts))
+    if args.processes > 1:
+        timed(f"precompilado ({args.processes} procesos)",
+              lambda: render_alert_messages(alerts, processes=args.processes), len(alerts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# benchmarks/datasets.py
+"""
+Datos sintéticos para los benchmarks: base de usuarios (users.csv) y CSV histórico
+horario de Open-Meteo, con el mismo formato que los archivos reales del proyecto.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Centro de la región simulada (Montería) y radio en grados alrededor de él
+CENTER_LAT, CENTER_LON = 8.7296, -75.8650
+REGION_RADIUS_DEG = 1.0
+
+
+def write_users_csv(path: str, n_users: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({
+        'farm_name': [f"Finca {i}" for i in range(n_users)],
+        'product_type': rng.choice(['Leche', 'Carne'], n_users),
+        'email': [f"productor{i}@example.com" for i in range(n_users)],
+        'latitude': CENTER_LAT + rng.uniform(-REGION_RADIUS_DEG, REGION_RADIUS_DEG, n_users),
+        'longitude': CENTER_LON + rng.uniform(-REGION_RADIUS_DEG, REGION_RADIUS_DEG, n_users),
+    }).to_csv(path, index=False)
+
+
+def write_historical_csv(path: str, years: int, seed: int = 0) -> None:
+    """
+    Histórico horario con las columnas time, temperature_2m (°C) y
+    relative_humidity_2m (%) (exportación de Open-Meteo).
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    times = pd.date_range(end=pd.Timestamp.now().normalize(), periods=years * 365 * 24, freq='h')
+    hours = times.hour.to_numpy()
+    day_of_year = times.dayofyear.to_numpy()
+    temperature = (27.0 + 4.5 * np.sin((hours - 9) / 24 * 2 * np.pi)
+                   + 1.0 * np.sin(day_of_year / 365 * 2 * np.pi) + rng.normal(0, 1.0, len(times)))
+    humidity = np.clip(80.0 + 10.0 * np.cos(hours / 24 * 2 * np.pi) + rng.normal(0, 5.0, len(times)), 20, 100)
+    pd.DataFrame({
+        'time': times.strftime('%Y-%m-%dT%H:%M'),
+        'temperature_2m (°C)': temperature.round(1),
+        'relative_humidity_2m (%)': humidity.round(0).astype(int),
+    }).to_csv(path, index=False)
+
+
+def prepare_workdir(workdir: str, n_users: int, history_years: int,
+                    users_path: str, historical_path: str) -> None:
+    """
+    Crea (o reutiliza, si ya tiene el tamaño pedido) los archivos de entrada de un
+    escenario dentro de `workdir`, en las rutas relativas que usa el pipeline.
+    Borra las cachés y la bitácora de corridas para que cada corrida empiece en frío.
+    """
+    marker = os.path.join(workdir, 'dataset.txt')
+    signature = f"{n_users},{history_years}"
+    if not os.path.exists(marker) or open(marker).read() != signature:
+        write_users_csv(os.path.join(workdir, users_path), n_users)
+        write_historical_csv(os.path.join(workdir, historical_path), history_years)
+        with open(marker, 'w') as f:
+            f.write(signature)
+
+    for state_dir in ('cache', 'state'):
+        cache_dir = os.path.join(workdir, 'data', state_dir)
+        if os.path.isdir(cache_dir):
+            for root, _, files in os.walk(cache_dir, topdown=False):
+                for name in files:
+                    os.remove(os.path.join(root, name))
@@ -0,0 +1,225 @@
+# benchmarks/standins.py
+"""
+Servicios locales que reemplazan a los proveedores externos en los benchmarks:
+
+- FakeProviderServer: servidor HTTP con las rutas de OpenWeather (/data/2.5/forecast)
+  y Open-Meteo (/v1/forecast, incluida la consulta multi-ubicación), con latencia y
+  tasa de errores configurables.
+- SMTPSink: servidor SMTP mínimo (sin TLS ni login) que acepta y descarta correos.
+- StubGenaiClient: cliente con la misma interfaz que google.genai.Client
+  (client.models.generate_content) que responde con narrativas fijas.
+"""
+import datetime as dt
+import json
+import math
+import random
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+
+# =======================================================================
+# PROVEEDORES DE PRONÓSTICO (HTTP)
+# =======================================================================
+
+def _synthetic_weather(lat: float, lon: float, when: dt.datetime):
+    """Temperatura y humedad deterministas por ubicación y hora (ciclo diario)."""
+    offset = ((round(lat * 10) + round(lon * 10)) % 7) * 0.5
+    temp = 27.0 + offset + 5.0 * math.sin((when.hour - 9) / 24 * 2 * math.pi)
+    humidity = 75.0 + 10.0 * math.cos(when.hour / 24 * 2 * math.pi)
+    return round(temp, 1), round(humidity)
+
+
+def openweather_payload(lat: float, lon: float) -> dict:
+    now = dt.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    items = []
+    for step in range(16):
+        when = now + dt.timedelta(hours=3 * step)
+        temp, humidity = _synthetic_weather(lat, lon, when)
+        items.append({'dt_txt': when.strftime('%Y-%m-%d %H:%M:%S'), 'main': {'temp': temp, 'humidity': humidity}})
+    return {'cod': '200', 'city': {'name': 'Benchmark', 'coord': {'lat': lat, 'lon': lon}}, 'list': items}
+
+
+def openmeteo_block(lat: float, lon: float) -> dict:
+    now = dt.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    times, temps, hums = [], [], []
+    for step in range(48):
+        when = now + dt.timedelta(hours=step)
+        temp, humidity = _synthetic_weather(lat, lon, when)
+        times.append(when.strftime('%Y-%m-%dT%H:%M'))
+        temps.append(temp)
+        hums.append(humidity)
+    return {'latitude': lat, 'longitude': lon,
+            'hourly': {'time': times, 'temperature_2m': temps, 'relative_humidity_2m': hums}}
+
+
+class _ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with server.lock:
+            server.requests[url.path] = server.requests.get(url.path, 0) + 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            return self._reply(500, {'cod': 500, 'message': 'error simulado'})
+
+        if url.path == '/data/2.5/forecast':
+            return self._reply(200, openweather_payload(float(query['lat']), float(query['lon'])))
+        if url.path == '/v1/forecast':
+            lats = [float(v) for v in query['latitude'].split(',')]
+            lons = [float(v) for v in query['longitude'].split(',')]
+            blocks = [openmeteo_block(lat, lon) for lat, lon in zip(lats, lons)]
+            return self._reply(200, blocks[0] if len(blocks) == 1 else blocks)
+        return self._reply(404, {'error': True, 'reason': 'ruta desconocida'})
+
+
+class FakeProviderServer:
+    """Servidor HTTP local (hilo propio) que emula OpenWeather y Open-Meteo."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _ProviderHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.requests = {}
+        self.httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def requests(self) -> dict:
+        return dict(self.httpd.requests)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# =======================================================================
+# SERVIDOR SMTP DE DESCARTE
+# =======================================================================
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def _send(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self._send("220 sumidero SMTP de benchmark")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._send("250 sumidero")
+            elif command == 'DATA':
+                self._send("354 fin con <CRLF>.<CRLF>")
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                with self.server.lock:
+                    self.server.received += 1
+                    self.server.bytes += size
+                self._send("250 OK")
+            elif command == 'QUIT':
+                self._send("221 adiós")
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP...
+                self._send("250 OK")
+
+
+class SMTPSink:
+    """Servidor SMTP local que acepta todos los mensajes y solo los cuenta."""
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.received = 0
+        self.server.bytes = 0
+        self.server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def received(self) -> int:
+        return self.server.received
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# =======================================================================
+# CLIENTE DE GEMINI SIMULADO
+# =======================================================================
+
+class _StubModels:
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        ids = re.findall(r"--- ID: (\S+) ---", contents)
+        if ids:
+            # Modo por lotes: arreglo JSON con un objeto por granja
+            text = json.dumps([
+                {'id': item_id, 'asunto': f"Alerta ITH para [[FINCA]] ({item_id})",
+                 'cuerpo': "<p>I. Resumen del riesgo en [[FINCA]].</p><p>II. HOY: <b>13:00–17:00</b>.</p>"}
+                for item_id in ids
+            ])
+        else:
+            text = ("1. ASUNTO: Alerta ITH para [[FINCA]]\n"
+                    "2. CUERPO: <p>I. Resumen del riesgo en [[FINCA]].</p><p>II. HOY: <b>13:00–17:00</b>.</p>")
+        usage = SimpleNamespace(prompt_token_count=len(contents) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class StubGenaiClient:
+    """Misma interfaz que google.genai.Client para lo que usa ia_narrative."""
+
+    def __init__(self, latency: float = 0.0):
+        self.models = _StubModels(latency)
@@ -0,0 +1,138 @@
+# src/alert_state.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from constants import (
+    ALERT_STATE_ENABLED,
+    ALERT_STATE_PATH,
+    ALERT_STATE_ITH_BUCKET,
+    ALERT_HEARTBEAT_HOURS
+)
+
+# =======================================================================
+# ESTADO DE ALERTAS POR FINCA (ALERTAS INCREMENTALES)
+# =======================================================================
+# Guarda la firma del perfil de riesgo con la que se alertó por última vez a cada
+# finca. Una corrida calcula las firmas nuevas en bloque (analyze.risk_profile_signatures
+# por celda + farm_signatures por finca) y solo narra y envía a las fincas cuya firma
+# cambió o cuyo último envío es más viejo que el intervalo de latido.
+
+# Claves por consulta `IN (...)` (SQLite admite 999 parámetros en versiones viejas)
+_QUERY_CHUNK = 900
+
+
+def to_stored_signature(signature) -> Optional[int]:
+    """Firma uint64 como INTEGER con signo de SQLite (misma representación en bits)."""
+    return None if signature is None else int(np.uint64(signature).view(np.int64))
+
+
+def from_stored_signature(signature: Optional[int]) -> Optional[int]:
+    return None if signature is None else int(np.int64(signature).view(np.uint64))
+
+
+def farm_signatures(cell_signatures: np.ndarray, product_types: Iterable[str], ith_threshold,
+                    ith_bucket: float = ALERT_STATE_ITH_BUCKET) -> np.ndarray:
+    """
+    Firma (uint64) de cada finca: la firma de su celda combinada con el tipo de
+    producción (normalizado) y el umbral histórico por intervalos, que también
+    cambian el contenido de la alerta. `ith_threshold` es un único umbral o uno
+    por finca (línea base de su celda).
+    """
+    product_types = pd.Series(list(product_types), dtype=object).astype(str).str.lower().str.split().str.join(" ")
+    profile = pd.DataFrame({
+        'cell': np.asarray(cell_signatures, dtype=np.uint64),
+        'product_type': product_types.to_numpy(),
+        'threshold_bucket': np.broadcast_to(
+            np.floor(np.asarray(ith_threshold, dtype=np.float64) / ith_bucket).astype(np.int64), len(product_types)),
+    })
+    return pd.util.hash_pandas_object(profile, index=False).to_numpy()
+
+
+class AlertStateStore:
+    """
+    Última firma enviada y momento del envío por finca, en SQLite (modo WAL).
+    Las firmas uint64 se guardan como INTEGER con signo (misma representación en bits).
+    Es segura para usarse desde varios hilos (una conexión protegida por un lock).
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS farm_alerts ("
+            " farm_key TEXT PRIMARY KEY, signature INTEGER NOT NULL, sent_at REAL NOT NULL)"
+        )
+
+    def needs_alert(self, farm_keys: Iterable[str], signatures: np.ndarray,
+                    heartbeat_hours: float = ALERT_HEARTBEAT_HOURS, now: Optional[float] = None) -> np.ndarray:
+        """
+        Máscara booleana (vectorizada) de las fincas a alertar: sin envío previo,
+        con la firma cambiada o con el último envío fuera del intervalo de latido.
+        """
+        farm_keys = list(farm_keys)
+        if heartbeat_hours <= 0:
+            return np.ones(len(farm_keys), dtype=bool)
+        # Solo se leen las fincas del lote, en consultas de a lo sumo
+        # _QUERY_CHUNK claves (límite de parámetros de SQLite)
+        rows = []
+        with self._lock:
+            for start in range(0, len(farm_keys), _QUERY_CHUNK):
+                chunk = farm_keys[start:start + _QUERY_CHUNK]
+                rows += self._conn.execute(
+                    "SELECT farm_key, signature, sent_at FROM farm_alerts"
+                    f" WHERE farm_key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        if not rows:
+            return np.ones(len(farm_keys), dtype=bool)
+        stored_keys, stored_signatures, stored_sent_at = zip(*rows)
+        # Posición de cada finca en lo guardado (-1 = nunca se le envió)
+        positions = pd.Index(stored_keys).get_indexer(farm_keys)
+        found = positions >= 0
+        stored_signatures = np.asarray(stored_signatures, dtype=np.int64)[positions]
+        stored_sent_at = np.asarray(stored_sent_at, dtype=np.float64)[positions]
+        now = time.time() if now is None else now
+        unchanged = found & (stored_signatures == np.asarray(signatures, dtype=np.uint64).view(np.int64)) & \
+                    (now - stored_sent_at < heartbeat_hours * 3600)
+        return ~unchanged
+
+    def record_sent(self, sent: Iterable[Tuple[str, int]], sent_at: Optional[float] = None) -> int:
+        """Registra (finca, firma uint64) como la última alerta enviada, en una sola transacción."""
+        sent_at = time.time() if sent_at is None else sent_at
+        rows = [(key, to_stored_signature(signature), sent_at) for key, signature in sent]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO farm_alerts (farm_key, signature, sent_at) VALUES (?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_alert_state() -> Optional[AlertStateStore]:
+    """
+    Abre el estado de alertas. Si está desactivado o no se puede abrir devuelve
+    None y se alerta a todas las fincas, como antes.
+    """
+    if not ALERT_STATE_ENABLED:
+        return None
+    try:
+        return AlertStateStore(ALERT_STATE_PATH)
+    except Exception as e:
+        print(f"  --- ADVERTENCIA: No se pudo abrir el estado de alertas ({e}). Se alertará a todas las fincas.")
+        return None
@@ -1,7 +1,13 @@
 # src/analyze.py
 import pandas as pd
 import numpy as np
-from typing import Tuple, Optional
+import warnings
+from datetime import datetime
+from typing import Dict, Hashable, Tuple, Optional, Union
+
+from constants import RISK_BANDS, RISK_LEVEL_LABELS, ALERT_STATE_ITH_BUCKET
+from forecast_block import ForecastBlock, as_forecast_block
+from transform import ith_from_arrays
 
 # --- 1. FUNCIÓN DE CÁLCULO DE UMBRAL (LOGICA DE NEGOCIO) ---
 
@@ -28,30 +34,369 @@ def calculate_historical_threshold(df_historical: pd.DataFrame, ith_col: str = '
     return threshold
 
 
+# --- 1.1 TABLA DE UMBRALES POR MES Y HORA DEL DÍA ---
+
+def build_threshold_table(df_historical: pd.DataFrame, ith_col: str = 'ITH', quantile: float = 0.75) -> Optional[np.ndarray]:
+    """
+    Precalcula una tabla densa (12 meses x 24 horas) con el P75 histórico del ITH
+    para cada mes y hora del día, con un único groupby vectorizado.
+
+    Las celdas sin datos históricos toman el P75 global. Las horas se interpretan
+    en el mismo huso que el eje de tiempo del histórico (UTC en Open-Meteo por defecto).
+    """
+    if df_historical.empty or ith_col not in df_historical.columns:
+        print("Advertencia: Histórico vacío o ITH faltante. Tabla de umbrales no calculada.")
+        return None
+
+    ith = pd.to_numeric(df_historical[ith_col], errors='coerce')
+    times = pd.to_datetime(df_historical['time'])
+    by_slot = ith.groupby([times.dt.month, times.dt.hour]).quantile(quantile).dropna()
+
+    table = np.full((12, 24), ith.quantile(quantile), dtype=np.float64)
+    months = by_slot.index.get_level_values(0).to_numpy(dtype=np.int64)
+    hours = by_slot.index.get_level_values(1).to_numpy(dtype=np.int64)
+    table[months - 1, hours] = by_slot.to_numpy()
+    return table
+
+
+def build_threshold_tables(ith: np.ndarray, times: np.ndarray, quantile: float = 0.75) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Versión matricial de calculate_historical_threshold + build_threshold_table para
+    varias series sobre el mismo eje horario (almacén climático por celda).
+    `ith` es (celdas x horas) o una sola serie, con NaN en las horas sin dato; puede
+    ser una vista de un arreglo mapeado en memoria (solo se leen esas filas).
+
+    Devuelve el P75 global de cada celda (k,) y su tabla mes x hora (k, 12, 24);
+    los slots sin datos toman el P75 global de la celda (NaN si la celda no tiene datos).
+    """
+    ith = np.atleast_2d(ith)
+    month_index, hour_of_day = month_hour_index(times)
+    slots = month_index * 24 + hour_of_day
+    # Columnas de cada slot (mes, hora) agrupadas con un solo argsort del eje
+    order = np.argsort(slots, kind='stable')
+    bounds = np.searchsorted(slots[order], np.arange(12 * 24 + 1))
+
+    tables = np.full((len(ith), 12 * 24), np.nan, dtype=np.float64)
+    with warnings.catch_warnings():
+        # Celdas o slots sin ningún dato: nanquantile avisa y devuelve NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        overall = np.nanquantile(ith, quantile, axis=1).astype(np.float64)
+        for slot in np.flatnonzero(np.diff(bounds)):
+            columns = order[bounds[slot]:bounds[slot + 1]]
+            tables[:, slot] = np.nanquantile(ith[:, columns], quantile, axis=1)
+    tables = np.where(np.isnan(tables), overall[:, None], tables)
+    return overall, tables.reshape(len(ith), 12, 24)
+
+
+def month_hour_index(times: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Índices (mes 0-11, hora 0-23) de cada instante, calculados con aritmética de
+    datetime64 (sin accesores .dt ni trabajo por fila).
+    """
+    hours_since_epoch = np.asarray(times).astype('datetime64[h]')
+    hour_of_day = hours_since_epoch.astype(np.int64) % 24
+    month_index = hours_since_epoch.astype('datetime64[M]').astype(np.int64) % 12
+    return month_index, hour_of_day
+
+
+def lookup_thresholds(threshold_table: np.ndarray, times: pd.Series) -> np.ndarray:
+    """
+    Umbral correspondiente a cada instante del pronóstico: un solo indexado
+    'fancy' de NumPy sobre la tabla mes x hora (sin trabajo por fila en Python).
+    """
+    month_index, hour_of_day = month_hour_index(times)
+    return threshold_table[month_index, hour_of_day]
+
+
 # --- 2. FUNCIÓN DE ETIQUETADO DE RIESGO ---
+# El riesgo se guarda como código entero (uint8) y la etiqueta de texto solo se
+# genera al mostrarlo (prompts, logs, correos) con risk_labels().
+
+RISK_NO_DATA = 0
+RISK_LOW = 1
+RISK_MODERATE = 2
+RISK_HIGH = 3
+
+_RISK_BANDS = np.asarray(RISK_BANDS, dtype=np.float64)
+_RISK_LABELS = np.asarray(RISK_LEVEL_LABELS, dtype=object)
 
-def assign_risk_category(df_forecast: pd.DataFrame, threshold: float, ith_col: str = 'ITH') -> pd.DataFrame:
+
+def risk_labels(codes) -> np.ndarray:
+    """Etiquetas de texto de los códigos de riesgo (solo para presentación)."""
+    return _RISK_LABELS[np.asarray(codes, dtype=np.intp)]
+
+
+def assign_risk_category(df_forecast: pd.DataFrame, threshold: float, ith_col: str = 'ITH',
+                         threshold_table: Optional[np.ndarray] = None) -> pd.DataFrame:
     """
-    Asigna una categoría de riesgo al DataFrame de pronóstico basada en el umbral histórico.
+    Asigna el código de riesgo (columna 'risk', uint8) de cada hora del pronóstico.
+
+    Regla de negocio: el nivel base sale de las bandas RISK_BANDS (un solo
+    np.searchsorted; cada banda incluye su borde inferior, p. ej. ITH 75.0 ya es
+    de la banda 75-79) y, si el ITH supera el umbral histórico (P75), el riesgo es
+    al menos ALTO. Si se entrega
+    `threshold_table` (mes x hora), cada hora se compara con su propio P75 histórico
+    en lugar del P75 global. Las horas sin ITH quedan en SIN DATOS.
     """
     if threshold is None or df_forecast.empty:
-        df_forecast['risk'] = 'SIN DATOS'
+        df_forecast['risk'] = np.full(len(df_forecast), RISK_NO_DATA, dtype=np.uint8)
         return df_forecast
-    
-    # Definición del riesgo basada en la lógica de negocio:
-    # Si el ITH supera el umbral (P75 histórico), el riesgo es ALTO.
-    df_forecast['risk'] = np.where(
-        df_forecast[ith_col] > threshold,
-        'RIESGO ALTO 🟥',
-        'RIESGO MODERADO 🟨'
+
+    ith = pd.to_numeric(df_forecast[ith_col], errors='coerce').to_numpy(dtype=np.float64)
+    df_forecast['risk'] = risk_codes(ith, threshold, df_forecast['time'], threshold_table)
+    return df_forecast
+
+
+def risk_codes(ith: np.ndarray, threshold: float, times=None,
+               threshold_table: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Misma regla que assign_risk_category sobre arreglos de NumPy (ITH y, si hay
+    `threshold_table`, el eje de tiempo). Devuelve los códigos como uint8.
+    """
+    ith = np.asarray(ith, dtype=np.float64)
+    if threshold is None:
+        return np.full(len(ith), RISK_NO_DATA, dtype=np.uint8)
+    if threshold_table is not None:
+        threshold = lookup_thresholds(threshold_table, times)
+
+    codes = np.searchsorted(_RISK_BANDS, ith, side='right') + RISK_LOW
+    codes = np.maximum(codes, np.where(ith > threshold, RISK_HIGH, RISK_LOW))
+    codes[np.isnan(ith)] = RISK_NO_DATA
+    return codes.astype(np.uint8)
+
+# --- 2.1 EPISODIOS DE RIESGO (CODIFICACIÓN POR TRAMOS) ---
+
+def encode_risk_episodes(forecast: Union[ForecastBlock, pd.DataFrame], risk_col: str = 'risk',
+                         ith_col: str = 'ITH') -> pd.DataFrame:
+    """
+    Agrupa las horas consecutivas con el mismo nivel de riesgo en episodios
+    (codificación run-length vectorizada con np.diff/cumsum sobre los códigos del
+    riesgo). Acepta un ForecastBlock analizado o un DataFrame, ordenados por tiempo.
+
+    Devuelve una fila por episodio: 'start', 'end' (primera y última hora),
+    'hours' (registros del tramo), 'level' (código de riesgo) y 'peak_ith'.
+    """
+    if forecast.empty:
+        return pd.DataFrame(columns=['start', 'end', 'hours', 'level', 'peak_ith'])
+
+    if isinstance(forecast, ForecastBlock):
+        codes = forecast.risk
+        times = pd.Series(pd.DatetimeIndex(forecast.datetimes()))
+        ith = forecast.ith.astype(np.float64)
+    else:
+        codes = forecast[risk_col].to_numpy(dtype=np.uint8)
+        # Se conserva la zona horaria del eje de tiempo (to_numpy la perdería)
+        times = forecast['time'].reset_index(drop=True)
+        ith = pd.to_numeric(forecast[ith_col], errors='coerce').to_numpy(dtype=np.float64)
+
+    # Un episodio nuevo empieza donde cambia el código del riesgo
+    change = np.empty(len(codes), dtype=bool)
+    change[0] = True
+    np.not_equal(np.diff(codes), 0, out=change[1:])
+    episode_id = np.cumsum(change) - 1
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], len(codes)) - 1
+
+    return pd.DataFrame({
+        'start': times.iloc[starts].to_numpy(dtype=object),
+        'end': times.iloc[ends].to_numpy(dtype=object),
+        'hours': np.bincount(episode_id),
+        'level': codes[starts],
+        # fmax ignora los NaN del ITH dentro del tramo
+        'peak_ith': np.fmax.reduceat(ith, starts),
+    })
+
+
+def describe_risk_episodes(episodes: pd.DataFrame, separator: str = "\n", time_format: str = '%H:%M') -> str:
+    """
+    Texto compacto de los episodios (para prompts, el cuerpo sin IA y los logs):
+    una línea por tramo en lugar de una por hora.
+    """
+    return separator.join(
+        f"{start.strftime(time_format)}–{end.strftime(time_format)} "
+        f"({hours} registros, ITH máx: {peak:.1f}, {level})"
+        for start, end, hours, level, peak in zip(episodes['start'], episodes['end'], episodes['hours'],
+                                                   risk_labels(episodes['level']), episodes['peak_ith'])
     )
-    
-    # Lógica de negocio adicional: si el ITH es > 70 (estrés leve para la ganadería),
-    # el riesgo siempre debe ser al menos MODERADO.
-    df_forecast['risk'] = np.where(
-        (df_forecast[ith_col] > 70) & (df_forecast['risk'] == 'RIESGO MODERADO 🟨'),
-        'RIESGO MODERADO 🟨',
-        df_forecast['risk']
+
+
+# --- 3. ANÁLISIS VECTORIZADO DE TODAS LAS UBICACIONES ---
+
+def analyze_forecasts_batch(forecasts: Dict[Hashable, Union[ForecastBlock, pd.DataFrame]], threshold: float,
+                            threshold_table: Optional[np.ndarray] = None, ith_col: str = 'ITH',
+                            baselines: Optional[Dict[Hashable, Tuple[float, Optional[np.ndarray]]]] = None
+                            ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Modo por lotes: concatena los arreglos de todos los pronósticos (ForecastBlock
+    o DataFrames estándar) y calcula ITH, riesgo y el resumen por ubicación en una
+    sola pasada vectorizada de NumPy (sin overhead de pandas por finca).
+
+    `baselines` ({clave: (P75, tabla mes x hora o None)}, del almacén climático por
+    celda) reemplaza el umbral global en las ubicaciones que tienen línea base propia.
+
+    Devuelve:
+      - df_long: filas de todas las ubicaciones ('location_id', 'time', ...),
+        ordenadas por 'location_id' (float32 para las medidas, uint8 para el riesgo).
+      - df_summary: una fila por 'location_id' con 'location_key' (la clave de
+        `forecasts`), 'max_ith', 'high_hours', 'moderate_hours' e 'ith_threshold'
+        (el P75 con que se evaluó la ubicación).
+    """
+    blocks = {key: as_forecast_block(forecast) for key, forecast in forecasts.items()
+              if forecast is not None and not forecast.empty}
+    if not blocks:
+        return pd.DataFrame(), pd.DataFrame(columns=['location_key', 'max_ith', 'high_hours', 'moderate_hours',
+                                                     'ith_threshold'])
+
+    keys = list(blocks)
+    lengths = np.array([len(blocks[key]) for key in keys])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    times = np.concatenate([blocks[key].epoch for key in keys]).view('datetime64[s]')
+    temperature = np.concatenate([blocks[key].temperature for key in keys]).astype(np.float32, copy=False)
+    humidity = np.concatenate([blocks[key].humidity for key in keys]).astype(np.float32, copy=False)
+
+    location_id = np.repeat(np.arange(len(keys)), lengths)
+
+    ith = ith_from_arrays(temperature, humidity)
+    p75, thresholds = _location_thresholds(keys, location_id, times, threshold, threshold_table, baselines)
+    risk = risk_codes(ith, thresholds)
+
+    df_long = pd.DataFrame({
+        'location_id': location_id,
+        'time': times,
+        'temperature_2m': temperature,
+        'relative_humidity_2m': humidity,
+        ith_col: ith,
+        'risk': risk,
+    })
+
+    # Resumen por ubicación con reduceat sobre los tramos contiguos (sin groupby)
+    df_summary = pd.DataFrame({
+        'location_key': keys,
+        'max_ith': np.fmax.reduceat(ith.astype(np.float64), starts),
+        'high_hours': np.add.reduceat((risk >= RISK_HIGH).astype(np.int64), starts),
+        'moderate_hours': np.add.reduceat((risk == RISK_MODERATE).astype(np.int64), starts),
+        'ith_threshold': p75,
+    }, index=pd.RangeIndex(len(keys), name='location_id'))
+    return df_long, df_summary
+
+
+def _location_thresholds(keys: list, location_id: np.ndarray, times: np.ndarray, threshold: Optional[float],
+                         threshold_table: Optional[np.ndarray],
+                         baselines: Optional[Dict[Hashable, Tuple[float, Optional[np.ndarray]]]]):
+    """
+    P75 de cada ubicación y umbral de cada fila del DataFrame largo: el global (o su
+    tabla mes x hora) salvo en las ubicaciones con línea base propia en `baselines`.
+    """
+    p75 = np.full(len(keys), np.nan if threshold is None else threshold, dtype=np.float64)
+    if threshold is None:
+        return p75, None
+    thresholds = threshold if threshold_table is None else lookup_thresholds(threshold_table, times)
+    local = [(position, baselines[key]) for position, key in enumerate(keys) if baselines and key in baselines]
+    if not local:
+        return p75, thresholds
+
+    # Una tabla mes x hora por ubicación y un solo indexado 'fancy' para todas las filas
+    tables = np.empty((len(keys), 12, 24), dtype=np.float64)
+    tables[:] = threshold_table if threshold_table is not None else threshold
+    for position, (cell_p75, cell_table) in local:
+        p75[position] = cell_p75
+        tables[position] = cell_table if cell_table is not None else cell_p75
+    month_index, hour_of_day = month_hour_index(times)
+    return p75, tables[location_id, month_index, hour_of_day]
+
+
+def split_by_location(df_long: pd.DataFrame, ith_col: str = 'ITH') -> Dict[int, ForecastBlock]:
+    """
+    Corta el DataFrame largo en un ForecastBlock por 'location_id' usando los
+    desplazamientos de cada bloque (el DataFrame viene ordenado por ubicación).
+    Los bloques son vistas sobre las columnas de df_long: no se copian datos.
+    """
+    if df_long.empty:
+        return {}
+    location_ids = df_long['location_id'].to_numpy()
+    unique_ids, starts = np.unique(location_ids, return_index=True)
+    ends = np.append(starts[1:], len(df_long))
+    analyzed = ForecastBlock(
+        df_long['time'].to_numpy(dtype='datetime64[s]').view(np.int64),
+        df_long['temperature_2m'].to_numpy(dtype=np.float32),
+        df_long['relative_humidity_2m'].to_numpy(dtype=np.float32),
+        df_long[ith_col].to_numpy(dtype=np.float32),
+        df_long['risk'].to_numpy(dtype=np.uint8),
     )
-    
-    return df_forecast
\ No newline at end of file
+    return {int(location_id): analyzed.take(slice(start, end))
+            for location_id, start, end in zip(unique_ids, starts, ends)}
+
+
+# --- 4. FIRMA DEL PERFIL DE RIESGO (ALERTAS INCREMENTALES) ---
+
+def risk_profile_signatures(df_long: pd.DataFrame, ith_bucket: float = ALERT_STATE_ITH_BUCKET,
+                            now: Optional[pd.Timestamp] = None, ith_col: str = 'ITH') -> pd.Series:
+    """
+    Firma (uint64) del panorama de riesgo de cada 'location_id' para decidir si
+    hace falta volver a alertar. Cubre lo mismo que el correo (hoy y mañana) y no
+    debe cambiar solo porque avanza el reloj entre dos corridas del mismo día:
+      - hoy (desde la hora actual): nivel máximo, ITH máximo por intervalos de
+        `ith_bucket` puntos y última hora con riesgo MODERADO o superior;
+      - mañana (completo): los episodios MODERADO o superior (inicio, fin y nivel)
+        y el ITH máximo por intervalos;
+      - la fecha.
+    Todo se calcula en una pasada vectorizada sobre el DataFrame largo.
+    """
+    if df_long.empty:
+        return pd.Series(dtype=np.uint64)
+    now = (pd.Timestamp(datetime.now()) if now is None else now).floor('h')
+    times = df_long['time']
+    if times.dt.tz is not None:
+        # Se compara en hora local de pared, igual que el resto del pipeline
+        times = times.dt.tz_localize(None)
+    tomorrow = now.normalize() + pd.Timedelta(days=1)
+    location_ids = np.unique(df_long['location_id'].to_numpy())
+
+    hours = times.to_numpy(dtype='datetime64[h]').astype(np.int64)
+    codes = df_long['risk'].to_numpy(dtype=np.uint8)
+    ith = pd.to_numeric(df_long[ith_col], errors='coerce').to_numpy(dtype=np.float64)
+    locations = df_long['location_id'].to_numpy()
+    is_today = ((times >= now) & (times < tomorrow)).to_numpy()
+    is_tomorrow = ((times >= tomorrow) & (times < tomorrow + pd.Timedelta(days=1))).to_numpy()
+
+    def per_location(values: np.ndarray, mask: np.ndarray, how: str) -> np.ndarray:
+        # Agregado por ubicación (-1 donde la ubicación no tiene filas en la máscara)
+        result = pd.Series(values[mask]).groupby(locations[mask]).agg(how)
+        return result.reindex(location_ids).fillna(-1).to_numpy(dtype=np.int64)
+
+    def bucket(values: np.ndarray) -> np.ndarray:
+        return np.where(np.isnan(values), -1, np.floor(values / ith_bucket))
+
+    critical = codes >= RISK_MODERATE
+
+    # Mañana: episodios críticos (run-length por ubicación), combinados con XOR
+    tomorrow_rows = np.flatnonzero(is_tomorrow)
+    episodes_hash = np.zeros(len(location_ids), dtype=np.uint64)
+    if len(tomorrow_rows):
+        row_codes = codes[tomorrow_rows]
+        row_locations = locations[tomorrow_rows]
+        change = np.empty(len(tomorrow_rows), dtype=bool)
+        change[0] = True
+        change[1:] = (np.diff(row_codes) != 0) | (np.diff(row_locations) != 0)
+        starts = np.flatnonzero(change)
+        ends = np.append(starts[1:], len(tomorrow_rows)) - 1
+        keep = row_codes[starts] >= RISK_MODERATE
+        episodes = pd.DataFrame({
+            'start': hours[tomorrow_rows][starts][keep],
+            'end': hours[tomorrow_rows][ends][keep],
+            'level': row_codes[starts][keep].astype(np.int64),
+        })
+        if len(episodes):
+            episode_hashes = pd.util.hash_pandas_object(episodes, index=False).to_numpy()
+            groups, group_starts = np.unique(row_locations[starts][keep], return_index=True)
+            episodes_hash[np.searchsorted(location_ids, groups)] = np.bitwise_xor.reduceat(episode_hashes, group_starts)
+
+    profile = pd.DataFrame({
+        'today_level': per_location(codes.astype(np.int64), is_today, 'max'),
+        'today_peak': per_location(bucket(ith), is_today, 'max'),
+        'today_last_critical': per_location(hours, is_today & critical, 'max'),
+        'tomorrow_episodes': episodes_hash,
+        'tomorrow_peak': per_location(bucket(ith), is_tomorrow, 'max'),
+        'date': np.full(len(location_ids), now.toordinal(), dtype=np.int64),
+    })
+    return pd.Series(pd.util.hash_pandas_object(profile, index=False).to_numpy(), index=location_ids)
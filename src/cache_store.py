@@ -0,0 +1,115 @@
+# src/cache_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+# =======================================================================
+# CACHÉ PERSISTENTE EN SQLITE (TTL + LRU POR TAMAÑO)
+# =======================================================================
+
+class SQLiteTTLCache:
+    """
+    Caché clave -> bytes persistida en un archivo SQLite.
+
+    - Cada entrada tiene su propio vencimiento (TTL); una entrada vencida cuenta como fallo.
+    - El tamaño total está acotado por `max_bytes`: al superarlo se eliminan las
+      entradas menos usadas recientemente (LRU por 'last_access'). El total se lleva
+      en memoria (se lee al abrir y se ajusta en cada alta, reemplazo y borrado), así
+      que set() no recorre la tabla.
+    - Lleva contadores de aciertos/fallos para el reporte de la ejecución.
+    Es segura para usarse desde varios hilos (una conexión protegida por un lock).
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._total_bytes = self._stored_bytes()
+        self.purge_expired()
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._total_bytes -= row[2]
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def contains(self, key: str) -> bool:
+        """Indica si hay una entrada vigente, sin afectar contadores ni el orden LRU."""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now)
+            )
+            self._total_bytes += len(value) - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def get_json(self, key: str) -> Optional[object]:
+        value = self.get(key)
+        return json.loads(zlib.decompress(value)) if value is not None else None
+
+    def set_json(self, key: str, data: object, ttl: float) -> None:
+        payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        self.set(key, zlib.compress(payload), ttl)
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            freed = self._conn.execute("DELETE FROM entries WHERE expires_at <= ? RETURNING size", (time.time(),)).fetchall()
+            self._total_bytes -= sum(size for size, in freed)
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self) -> None:
+        # Se llama con el lock tomado, cuando el total en memoria supera el límite.
+        # Se recalcula desde la tabla (otro proceso puede compartir el archivo).
+        self._total_bytes = self._stored_bytes()
+        if self._total_bytes <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if self._total_bytes - freed <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self._total_bytes -= freed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
@@ -0,0 +1,314 @@
+# src/climate_store.py
+"""
+Almacén del histórico climático por celda de la grilla.
+
+Uso (desde la raíz del repositorio):
+    python src/climate_store.py ingest manifiesto.csv               # construye el almacén
+    python src/climate_store.py ingest manifiesto.csv --start 1995-01-01 --end 2024-12-31
+    python src/climate_store.py info
+
+El manifiesto es un CSV con las columnas 'latitude', 'longitude' y 'file': cada
+fila apunta a un histórico horario con el mismo formato que
+DATA_FILE_PATH_HISTORICAL (rutas relativas al manifiesto).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analyze import build_threshold_tables
+from constants import (
+    CLIMATE_STORE_ENABLED,
+    CLIMATE_STORE_DIR,
+    CLIMATE_STORE_INGEST_BLOCK_CELLS,
+    GRID_RESOLUTION_DEG,
+    HISTORICAL_STREAMING_CHUNK_ROWS
+)
+from extract import iter_historical_chunks
+from transform import ith_from_arrays, snap_to_grid
+
+# =======================================================================
+# ALMACÉN CLIMÁTICO POR CELDA (MAPEADO EN MEMORIA)
+# =======================================================================
+# Un solo eje horario fijo para todas las celdas y, por celda, una fila float32 con
+# el ITH de cada hora (NaN donde no hay dato). Los archivos son .npy y se abren con
+# mmap_mode='r': leer el histórico de una celda es un corte de una fila (sin copiar
+# y sin cargar el resto del almacén), y el sistema operativo comparte las páginas
+# entre procesos.
+#   - ith.npy: matriz (celdas x horas) float32.
+#   - thresholds.npy: por celda, el P75 global y la tabla mes x hora (1 + 288) float64,
+#     precalculados en la ingesta con analyze.build_threshold_tables.
+#   - index.json: versión, resolución de la grilla, eje horario y coordenadas de cada fila.
+# Cada ingesta escribe una generación completa en su propio subdirectorio y al final
+# reemplaza (os.replace, atómico) el archivo CURRENT que la nombra: un lector nunca ve
+# archivos de dos generaciones mezclados, aunque la ingesta muera a mitad de camino.
+
+STORE_VERSION = 1
+_ITH_FILE = 'ith.npy'
+_THRESHOLDS_FILE = 'thresholds.npy'
+_INDEX_FILE = 'index.json'
+_CURRENT_FILE = 'CURRENT'
+_GENERATION_PREFIX = 'gen-'
+
+
+def _cell_key(lat: float, lon: float, resolution: float) -> Tuple[float, float]:
+    return snap_to_grid(float(lat), float(lon), resolution)
+
+
+class ClimateStore:
+    """
+    Lectura del almacén (solo lectura, segura entre hilos). Las celdas se buscan
+    por coordenada, ajustada a la resolución con la que se construyó el almacén.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, _INDEX_FILE), encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != STORE_VERSION:
+            raise ValueError(f"versión {index.get('version')} del almacén no soportada")
+        self.directory = directory
+        self.resolution = float(index['resolution'])
+        self.start = np.datetime64(index['start'], 'h')
+        self.hours = int(index['hours'])
+        self.cells = [tuple(cell) for cell in index['cells']]
+        self._rows = {cell: row for row, cell in enumerate(self.cells)}
+        self.ith = np.load(os.path.join(directory, _ITH_FILE), mmap_mode='r')
+        self.thresholds = np.load(os.path.join(directory, _THRESHOLDS_FILE), mmap_mode='r')
+        if self.ith.shape != (len(self.cells), self.hours) or len(self.thresholds) != len(self.cells):
+            raise ValueError("los arreglos no coinciden con el índice")
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def time_axis(self) -> np.ndarray:
+        """Eje horario común (datetime64[h]) de todas las filas."""
+        return self.start + np.arange(self.hours)
+
+    def row_of(self, lat: float, lon: float) -> Optional[int]:
+        return self._rows.get(_cell_key(lat, lon, self.resolution))
+
+    def baselines(self, coords: Iterable[Tuple[float, float]],
+                  with_tables: bool = True) -> Dict[Hashable, Tuple[float, Optional[np.ndarray]]]:
+        """
+        {(lat, lon): (P75, tabla 12 x 24 o None)} de las coordenadas que tienen
+        línea base en el almacén. Solo se leen las filas de umbrales de esas celdas.
+        """
+        found = {}
+        for lat, lon in coords:
+            row = self.row_of(lat, lon)
+            if row is None:
+                continue
+            values = np.asarray(self.thresholds[row], dtype=np.float64)
+            if np.isnan(values[0]):
+                continue
+            found[(lat, lon)] = (float(values[0]), values[1:].reshape(12, 24) if with_tables else None)
+        return found
+
+
+def current_generation(directory: str) -> Optional[str]:
+    """
+    Directorio de la generación vigente del almacén (la que nombra CURRENT), o None si
+    no hay ninguna. Un almacén anterior a las generaciones (archivos sueltos en
+    `directory`) se sigue leyendo tal cual.
+    """
+    pointer = os.path.join(directory, _CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, encoding='utf-8') as f:
+            return os.path.join(directory, f.read().strip())
+    if os.path.exists(os.path.join(directory, _INDEX_FILE)):
+        return directory
+    return None
+
+
+def open_climate_store(directory: str = CLIMATE_STORE_DIR) -> Optional[ClimateStore]:
+    """
+    Abre el almacén si está activado y existe. Si no, devuelve None y todas las
+    fincas usan el umbral del histórico global.
+    """
+    if not CLIMATE_STORE_ENABLED:
+        return None
+    try:
+        generation = current_generation(directory)
+        if generation is None:
+            return None
+        return ClimateStore(generation)
+    except Exception as e:
+        print(f"  --- ADVERTENCIA: No se pudo abrir el almacén climático por celda ({e}). Se usa el umbral global.")
+        return None
+
+
+# =======================================================================
+# INGESTA (CSV HORARIOS -> ALMACÉN)
+# =======================================================================
+
+def _read_manifest(manifest_path: str, resolution: float) -> Dict[Tuple[float, float], list]:
+    """{celda: [archivos]} del manifiesto (varios archivos pueden caer en la misma celda)."""
+    manifest = pd.read_csv(manifest_path)
+    missing = {'latitude', 'longitude', 'file'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"faltan columnas en el manifiesto: {', '.join(sorted(missing))}")
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    cells: Dict[Tuple[float, float], list] = {}
+    for lat, lon, path in manifest[['latitude', 'longitude', 'file']].itertuples(index=False):
+        cells.setdefault(_cell_key(lat, lon, resolution), []).append(os.path.join(base_dir, path))
+    return cells
+
+
+def _time_bounds(files: Iterable[str]) -> Tuple[np.datetime64, np.datetime64]:
+    """Primera y última hora de los archivos (solo se lee la columna de tiempo)."""
+    first, last = None, None
+    for path in files:
+        column = pd.read_csv(path, usecols=lambda name: name.strip().lower() == 'time').iloc[:, 0]
+        times = pd.to_datetime(column, errors='coerce').dropna()
+        if times.empty:
+            continue
+        lo, hi = times.min().to_datetime64().astype('datetime64[h]'), times.max().to_datetime64().astype('datetime64[h]')
+        first = lo if first is None else min(first, lo)
+        last = hi if last is None else max(last, hi)
+    if first is None:
+        raise ValueError("ningún archivo del manifiesto tiene fechas válidas")
+    return first, last
+
+
+def _fill_row(row: np.ndarray, files: Iterable[str], start: np.datetime64) -> int:
+    """Escribe el ITH de los archivos de una celda en su fila. Devuelve las horas con dato."""
+    for path in files:
+        for chunk in iter_historical_chunks(path, HISTORICAL_STREAMING_CHUNK_ROWS):
+            hours = (chunk['time'].to_numpy(dtype='datetime64[h]') - start).astype(np.int64)
+            ith = ith_from_arrays(pd.to_numeric(chunk['temperature_2m'], errors='coerce').to_numpy(dtype=np.float64),
+                                  pd.to_numeric(chunk['relative_humidity_2m'], errors='coerce').to_numpy(dtype=np.float64))
+            keep = (hours >= 0) & (hours < len(row)) & ~np.isnan(ith)
+            row[hours[keep]] = ith[keep]
+    return int(np.count_nonzero(~np.isnan(row)))
+
+
+def _remove_old_generations(directory: str, current: str, previous: Optional[str]) -> None:
+    """
+    Borra las generaciones que ya no son la vigente ni la anterior (un proceso que
+    acaba de leer CURRENT todavía puede estar abriendo la anterior).
+    """
+    keep = {current, os.path.basename(previous)} if previous else {current}
+    for name in os.listdir(directory):
+        if name.startswith(_GENERATION_PREFIX) and name not in keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    # Archivos sueltos de un almacén sin generaciones, si ya no son ni el anterior
+    if previous != directory:
+        for name in (_ITH_FILE, _THRESHOLDS_FILE, _INDEX_FILE):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build_climate_store(manifest_path: str, directory: str = CLIMATE_STORE_DIR,
+                        resolution: float = GRID_RESOLUTION_DEG, start: Optional[str] = None,
+                        end: Optional[str] = None) -> ClimateStore:
+    """
+    Construye el almacén a partir del manifiesto: una pasada por archivo (por bloques,
+    memoria acotada) escribiendo directo en el .npy mapeado y, después, las tablas de
+    umbral de a CLIMATE_STORE_INGEST_BLOCK_CELLS celdas. Todo se escribe en un
+    subdirectorio de generación nuevo y CURRENT pasa a nombrarlo al final, así que
+    el almacén previo sigue siendo el vigente hasta que el nuevo está completo.
+    """
+    cells = _read_manifest(manifest_path, resolution)
+    if not cells:
+        raise ValueError("el manifiesto no tiene filas")
+    if start is None or end is None:
+        first, last = _time_bounds(path for files in cells.values() for path in files)
+    first = np.datetime64(start, 'h') if start is not None else first
+    if end is not None:
+        # Una fecha sin hora incluye el día completo
+        end_value = np.datetime64(end)
+        last = (end_value + 1).astype('datetime64[h]') - 1 if end_value.dtype == np.dtype('datetime64[D]') \
+            else end_value.astype('datetime64[h]')
+    hours = int((last - first).astype(np.int64)) + 1
+    if hours <= 0:
+        raise ValueError("el rango de fechas está vacío")
+
+    generation = f"{_GENERATION_PREFIX}{time.strftime('%Y%m%dT%H%M%S')}.{time.time_ns() % 10**9:09d}-{os.getpid()}"
+    generation_dir = os.path.join(directory, generation)
+    os.makedirs(generation_dir)
+    keys = sorted(cells)
+    paths = {name: os.path.join(generation_dir, name) for name in (_ITH_FILE, _THRESHOLDS_FILE, _INDEX_FILE)}
+
+    ith = np.lib.format.open_memmap(paths[_ITH_FILE], mode='w+', dtype=np.float32, shape=(len(keys), hours))
+    valid_hours = []
+    for row, key in enumerate(keys):
+        ith[row] = np.nan
+        valid_hours.append(_fill_row(ith[row], cells[key], first))
+        print(f"  --- Celda {key} ({row + 1}/{len(keys)}): {valid_hours[-1]}/{hours} horas con dato.")
+    ith.flush()
+
+    thresholds = np.lib.format.open_memmap(paths[_THRESHOLDS_FILE], mode='w+', dtype=np.float64,
+                                           shape=(len(keys), 1 + 12 * 24))
+    time_axis = first + np.arange(hours)
+    for block_start in range(0, len(keys), CLIMATE_STORE_INGEST_BLOCK_CELLS):
+        block = slice(block_start, block_start + CLIMATE_STORE_INGEST_BLOCK_CELLS)
+        overall, tables = build_threshold_tables(ith[block], time_axis)
+        thresholds[block, 0] = overall
+        thresholds[block, 1:] = tables.reshape(len(overall), -1)
+    thresholds.flush()
+    del ith, thresholds
+
+    index = {
+        'version': STORE_VERSION,
+        'resolution': resolution,
+        'start': str(first),
+        'hours': hours,
+        'cells': [list(key) for key in keys],
+        'valid_hours': valid_hours,
+        'built_at': time.time(),
+    }
+    with open(paths[_INDEX_FILE], 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+    # Publicación atómica: CURRENT pasa a nombrar la generación nueva
+    previous = current_generation(directory)
+    pointer = os.path.join(directory, _CURRENT_FILE)
+    with open(f"{pointer}.tmp", 'w', encoding='utf-8') as f:
+        f.write(generation)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{pointer}.tmp", pointer)
+    _remove_old_generations(directory, generation, previous)
+    print(f"  --- EXITO Almacén climático con {len(keys)} celdas x {hours} horas en {generation_dir}.")
+    return ClimateStore(generation_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Almacén del histórico climático por celda de la grilla.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help="Construye el almacén desde un manifiesto de CSV horarios.")
+    ingest.add_argument('manifest', help="CSV con columnas latitude, longitude y file.")
+    ingest.add_argument('--dir', default=CLIMATE_STORE_DIR, help="Directorio del almacén.")
+    ingest.add_argument('--resolution', type=float, default=GRID_RESOLUTION_DEG, help="Resolución de la grilla (grados).")
+    ingest.add_argument('--start', help="Primera hora del eje (por defecto, la más antigua de los archivos).")
+    ingest.add_argument('--end', help="Última hora del eje (por defecto, la más reciente de los archivos).")
+    info = commands.add_parser('info', help="Resume el almacén existente.")
+    info.add_argument('--dir', default=CLIMATE_STORE_DIR, help="Directorio del almacén.")
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        try:
+            build_climate_store(args.manifest, args.dir, args.resolution, args.start, args.end)
+        except (OSError, ValueError) as e:
+            print(f"--- ERROR: No se pudo construir el almacén climático: {e}")
+            return 1
+        return 0
+
+    store = open_climate_store(args.dir)
+    if store is None:
+        print(f"--- ERROR: No hay un almacén climático válido en {args.dir}.")
+        return 1
+    print(f"Almacén {args.dir}: {len(store)} celdas (resolución {store.resolution}°), "
+          f"{store.hours} horas desde {store.start} ({store.ith.nbytes / 2**20:.1f} MiB de ITH).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,11 +4,186 @@
 LATITUD_MONTERIA = 8.7296
 LONGITUD_MONTERIA = -75.8650
 
+# --- AGRUPACIÓN ESPACIAL DE FINCAS ---
+# Resolución (en grados) de la grilla de pronóstico. Las fincas que caen en la
+# misma celda comparten una única consulta al proveedor (~0.1° ≈ 11 km).
+GRID_RESOLUTION_DEG = 0.1
+
 # --- ENDPOINTS DE API (Primario) ---
 URL_OPENWEATHER_FORECAST = "https://api.openweathermap.org/data/2.5/forecast"
 URL_OPENMETEO_FORECAST = "https://api.open-meteo.com/v1/forecast"
 
+# --- LÍMITES DE CONCURRENCIA Y TASA POR PROVEEDOR ---
+REQUEST_TIMEOUT_SECONDS = 10
+# max_concurrency: peticiones simultáneas; rate_per_sec / burst: token bucket.
+# Valores pensados para los planes gratuitos (OpenWeather: 60 req/min, Open-Meteo: 600 req/min).
+PROVIDER_LIMITS = {
+    "OpenWeatherMap": {"max_concurrency": 8, "rate_per_sec": 1.0, "burst": 10},
+    "OpenMeteo": {"max_concurrency": 8, "rate_per_sec": 10.0, "burst": 20},
+}
+
+# --- SALUD DE LOS PROVEEDORES (CIRCUIT BREAKER Y RESPALDO ANTICIPADO) ---
+# Fallos consecutivos que abren el circuito de un proveedor (se va directo al
+# respaldo) y cada cuánto se sondea para cerrarlo. Con FORECAST_HEDGE_ENABLED, las
+# celdas de un lote que OpenWeather no respondió en FORECAST_HEDGE_DELAY_SECONDS se
+# piden también a Open-Meteo (multi-ubicación) y gana la primera respuesta válida.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_PROBE_INTERVAL_SECONDS = 60
+FORECAST_HEDGE_ENABLED = False
+FORECAST_HEDGE_DELAY_SECONDS = 2.0
+
+# --- CONSULTAS MULTI-UBICACIÓN DE OPEN-METEO ---
+# Open-Meteo acepta listas de coordenadas separadas por comas en una sola petición.
+# Cada lote se corta al llegar a cualquiera de los dos límites.
+OPENMETEO_MAX_POINTS_PER_REQUEST = 100
+OPENMETEO_MAX_URL_LENGTH = 4000
+
+# --- CACHÉ LOCAL DE PRONÓSTICOS ---
+FORECAST_CACHE_ENABLED = True
+FORECAST_CACHE_PATH = "data/cache/forecast_cache.sqlite"
+FORECAST_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Intervalo de actualización de cada proveedor: define la emisión vigente y el TTL
+PROVIDER_UPDATE_INTERVAL_SECONDS = {
+    "OpenWeatherMap": 3 * 3600,
+    "OpenMeteo": 3600,
+}
+
+# --- UMBRALES DE RIESGO ---
+# Comparar cada hora del pronóstico con el P75 histórico de su mes y hora del día
+# (tabla 12 x 24) en lugar del P75 global.
+USE_MONTH_HOUR_THRESHOLDS = True
+
+# Bandas de ITH del Plan de Prevención (Alerta / Peligro / Emergencia). Cada hora
+# toma el nivel de la banda cuyo borde alcanza (ITH >= borde); superar el P75
+# histórico la eleva al menos a ALTO. RISK_LEVEL_LABELS debe tener len(RISK_BANDS) + 2 etiquetas (SIN DATOS primero).
+RISK_BANDS = (72.0, 75.0, 79.0, 84.0)
+RISK_LEVEL_LABELS = (
+    'SIN DATOS',
+    'RIESGO BAJO 🟩',
+    'RIESGO MODERADO 🟨',
+    'RIESGO ALTO 🟥',
+    'RIESGO PELIGRO 🟪',
+    'RIESGO EMERGENCIA ⬛',
+)
+
+# --- GENERACIÓN DE NARRATIVAS (GEMINI) ---
+# Hilos que llaman al modelo a la vez, límite de peticiones por minuto y reintentos
+# (con espera exponencial + jitter) ante errores de cuota.
+NARRATIVE_MAX_WORKERS = 8
+NARRATIVE_REQUESTS_PER_MINUTE = 60
+NARRATIVE_MAX_RETRIES = 4
+NARRATIVE_RETRY_BASE_SECONDS = 2.0
+# Modo por lotes: varias granjas por petición (el plan de prevención se envía una vez)
+NARRATIVE_BATCH_ENABLED = True
+NARRATIVE_BATCH_SIZE = 10
+
+# --- CACHÉ DE NARRATIVAS (GEMINI) ---
+NARRATIVE_CACHE_ENABLED = True
+NARRATIVE_CACHE_PATH = "data/cache/narrative_cache.sqlite"
+NARRATIVE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+NARRATIVE_CACHE_TTL_SECONDS = 12 * 3600
+NARRATIVE_CACHE_MEMORY_ENTRIES = 1024
+# Ancho de los intervalos (en puntos de ITH) del umbral y del máximo en la firma
+NARRATIVE_THRESHOLD_BUCKET = 0.5
+
+# --- ENVÍO DE CORREOS ---
+# Sesiones SMTP simultáneas del envío masivo y mensajes por sesión antes de reciclarla
+SMTP_POOL_SIZE = 4
+SMTP_MAX_MESSAGES_PER_SESSION = 100
+
+# --- MÉTRICAS E INSTRUMENTACIÓN ---
+# Temporizadores por etapa y contadores (False = sin costo), logs JSON por stderr y
+# archivo opcional para el textfile collector de Prometheus (None = no se escribe).
+METRICS_ENABLED = True
+METRICS_JSON_LOGS = False
+METRICS_PROMETHEUS_TEXTFILE = None  # p. ej. "data/metrics/agri_alerta.prom"
+
+# --- BITÁCORA DE CORRIDAS (REANUDACIÓN) ---
+# Progreso por finca en SQLite: una ejecución interrumpida se reanuda sin repetir
+# consultas, narrativas ni envíos. Ventana de envío (correos reclamados por
+# adelantado y confirmados por transacción: es también el máximo de envíos
+# inciertos por hilo si el proceso muere) y días que se conservan las corridas terminadas.
+RUN_JOURNAL_ENABLED = True
+RUN_JOURNAL_PATH = "data/state/run_journal.sqlite"
+RUN_JOURNAL_SEND_WINDOW = 50
+RUN_JOURNAL_RETENTION_DAYS = 14
+
+# --- ALERTAS INCREMENTALES ---
+# Solo se vuelve a alertar a una finca cuando cambia la firma de su perfil de riesgo
+# (episodios de hoy y mañana, ITH máximo por intervalos y fecha) respecto del último
+# envío, o cuando pasó el intervalo de latido desde ese envío (0 = alertar siempre).
+ALERT_STATE_ENABLED = True
+ALERT_STATE_PATH = "data/state/alert_state.sqlite"
+ALERT_STATE_ITH_BUCKET = 1.0
+ALERT_HEARTBEAT_HOURS = 24
+
+# --- BANDEJA DE SALIDA (ENVÍO DESACOPLADO) ---
+# Los mensajes renderizados se guardan en una cola SQLite duradera y un emisor la
+# vacía a su propio ritmo (`python src/outbox.py drain`). Con OUTBOX_DRAIN_INLINE el
+# propio pipeline la vacía al terminar de encolar (como antes, pero los fallos quedan
+# en la cola para reintentarse sin recalcular nada). Cada sesión SMTP reclama de a
+# OUTBOX_CLAIM_BATCH mensajes (máximo de envíos inciertos por sesión si el emisor
+# muere); tras OUTBOX_MAX_ATTEMPTS fallos pasan a mensajes muertos (dead letters).
+OUTBOX_ENABLED = True
+OUTBOX_PATH = "data/state/outbox.sqlite"
+OUTBOX_DRAIN_INLINE = True
+OUTBOX_CLAIM_BATCH = 50
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 60.0
+OUTBOX_RETRY_MAX_SECONDS = 3600.0
+# Reclamos sin confirmar más viejos que esto (emisor caído) se declaran inciertos. Un
+# emisor vivo renueva los reclamos de su lote cada OUTBOX_HEARTBEAT_SECONDS mientras
+# lo envía, así un lote lento no se toma por abandonado.
+OUTBOX_CLAIM_TIMEOUT_SECONDS = 900
+OUTBOX_HEARTBEAT_SECONDS = 60
+# Correos por segundo del emisor (0 = sin límite) y días que se conservan los enviados
+OUTBOX_SEND_RATE_PER_SEC = 0
+OUTBOX_RETENTION_DAYS = 7
+
+# --- RENDERIZADO DE CORREOS ---
+# Procesos para renderizar HTML + MIME en lotes grandes (0 o 1 = en el proceso
+# principal) y alertas por bloque enviado a cada proceso.
+RENDER_PROCESSES = 0
+RENDER_CHUNK_SIZE = 2000
+
+# --- PIPELINE EN FLUJO ---
+# Las fincas avanzan en lotes de STREAM_CHUNK_CELLS celdas de la grilla por etapas
+# (extracción -> análisis -> narrativas -> render -> envío) conectadas por colas de
+# STREAM_QUEUE_SIZE lotes: consultas, llamadas a Gemini y envíos SMTP de lotes
+# distintos se solapan y una etapa lenta frena a las anteriores (memoria acotada).
+# 0 celdas = un único lote (cada etapa termina antes de empezar la siguiente).
+STREAM_CHUNK_CELLS = 64
+STREAM_QUEUE_SIZE = 2
+# Hilos por etapa (cada etapa ya paraleliza su lote con sus propios pools). Con un
+# solo hilo de narrativas cada lote ve en la caché las firmas del lote anterior y no
+# repite llamadas a Gemini.
+STREAM_STAGE_WORKERS = {
+    'extraccion': 2,
+    'analisis': 1,
+    'narrativas': 1,
+    'render': 1,
+    'envio': 1,
+}
+# Cada cuántos segundos se imprime la profundidad de las colas durante la corrida (0 = nunca)
+STREAM_REPORT_INTERVAL_SECONDS = 0
+
 # --- RUTAS DE ARCHIVOS ---
 DATA_FILE_PATH_FORECAST = "data/raw/openweather_forecast.csv"
 DATA_FILE_PATH_HISTORICAL = "data/raw/openmeteo_historical_monteria.csv"
-DATA_FILE_PATH_USERS = "data/users.csv"
\ No newline at end of file
+DATA_FILE_PATH_USERS = "data/users.csv"
+# Artefactos derivados del histórico (copia columnar + estadísticas de umbral)
+HISTORICAL_CACHE_DIR = "data/cache/historical"
+# Desde este tamaño el histórico se procesa por bloques con un sketch de cuantiles
+# (memoria constante); por debajo se usa el cálculo exacto en memoria.
+HISTORICAL_STREAMING_MIN_BYTES = 256 * 1024 * 1024
+HISTORICAL_STREAMING_CHUNK_ROWS = 500_000
+# Rango y ancho de bin del histograma: el P75 estimado tiene un error máximo de un bin
+HISTORICAL_SKETCH_RANGE = (-20.0, 130.0)
+HISTORICAL_SKETCH_BIN_WIDTH = 0.05
+# Almacén del histórico por celda (eje horario fijo + ITH float32 por celda, mapeado
+# en memoria), generado con `python src/climate_store.py ingest <manifiesto.csv>`.
+# Las celdas sin línea base propia (o sin almacén) usan el umbral del histórico global.
+CLIMATE_STORE_ENABLED = True
+CLIMATE_STORE_DIR = "data/cache/climate_store"
+# Celdas cuyas tablas de umbral se calculan por pasada en la ingesta (acota la memoria)
+CLIMATE_STORE_INGEST_BLOCK_CELLS = 64
@@ -1,15 +1,15 @@
 # src/extract.py (COMPLETO Y FUNCIONAL)
 import requests
 import pandas as pd
-from os import getenv
-from dotenv import load_dotenv
-from typing import Optional, Dict
+from typing import Optional, Dict, Hashable, Iterable, Iterator, List, Tuple
 import os
 
-
-load_dotenv() 
-# Asegúrate de que esta clave exista en tu .env
-API_KEY = getenv("OPENWEATHER_API_KEY") 
+from fetch_engine import get_provider_client, fetch_many, map_concurrently
+from provider_health import CircuitOpenError, get_breaker
+from constants import OPENMETEO_MAX_POINTS_PER_REQUEST, OPENMETEO_MAX_URL_LENGTH
+from forecast_cache import get_cached_forecast, store_forecast
+from metrics import increment, log_event
+from settings import get_settings
 
 # =======================================================================
 # 1. FUNCIONES DE EXTRACCIÓN (Fetch)
@@ -20,32 +20,43 @@ def fetch_openweather_forecast(url: str, lat: float, lon: float) -> Optional[Dic
     Obtiene el pronóstico de 5 días / 3 horas de OpenWeatherMap.
     Devuelve el JSON completo o None si falla.
     """
-    if not API_KEY:
-        print("--- ERROR: OPENWEATHER_API_KEY no configurada.")
+    cached = get_cached_forecast("OpenWeatherMap", lat, lon)
+    if cached is not None:
+        return cached
+
+    # Asegúrate de que esta clave exista en tu .env
+    api_key = get_settings().openweather_api_key
+    if not api_key:
+        # Sin clave todas las consultas fallarían: se abre el circuito y se va al respaldo
+        get_breaker("OpenWeatherMap").trip("OPENWEATHER_API_KEY no configurada")
         return None
         
     try:
-        # Nota: OpenWeather usa 'lat' y 'lon'
-        response = requests.get(url, params={
+        # Nota: OpenWeather usa 'lat' y 'lon'. Un 'cod' distinto de '200' cuenta como
+        # fallo del proveedor (circuit breaker), igual que un error HTTP
+        data, valid = get_provider_client("OpenWeatherMap").get_json(url, params={
             'lat': lat,
             'lon': lon,
-            'appid': API_KEY,
+            'appid': api_key,
             'units': 'metric', # Obtener temperatura en Celsius
             'lang': 'es'
-        }, timeout=10)
-        
-        response.raise_for_status()  # Lanza excepción para códigos de error HTTP
+        }, is_valid=lambda data: isinstance(data, dict) and data.get('cod') == '200')
         
-        data = response.json()
-        if data.get('cod') == '200':
+        if valid:
             print(f"  --- EXITO Extracción exitosa de OpenWeatherMap.")
+            store_forecast("OpenWeatherMap", lat, lon, data)
             return data
         else:
-            print(f"  ---  ALERTA OpenWeatherMap devolvió código: {data.get('cod')}")
+            print(f"  ---  ALERTA OpenWeatherMap devolvió código: {data.get('cod') if isinstance(data, dict) else None}")
+            increment('provider_failures_openweathermap')
             return None
             
+    except CircuitOpenError:
+        return None
     except requests.exceptions.RequestException as e:
         print(f"  ---  ERROR de conexión/API de OpenWeatherMap: {e}")
+        increment('provider_failures_openweathermap')
+        log_event('provider_failure', provider='OpenWeatherMap', error=str(e))
         return None
 
 def fetch_openmeteo_forecast(url: str, lat: float, lon: float) -> Optional[Dict]:
@@ -53,29 +64,141 @@ def fetch_openmeteo_forecast(url: str, lat: float, lon: float) -> Optional[Dict]
     Obtiene el pronóstico de 7 días / 1 hora de Open-Meteo.
     Devuelve el JSON completo o None si falla.
     """
+    cached = get_cached_forecast("OpenMeteo", lat, lon)
+    if cached is not None:
+        return cached
+
     try:
         # Nota: Open-Meteo usa 'latitude' y 'longitude'
-        response = requests.get(url, params={
+        data, valid = get_provider_client("OpenMeteo").get_json(url, params={
             'latitude': lat,
             'longitude': lon,
             'hourly': 'temperature_2m,relative_humidity_2m',
             'forecast_days': 2 # Solo necesitamos hoy y mañana para la alerta
-        }, timeout=10)
-        
-        response.raise_for_status() 
+        }, is_valid=lambda data: isinstance(data, dict) and 'hourly' in data)
         
-        data = response.json()
-        if 'hourly' in data:
+        if valid:
             print(f"  --- EXITO Extracción exitosa de Open-Meteo (Fallback).")
+            store_forecast("OpenMeteo", lat, lon, data)
             return data
         else:
             print(f"  --- ALERTA Open-Meteo no devolvió datos horarios.")
+            increment('provider_failures_openmeteo')
             return None
             
+    except CircuitOpenError:
+        return None
     except requests.exceptions.RequestException as e:
         print(f"  --- ERROR de conexión/API de Open-Meteo: {e}")
+        increment('provider_failures_openmeteo')
+        log_event('provider_failure', provider='OpenMeteo', error=str(e))
+        return None
+
+def _hourly_blocks(data, expected: int) -> Optional[List[Dict]]:
+    """
+    Lista de bloques de una respuesta multi-ubicación de Open-Meteo, o None si no trae
+    `expected` bloques con datos horarios. Con una sola coordenada Open-Meteo devuelve
+    un objeto en lugar de una lista.
+    """
+    blocks = [data] if isinstance(data, dict) else data
+    if isinstance(blocks, list) and len(blocks) == expected and all(
+            isinstance(item, dict) and 'hourly' in item for item in blocks):
+        return blocks
+    return None
+
+def fetch_openmeteo_forecast_bulk(url: str, coords: List[Tuple[float, float]]) -> Optional[List[Dict]]:
+    """
+    Obtiene el pronóstico de Open-Meteo para VARIAS coordenadas en una sola petición
+    (latitudes y longitudes separadas por comas).
+    Devuelve la lista de JSON por ubicación (mismo orden que `coords`) o None si falla.
+    """
+    try:
+        data, valid = get_provider_client("OpenMeteo").get_json(url, params={
+            'latitude': ','.join(f"{lat:.4f}" for lat, _ in coords),
+            'longitude': ','.join(f"{lon:.4f}" for _, lon in coords),
+            'hourly': 'temperature_2m,relative_humidity_2m',
+            'forecast_days': 2
+        }, is_valid=lambda data: _hourly_blocks(data, len(coords)) is not None)
+
+        if valid:
+            data = _hourly_blocks(data, len(coords))
+            print(f"  --- EXITO Extracción multi-ubicación de Open-Meteo ({len(coords)} puntos).")
+            for (lat, lon), item in zip(coords, data):
+                store_forecast("OpenMeteo", lat, lon, item)
+            return data
+        else:
+            count = len(data) if isinstance(data, list) else int(isinstance(data, dict))
+            print(f"  --- ALERTA Open-Meteo devolvió {count} bloques horarios para {len(coords)} puntos.")
+            increment('provider_failures_openmeteo')
+            return None
+
+    except CircuitOpenError:
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"  --- ERROR de conexión/API de Open-Meteo (multi-ubicación): {e}")
+        increment('provider_failures_openmeteo')
+        log_event('provider_failure', provider='OpenMeteo', points=len(coords), error=str(e))
         return None
 
+def chunk_coordinates(url: str, coords: List[Tuple[Hashable, float, float]],
+                      max_points: int = OPENMETEO_MAX_POINTS_PER_REQUEST,
+                      max_url_length: int = OPENMETEO_MAX_URL_LENGTH) -> List[List[Tuple[Hashable, float, float]]]:
+    """
+    Empaqueta las coordenadas en lotes que respetan el máximo de puntos por petición
+    y el largo máximo de URL (estimado con el mismo formato de 4 decimales).
+    """
+    # Parámetros fijos + nombres 'latitude=' y 'longitude=' (aprox.)
+    base_length = len(url) + 100
+    chunks, current, length = [], [], base_length
+    for item in coords:
+        # Cada punto suma "lat," y "lon," (las comas se codifican como %2C)
+        item_length = len(f"{item[1]:.4f}") + len(f"{item[2]:.4f}") + 6
+        if current and (len(current) >= max_points or length + item_length > max_url_length):
+            chunks.append(current)
+            current, length = [], base_length
+        current.append(item)
+        length += item_length
+    if current:
+        chunks.append(current)
+    return chunks
+
+def fetch_openmeteo_batch(url: str, coords: Iterable[Tuple[Hashable, float, float]]) -> Iterator[Tuple[List[Hashable], Optional[List[Dict]]]]:
+    """
+    Modo por lotes de Open-Meteo: agrupa las coordenadas en peticiones multi-ubicación
+    y las ejecuta en paralelo. Entrega (claves del lote, lista de JSON o None).
+    Las coordenadas ya presentes en la caché se entregan primero, sin petición.
+    """
+    cached_keys, cached_data, missing = [], [], []
+    for key, lat, lon in coords:
+        cached = get_cached_forecast("OpenMeteo", lat, lon)
+        if cached is not None:
+            cached_keys.append(key)
+            cached_data.append(cached)
+        else:
+            missing.append((key, lat, lon))
+    if cached_keys:
+        yield cached_keys, cached_data
+
+    chunks = chunk_coordinates(url, missing)
+    jobs = ((tuple(key for key, _, _ in chunk), (url, [(lat, lon) for _, lat, lon in chunk])) for chunk in chunks)
+    client = get_provider_client("OpenMeteo")
+    for keys, data in map_concurrently(fetch_openmeteo_forecast_bulk, jobs, max_workers=client.max_concurrency):
+        yield list(keys), data
+
+FETCH_FUNCTIONS = {
+    "OpenWeatherMap": fetch_openweather_forecast,
+    "OpenMeteo": fetch_openmeteo_forecast,
+}
+
+def fetch_forecast_batch(source: str, url: str, coords: Iterable[Tuple[Hashable, float, float]]) -> Iterator[Tuple[Hashable, Optional[Dict]]]:
+    """
+    Extrae en paralelo el pronóstico de `source` para un lote de (clave, lat, lon),
+    reutilizando las conexiones y respetando los límites del proveedor.
+    Entrega (clave, JSON o None) a medida que cada consulta termina.
+    """
+    client = get_provider_client(source)
+    return fetch_many(FETCH_FUNCTIONS[source], url, coords, max_workers=client.max_concurrency)
+
 # =======================================================================
 # 2. FUNCIONES DE CARGA (Load)
 # =======================================================================
@@ -89,19 +212,9 @@ def load_historical_data(file_path: str) -> pd.DataFrame:
         return pd.DataFrame() 
         
     try:
-        df_historical = pd.read_csv(file_path, parse_dates=['time'])
-        
-        # Limpieza de nombres de columnas (quita unidades como (C) o (%))
-        df_historical.columns = df_historical.columns.str.replace(r' \(.*\)', '', regex=True)
-        df_historical.columns = df_historical.columns.str.lower().str.strip()
-
-        required_cols = ['time', 'temperature_2m', 'relative_humidity_2m']
-        if not all(col in df_historical.columns for col in required_cols):
-             print(f"FALLO: El CSV histórico no contiene todas las columnas requeridas tras la limpieza.")
-             return pd.DataFrame()
-
-        # Asegurar el formato de tiempo
-        df_historical['time'] = pd.to_datetime(df_historical['time'])
+        df_historical = _clean_historical_columns(pd.read_csv(file_path, parse_dates=['time']))
+        if df_historical is None:
+            return pd.DataFrame()
 
         print(f"  --- EXITO Histórico cargado exitosamente: {len(df_historical)} registros.")
         return df_historical
@@ -110,6 +223,35 @@ def load_historical_data(file_path: str) -> pd.DataFrame:
         print(f"  --- ERROR al cargar el histórico: {e}")
         return pd.DataFrame()
 
+def _clean_historical_columns(df_historical: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Limpia los nombres de columnas del histórico y valida las requeridas.
+    """
+    # Limpieza de nombres de columnas (quita unidades como (C) o (%))
+    df_historical.columns = df_historical.columns.str.replace(r' \(.*\)', '', regex=True)
+    df_historical.columns = df_historical.columns.str.lower().str.strip()
+
+    required_cols = ['time', 'temperature_2m', 'relative_humidity_2m']
+    if not all(col in df_historical.columns for col in required_cols):
+         print(f"FALLO: El CSV histórico no contiene todas las columnas requeridas tras la limpieza.")
+         return None
+
+    # Asegurar el formato de tiempo
+    df_historical['time'] = pd.to_datetime(df_historical['time'])
+    return df_historical
+
+def iter_historical_chunks(file_path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Lee el CSV histórico por bloques de `chunksize` filas (memoria constante sin
+    importar el tamaño del archivo). Cada bloque sale con las columnas ya limpias.
+    """
+    reader = pd.read_csv(file_path, parse_dates=['time'], chunksize=chunksize)
+    for chunk in reader:
+        chunk = _clean_historical_columns(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
 def load_user_data(file_path: str) -> pd.DataFrame:
     """
     Carga la lista de usuarios (coordenadas y correos) para los envíos masivos.
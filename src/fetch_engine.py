@@ -0,0 +1,202 @@
+# src/fetch_engine.py
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import PROVIDER_LIMITS, REQUEST_TIMEOUT_SECONDS
+from metrics import get_histogram, increment
+from provider_health import CircuitOpenError, get_breaker
+from ratelimit import TokenBucket, backoff_delay
+
+# =======================================================================
+# 1. CLIENTE HTTP POR PROVEEDOR (Conexiones reutilizables + límites)
+# =======================================================================
+
+class ProviderClient:
+    """
+    Sesión HTTP compartida para un proveedor de pronóstico.
+
+    - Mantiene un pool de conexiones keep-alive (requests.Session + HTTPAdapter).
+    - Limita las peticiones simultáneas con un semáforo (max_concurrency).
+    - Limita la tasa con un token bucket (rate_per_sec / burst).
+    - Ante HTTP 429 reduce la tasa a la mitad, respeta 'Retry-After' y reintenta;
+      cada respuesta exitosa la recupera gradualmente hasta la tasa configurada.
+    - Informa cada resultado a su circuit breaker (provider_health): solo cuenta como
+      éxito una respuesta 2xx con JSON que el llamador da por válido. Con el circuito
+      abierto rechaza la petición al instante con CircuitOpenError.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, rate_per_sec: float, burst: Optional[float] = None,
+                 timeout: float = REQUEST_TIMEOUT_SECONDS, max_retries: int = 3):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._base_rate = float(rate_per_sec)
+        self._min_rate = self._base_rate / 16
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        self.breaker = get_breaker(name)
+
+    def _throttle(self) -> None:
+        self._bucket.set_rate(max(self._min_rate, self._bucket.rate / 2))
+
+    def _recover(self) -> None:
+        if self._bucket.rate < self._base_rate:
+            self._bucket.set_rate(min(self._base_rate, self._bucket.rate + self._base_rate / 20))
+
+    def get_json(self, url: str, params: Dict, is_valid: Callable[[Any], bool]) -> Tuple[Any, bool]:
+        """
+        GET con límites del proveedor y el JSON de la respuesta. Devuelve
+        (datos, is_valid(datos)); los errores HTTP, de red y de JSON se propagan.
+        El circuit breaker recibe un único resultado por petición: éxito solo si la
+        respuesta es válida; cualquier otra cosa (un cuerpo ilegible, un código de
+        error dentro del JSON) cuenta como fallo, y así un sondeo siempre se resuelve.
+        """
+        if not self.breaker.allow_request():
+            increment(f"provider_short_circuited_{self.name.lower()}")
+            raise CircuitOpenError(f"Circuito de {self.name} abierto")
+        try:
+            response = self._get_with_retries(url, params)
+            response.raise_for_status()
+            data = response.json()
+            valid = bool(is_valid(data))
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if valid:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return data, valid
+
+    def _get_with_retries(self, url: str, params: Dict) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                self._bucket.acquire()
+                started = time.perf_counter()
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                get_histogram(f"provider_{self.name.lower()}_seconds").observe(time.perf_counter() - started)
+
+            if response.status_code != 429:
+                self._recover()
+                return response
+
+            self._throttle()
+            increment(f"provider_throttled_{self.name.lower()}")
+            if attempt == self.max_retries:
+                break
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+            print(f"  --- ALERTA {self.name} respondió 429. Reintentando en {delay:.1f}s "
+                  f"(tasa ajustada a {self._bucket.rate:.2f} req/s).")
+            time.sleep(delay)
+
+        return response
+
+
+_clients: Dict[str, ProviderClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_provider_client(name: str) -> ProviderClient:
+    """
+    Devuelve (creándolo la primera vez) el cliente compartido del proveedor,
+    con los límites definidos en constants.PROVIDER_LIMITS.
+    """
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ProviderClient(name, **PROVIDER_LIMITS[name])
+        return _clients[name]
+
+
+# =======================================================================
+# 2. EXTRACCIÓN CONCURRENTE POR LOTES
+# =======================================================================
+
+def map_concurrently(fn: Callable, jobs: Iterable[Tuple[Hashable, tuple]], max_workers: int) -> Iterator[Tuple[Hashable, object]]:
+    """
+    Ejecuta fn(*args) para cada (clave, args) en un pool de hilos y entrega los
+    pares (clave, resultado) a medida que se completan.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fn, *args): key for key, args in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def fetch_many(fetch_fn: Callable[[str, float, float], Optional[Dict]], url: str,
+               coords: Iterable[Tuple[Hashable, float, float]], max_workers: int) -> Iterator[Tuple[Hashable, Optional[Dict]]]:
+    """
+    Ejecuta fetch_fn(url, lat, lon) para cada (clave, lat, lon) en un pool de hilos
+    y entrega los pares (clave, resultado) a medida que se completan.
+    """
+    return map_concurrently(fetch_fn, ((key, (url, lat, lon)) for key, lat, lon in coords), max_workers)
+
+
+# =======================================================================
+# 3. LOTE "HEDGED" (RESPALDO ANTICIPADO)
+# =======================================================================
+
+_FINISHED = object()
+
+
+def hedged_batch(primary: Callable[[List], Iterable[Tuple[Hashable, Any]]],
+                 fallback: Callable[[List], Iterable[Tuple[Hashable, Any]]],
+                 items: List[Tuple], delay: float) -> Iterator[Tuple[Hashable, Any, str]]:
+    """
+    Lanza `primary(items)` en segundo plano; los ítems (clave, ...) que sigan sin
+    respuesta tras `delay` segundos se piden también a `fallback(pendientes)`. Ambas
+    funciones entregan pares (clave, resultado o None). Se entrega
+    (clave, resultado, 'primary' | 'fallback') con la primera respuesta no nula de
+    cada clave. Si el primario termina antes del plazo, el respaldo recibe solo los
+    ítems que fallaron. Las peticiones perdedoras terminan en segundo plano (su
+    resultado queda en caché).
+    """
+    results: "queue.Queue" = queue.Queue()
+
+    def run(label: str, fn: Callable, subset: List[Tuple]) -> None:
+        try:
+            for key, value in fn(subset):
+                results.put((label, key, value))
+        except Exception as e:
+            print(f"--- ERROR Falló la consulta {label} del lote hedged: {e}")
+        finally:
+            results.put((label, _FINISHED, None))
+
+    def start(label: str, fn: Callable, subset: List[Tuple]) -> None:
+        running.add(label)
+        launched.add(label)
+        threading.Thread(target=run, args=(label, fn, subset), daemon=True, name=f"hedge-{label}").start()
+
+    pending = {item[0]: item for item in items}
+    running, launched = set(), set()
+    start('primary', primary, items)
+    deadline = time.monotonic() + delay
+    while pending and running:
+        timeout = None if 'fallback' in launched else max(0.0, deadline - time.monotonic())
+        try:
+            label, key, value = results.get(timeout=timeout)
+        except queue.Empty:
+            # El primario no terminó a tiempo: respaldo en paralelo para lo pendiente
+            increment('forecast_hedged_requests', len(pending))
+            start('fallback', fallback, list(pending.values()))
+            continue
+        if key is _FINISHED:
+            running.discard(label)
+            if pending and 'fallback' not in launched:
+                start('fallback', fallback, list(pending.values()))
+            continue
+        if value is not None and pending.pop(key, None) is not None:
+            yield key, value, label
@@ -0,0 +1,201 @@
+# src/forecast_block.py
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# =======================================================================
+# PRONÓSTICO COMPACTO (ARREGLOS CONTIGUOS EN LUGAR DE DATAFRAMES)
+# =======================================================================
+# Cada pronóstico es una serie corta (16 a 48 horas). Como DataFrame, cada una
+# arrastra índice, bloques internos y metadatos de pandas, y con decenas de miles
+# de celdas ese overhead domina la memoria. ForecastBlock guarda solo arreglos
+# NumPy contiguos y se decodifica directo del JSON del proveedor:
+#   - epoch: int64, segundos desde 1970 (hora de pared del proveedor, sin zona);
+#   - temperature, humidity, ith: float32;
+#   - risk: uint8 (códigos de analyze.assign_risk_category).
+# Los bloques de una respuesta multi-ubicación y los del análisis por lotes son
+# vistas sobre los mismos arreglos. to_frame() arma el DataFrame solo si se pide.
+
+SECONDS_PER_DAY = 86400
+
+
+class ForecastBlock:
+    """Pronóstico horario de una ubicación respaldado por arreglos NumPy."""
+
+    __slots__ = ('epoch', 'temperature', 'humidity', 'ith', 'risk')
+
+    def __init__(self, epoch: np.ndarray, temperature: np.ndarray, humidity: np.ndarray,
+                 ith: Optional[np.ndarray] = None, risk: Optional[np.ndarray] = None):
+        self.epoch = epoch
+        self.temperature = temperature
+        self.humidity = humidity
+        self.ith = ith
+        self.risk = risk
+
+    def __len__(self) -> int:
+        return len(self.epoch)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.epoch) == 0
+
+    def datetimes(self) -> np.ndarray:
+        """Eje de tiempo como datetime64[s] (vista, sin copiar)."""
+        return self.epoch.view('datetime64[s]')
+
+    def days(self) -> np.ndarray:
+        """Día de cada hora como número de días desde 1970 (comparable con datetime64[D])."""
+        return self.epoch // SECONDS_PER_DAY
+
+    def max_ith(self) -> float:
+        if self.ith is None or not len(self.ith):
+            return float('nan')
+        return float(np.nanmax(self.ith)) if not np.isnan(self.ith).all() else float('nan')
+
+    def take(self, selector) -> 'ForecastBlock':
+        """Subconjunto de horas (slice, máscara booleana o índices) con los mismos campos."""
+        return ForecastBlock(
+            self.epoch[selector], self.temperature[selector], self.humidity[selector],
+            None if self.ith is None else self.ith[selector],
+            None if self.risk is None else self.risk[selector],
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame estándar ('time', 'temperature_2m', 'relative_humidity_2m' y, si existen, 'ITH' y 'risk')."""
+        df = pd.DataFrame({
+            'time': pd.to_datetime(self.epoch, unit='s'),
+            'temperature_2m': self.temperature,
+            'relative_humidity_2m': self.humidity,
+        })
+        if self.ith is not None:
+            df['ITH'] = self.ith
+        if self.risk is not None:
+            df['risk'] = self.risk
+        return df
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'ForecastBlock':
+        """Bloque equivalente a un DataFrame estándar (con 'ITH' y 'risk' si los tiene)."""
+        times = pd.to_datetime(df['time'])
+        if times.dt.tz is not None:
+            # Se guarda la hora local de pared, igual que el resto del pipeline
+            times = times.dt.tz_localize(None)
+        epoch = times.to_numpy(dtype='datetime64[s]').astype(np.int64)
+        return cls(
+            epoch,
+            df['temperature_2m'].to_numpy(dtype=np.float32),
+            df['relative_humidity_2m'].to_numpy(dtype=np.float32),
+            df['ITH'].to_numpy(dtype=np.float32) if 'ITH' in df.columns else None,
+            df['risk'].to_numpy(dtype=np.uint8) if 'risk' in df.columns else None,
+        )
+
+
+def as_forecast_block(forecast: Union[ForecastBlock, pd.DataFrame]) -> ForecastBlock:
+    """Acepta un ForecastBlock o un DataFrame estándar y devuelve un ForecastBlock."""
+    return forecast if isinstance(forecast, ForecastBlock) else ForecastBlock.from_frame(forecast)
+
+
+# --- DECODIFICACIÓN DESDE EL JSON DEL PROVEEDOR ---
+
+def _parse_epoch(values: Sequence) -> np.ndarray:
+    """Textos de fecha ISO -> epoch int64 en segundos (valores inválidos quedan como NaT)."""
+    try:
+        parsed = np.array(values, dtype='datetime64[s]')
+    except (ValueError, TypeError):
+        parsed = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='datetime64[s]')
+    return parsed.astype(np.int64)
+
+
+def _to_float32(values: Sequence) -> np.ndarray:
+    try:
+        return np.array(values, dtype=np.float32)
+    except (ValueError, TypeError):
+        # Valores nulos o no numéricos -> NaN (se descartan al armar el bloque)
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float32)
+
+
+_NAT = np.datetime64('NaT').astype(np.int64)
+
+
+def _valid_rows(epoch: np.ndarray, temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    return (epoch != _NAT) & ~np.isnan(temperature) & ~np.isnan(humidity)
+
+
+def _build_block(epoch: np.ndarray, temperature: np.ndarray, humidity: np.ndarray) -> Optional[ForecastBlock]:
+    valid = _valid_rows(epoch, temperature, humidity)
+    if not valid.all():
+        epoch, temperature, humidity = epoch[valid], temperature[valid], humidity[valid]
+    return ForecastBlock(epoch, temperature, humidity) if len(epoch) else None
+
+
+def decode_openweather(raw_data: Dict) -> Optional[ForecastBlock]:
+    """Bloque desde la respuesta de OpenWeather (lista de pasos de 3 horas)."""
+    items = raw_data.get('list', [])
+    mains = [item.get('main', {}) for item in items]
+    # 'dt' es el mismo instante que 'dt_txt' (UTC) ya en segundos: no hace falta parsear texto
+    if items and all(isinstance(item.get('dt'), int) for item in items):
+        epoch = np.array([item['dt'] for item in items], dtype=np.int64)
+    else:
+        epoch = _parse_epoch([item.get('dt_txt') for item in items])
+    return _build_block(epoch,
+                        _to_float32([main.get('temp') for main in mains]),
+                        _to_float32([main.get('humidity') for main in mains]))
+
+
+def decode_openmeteo(raw_data: Dict) -> Optional[ForecastBlock]:
+    """Bloque desde la respuesta de Open-Meteo (columnas horarias)."""
+    hourly = raw_data.get('hourly', {})
+    times = hourly.get('time', [])
+    n = len(times)
+
+    def _column(name: str) -> list:
+        column = list(hourly.get(name, []))[:n]
+        return column + [None] * (n - len(column))
+
+    return _build_block(_parse_epoch(times), _to_float32(_column('temperature_2m')),
+                        _to_float32(_column('relative_humidity_2m')))
+
+
+def decode_openmeteo_batch(raw_data: List[Dict]) -> List[Optional[ForecastBlock]]:
+    """
+    Bloques de una respuesta multi-ubicación de Open-Meteo: todas las columnas se
+    convierten UNA sola vez y cada ubicación queda como vista sobre esos arreglos.
+    """
+    if not raw_data:
+        return []
+    hourly_blocks = [item.get('hourly', {}) for item in raw_data]
+    lengths = np.array([len(block.get('time', [])) for block in hourly_blocks])
+
+    def _column(name: str) -> list:
+        # Se rellena con None si un bloque trae columnas de distinto largo
+        values = []
+        for block, n in zip(hourly_blocks, lengths):
+            column = list(block.get(name, []))[:n]
+            values.extend(column + [None] * (n - len(column)))
+        return values
+
+    epoch = _parse_epoch(_column('time'))
+    temperature = _to_float32(_column('temperature_2m'))
+    humidity = _to_float32(_column('relative_humidity_2m'))
+    location = np.repeat(np.arange(len(hourly_blocks)), lengths)
+    valid = _valid_rows(epoch, temperature, humidity)
+    if not valid.all():
+        epoch, temperature, humidity, location = epoch[valid], temperature[valid], humidity[valid], location[valid]
+
+    # Las filas siguen ordenadas por ubicación: los cortes salen de searchsorted
+    bounds = np.searchsorted(location, np.arange(len(hourly_blocks) + 1))
+    return [ForecastBlock(epoch[start:end], temperature[start:end], humidity[start:end]) if end > start else None
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def decode_forecast(raw_data: Dict, source: str) -> Optional[ForecastBlock]:
+    """Bloque estándar desde el JSON crudo de `source` (None si no hay datos válidos)."""
+    if not raw_data:
+        return None
+    if source == "OpenWeatherMap":
+        return decode_openweather(raw_data)
+    if source == "OpenMeteo":
+        return decode_openmeteo(raw_data)
+    print(f"Advertencia: Fuente de datos desconocida: {source}")
+    return None
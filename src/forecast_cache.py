@@ -0,0 +1,86 @@
+# src/forecast_cache.py
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from cache_store import SQLiteTTLCache
+from constants import (
+    FORECAST_CACHE_ENABLED,
+    FORECAST_CACHE_PATH,
+    FORECAST_CACHE_MAX_BYTES,
+    PROVIDER_UPDATE_INTERVAL_SECONDS,
+    GRID_RESOLUTION_DEG
+)
+from metrics import increment
+from transform import snap_to_grid
+
+# --- CACHÉ DE PRONÓSTICOS POR PROVEEDOR Y CELDA ---
+# La clave es (proveedor, lat/lon redondeadas a la grilla, emisión del pronóstico).
+# La emisión es el inicio del ciclo de actualización vigente del proveedor, así que
+# una re-ejecución dentro del mismo ciclo no hace ninguna llamada de red.
+
+_cache: Optional[SQLiteTTLCache] = None
+_cache_lock = threading.Lock()
+_cache_failed = False
+
+
+def get_forecast_cache() -> Optional[SQLiteTTLCache]:
+    """
+    Abre (la primera vez) la caché de pronósticos. Devuelve None si está desactivada
+    o si no se pudo abrir; en ese caso el pipeline consulta siempre al proveedor.
+    """
+    global _cache, _cache_failed
+    if not FORECAST_CACHE_ENABLED or _cache_failed:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = SQLiteTTLCache(FORECAST_CACHE_PATH, FORECAST_CACHE_MAX_BYTES)
+            except Exception as e:
+                print(f"  --- ADVERTENCIA: No se pudo abrir la caché de pronósticos ({e}). Se continúa sin caché.")
+                _cache_failed = True
+        return _cache
+
+
+def forecast_issue_time(provider: str, now: Optional[float] = None) -> str:
+    """
+    Inicio (UTC) del ciclo de actualización vigente del proveedor.
+    """
+    interval = PROVIDER_UPDATE_INTERVAL_SECONDS[provider]
+    now = time.time() if now is None else now
+    issued = int(now // interval) * interval
+    return datetime.fromtimestamp(issued, tz=timezone.utc).strftime('%Y-%m-%dT%H:%MZ')
+
+
+def forecast_cache_key(provider: str, lat: float, lon: float) -> str:
+    cell_lat, cell_lon = snap_to_grid(lat, lon, GRID_RESOLUTION_DEG)
+    return f"{provider}|{cell_lat:.4f}|{cell_lon:.4f}|{forecast_issue_time(provider)}"
+
+
+def get_cached_forecast(provider: str, lat: float, lon: float) -> Optional[Dict]:
+    cache = get_forecast_cache()
+    if cache is None:
+        return None
+    data = cache.get_json(forecast_cache_key(provider, lat, lon))
+    if data is not None:
+        increment('forecast_cache_hits')
+        print(f"  --- CACHÉ Pronóstico de {provider} recuperado de la caché local.")
+    else:
+        increment('forecast_cache_misses')
+    return data
+
+
+def has_cached_forecast(provider: str, lat: float, lon: float) -> bool:
+    cache = get_forecast_cache()
+    return cache is not None and cache.contains(forecast_cache_key(provider, lat, lon))
+
+
+def store_forecast(provider: str, lat: float, lon: float, data: Dict) -> None:
+    cache = get_forecast_cache()
+    if cache is not None:
+        cache.set_json(forecast_cache_key(provider, lat, lon), data, ttl=PROVIDER_UPDATE_INTERVAL_SECONDS[provider])
+
+
+def forecast_cache_stats() -> Optional[Dict[str, int]]:
+    return _cache.stats() if _cache is not None else None
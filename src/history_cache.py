@@ -0,0 +1,244 @@
+# src/history_cache.py
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from analyze import calculate_historical_threshold, build_threshold_table, month_hour_index
+from constants import (
+    HISTORICAL_CACHE_DIR,
+    HISTORICAL_STREAMING_MIN_BYTES,
+    HISTORICAL_STREAMING_CHUNK_ROWS,
+    HISTORICAL_SKETCH_RANGE,
+    HISTORICAL_SKETCH_BIN_WIDTH
+)
+from extract import load_historical_data, iter_historical_chunks
+from quantile_sketch import HistogramSketch
+from transform import calculate_ith
+
+# =======================================================================
+# ARTEFACTO DEL HISTÓRICO (Columnar + Estadísticas de Umbral)
+# =======================================================================
+# El CSV histórico solo cambia cuando se reemplaza el archivo. Se guarda una copia
+# limpia (con ITH) en formato columnar binario (.npz) y, al lado, un JSON con las
+# estadísticas de umbral y la identidad del CSV (tamaño, mtime y sha256).
+# En el arranque basta con comparar tamaño/mtime: solo si cambiaron se calcula
+# el hash, y solo si el hash cambió se vuelve a procesar el CSV.
+#
+# Los archivos grandes (décadas de datos horarios) se procesan en streaming: se leen
+# por bloques y el P75 se estima con un histograma de memoria constante. En ese modo
+# el artefacto guarda solo las estadísticas, no la copia columnar.
+#
+# Si solo cambia el cálculo de las estadísticas (ARTIFACT_VERSION) y el CSV sigue
+# siendo el mismo, las estadísticas se recalculan desde la copia columnar sin volver
+# a parsear el CSV. COLUMNAR_VERSION identifica el formato del .npz.
+
+ARTIFACT_VERSION = 3
+COLUMNAR_VERSION = 1
+HISTORY_COLUMNS = ['temperature_2m', 'relative_humidity_2m', 'ITH']
+
+
+def _artifact_paths(file_path: str) -> Dict[str, str]:
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return {
+        'data': os.path.join(HISTORICAL_CACHE_DIR, f"{name}.npz"),
+        'meta': os.path.join(HISTORICAL_CACHE_DIR, f"{name}.meta.json"),
+    }
+
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: str, data: Dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(meta_path: str, any_version: bool = False) -> Optional[Dict]:
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta if any_version or meta.get('version') == ARTIFACT_VERSION else None
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(file_path: str, meta: Optional[Dict], paths: Dict[str, str]) -> bool:
+    """
+    Verifica si el artefacto corresponde al CSV actual. Si solo cambió el mtime
+    (p. ej. el archivo se copió de nuevo) pero no el contenido, actualiza el meta.
+    """
+    if meta is None or (meta['columnar'] and not os.path.exists(paths['data'])):
+        return False
+    stat = os.stat(file_path)
+    if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    if meta['size'] != stat.st_size or meta['sha256'] != _file_sha256(file_path):
+        return False
+    meta['mtime_ns'] = stat.st_mtime_ns
+    _write_json_atomic(paths['meta'], meta)
+    return True
+
+
+def _load_columnar(data_path: str) -> pd.DataFrame:
+    """
+    Carga el histórico limpio con ITH desde la copia columnar (.npz).
+    """
+    with np.load(data_path) as data:
+        df = pd.DataFrame({col: data[col] for col in HISTORY_COLUMNS})
+        df.insert(0, 'time', pd.to_datetime(data['time']))
+    return df
+
+
+def _reusable_columnar(paths: Dict[str, str], sha256: str) -> bool:
+    """
+    La copia columnar sirve si salió del mismo CSV (mismo sha256) y con el formato actual,
+    aunque el meta sea de otra versión de las estadísticas.
+    """
+    previous = _read_meta(paths['meta'], any_version=True)
+    return (previous is not None
+            and previous.get('columnar')
+            and previous.get('columnar_version') == COLUMNAR_VERSION
+            and previous.get('sha256') == sha256
+            and os.path.exists(paths['data']))
+
+
+def compute_historical_stats(df_historical_ith: pd.DataFrame) -> Optional[Dict]:
+    """
+    Estadísticas de umbral que se persisten junto al histórico limpio.
+    """
+    threshold = calculate_historical_threshold(df_historical_ith)
+    if threshold is None:
+        return None
+    threshold_table = build_threshold_table(df_historical_ith)
+    return {
+        'p75': float(threshold),
+        # Tabla 12 x 24 (mes, hora) del P75; se guarda como lista para el JSON
+        'threshold_table': threshold_table.tolist() if threshold_table is not None else None,
+    }
+
+
+def compute_historical_stats_streaming(file_path: str, quantile: float = 0.75) -> Optional[Dict]:
+    """
+    Misma salida que compute_historical_stats, pero leyendo el CSV por bloques y
+    alimentando un histograma mes x hora (memoria plana sin importar el tamaño).
+    El P75 global sale de combinar los 288 slots del mismo sketch.
+    """
+    sketch = HistogramSketch(*HISTORICAL_SKETCH_RANGE, HISTORICAL_SKETCH_BIN_WIDTH, slots=12 * 24)
+    rows = 0
+    for chunk in iter_historical_chunks(file_path, HISTORICAL_STREAMING_CHUNK_ROWS):
+        chunk = calculate_ith(chunk, temp_col='temperature_2m', hum_col='relative_humidity_2m')
+        if 'ITH' not in chunk.columns:
+            continue
+        month_index, hour_of_day = month_hour_index(chunk['time'])
+        sketch.update(pd.to_numeric(chunk['ITH'], errors='coerce').to_numpy(dtype=np.float64),
+                      slot=month_index * 24 + hour_of_day)
+        rows += len(chunk)
+
+    threshold = sketch.quantile(quantile)
+    if threshold is None:
+        print("Advertencia: Histórico vacío o ITH faltante. Umbral no calculado.")
+        return None
+
+    table = np.full((12, 24), threshold, dtype=np.float64)
+    for slot in range(12 * 24):
+        slot_threshold = sketch.quantile(quantile, slot=slot)
+        if slot_threshold is not None:
+            table[slot // 24, slot % 24] = slot_threshold
+
+    print(f"EXITO: Umbral de Riesgo Histórico : {threshold:.2f} "
+          f"(streaming, {rows} registros, error máx. ±{sketch.error_bound:.2f})")
+    return {
+        'p75': float(threshold),
+        'threshold_table': table.tolist(),
+        'quantile_error_bound': sketch.error_bound,
+    }
+
+
+def rebuild_history_artifact(file_path: str) -> Optional[Dict]:
+    """
+    Procesa el CSV (limpieza + ITH + umbral) y guarda el artefacto columnar y su meta.
+    Por encima de HISTORICAL_STREAMING_MIN_BYTES usa el cálculo en streaming y solo
+    guarda las estadísticas. Si la copia columnar vigente salió del mismo CSV, se
+    reutiliza en lugar de volver a parsear el CSV.
+    Devuelve el meta (con las estadísticas) o None si el histórico no es válido.
+    """
+    paths = _artifact_paths(file_path)
+    stat = os.stat(file_path)
+    sha256 = _file_sha256(file_path)
+    columnar = stat.st_size < HISTORICAL_STREAMING_MIN_BYTES
+
+    reuse_columnar = columnar and _reusable_columnar(paths, sha256)
+
+    if reuse_columnar:
+        # Mismo CSV: solo cambió el cálculo de las estadísticas
+        df_historical_ith = _load_columnar(paths['data'])
+        print(f"  --- EXITO Histórico limpio cargado desde la copia columnar: {len(df_historical_ith)} registros.")
+        stats = compute_historical_stats(df_historical_ith)
+    elif columnar:
+        # Ruta exacta: el archivo cabe cómodamente en memoria
+        df_historical = load_historical_data(file_path)
+        if df_historical.empty:
+            return None
+        df_historical_ith = calculate_ith(df_historical, temp_col='temperature_2m', hum_col='relative_humidity_2m')
+        stats = compute_historical_stats(df_historical_ith)
+    else:
+        stats = compute_historical_stats_streaming(file_path)
+    if stats is None:
+        return None
+
+    os.makedirs(HISTORICAL_CACHE_DIR, exist_ok=True)
+    if columnar and not reuse_columnar:
+        tmp_data = f"{paths['data']}.tmp.npz"
+        np.savez(
+            tmp_data,
+            time=df_historical_ith['time'].to_numpy(dtype='datetime64[ns]').astype(np.int64),
+            **{col: pd.to_numeric(df_historical_ith[col], errors='coerce').to_numpy(dtype=np.float64) for col in HISTORY_COLUMNS}
+        )
+        os.replace(tmp_data, paths['data'])
+
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'source': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256,
+        'columnar': columnar,
+        'columnar_version': COLUMNAR_VERSION if columnar else None,
+        'rows': len(df_historical_ith) if columnar else None,
+        'stats': stats,
+    }
+    _write_json_atomic(paths['meta'], meta)
+    print(f"  --- EXITO Artefacto del histórico reconstruido en {HISTORICAL_CACHE_DIR}.")
+    return meta
+
+
+def get_historical_stats(file_path: str) -> Optional[Dict]:
+    """
+    Devuelve las estadísticas de umbral del histórico ({'p75': ..., 'threshold_table': ...}).
+    Si el artefacto está vigente es solo una verificación de metadatos; si el CSV
+    cambió (o no hay artefacto) se reconstruye.
+    """
+    if not os.path.exists(file_path):
+        print(f"  --- ERROR: No se encontró el archivo histórico en la ruta: {file_path}")
+        return None
+
+    paths = _artifact_paths(file_path)
+    meta = _read_meta(paths['meta'])
+    if _is_fresh(file_path, meta, paths):
+        print(f"  --- EXITO Estadísticas del histórico vigentes (caché, {os.path.basename(file_path)}).")
+        return meta['stats']
+
+    meta = rebuild_history_artifact(file_path)
+    return meta['stats'] if meta else None
+
@@ -1,25 +1,65 @@
 # src/ia_narrative.py
+import numpy as np
 import pandas as pd
-from google import genai
-from os import getenv
-from dotenv import load_dotenv
-from typing import Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
 
-# Carga la API Key de Gemini
-load_dotenv()
-GEMINI_API_KEY = getenv("GEMINI_API_KEY")
-
-# Inicializa el cliente de Gemini (Global)
-# Si la clave es inválida o no está, 'client' será None
-client = None
-try:
-    if GEMINI_API_KEY:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-    else:
-        print("ADVERTENCIA: GEMINI_API_KEY no encontrada. La IA usará un mensaje de fallback.")
-except Exception as e:
-    print(f"Error inicializando el cliente Gemini: {e}")
+from constants import (
+    NARRATIVE_BATCH_SIZE,
+    NARRATIVE_MAX_WORKERS,
+    NARRATIVE_REQUESTS_PER_MINUTE,
+    NARRATIVE_MAX_RETRIES,
+    NARRATIVE_RETRY_BASE_SECONDS
+)
+from analyze import RISK_HIGH, RISK_MODERATE, encode_risk_episodes, describe_risk_episodes
+from forecast_block import ForecastBlock, as_forecast_block
+from metrics import get_histogram, increment, log_event
+from ratelimit import TokenBucket, backoff_delay
+
+from narrative_cache import FARM_NAME_PLACEHOLDER, get_narrative_cache, narrative_signature
+from settings import get_settings
+
+# Cliente de Gemini (Global), creado en el primer uso: importar google.genai es
+# lento, así que ni el SDK ni el cliente se cargan al importar este módulo.
+# Si la clave es inválida o no está, el cliente será None
+_client = None
+_client_ready = False
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Devuelve el cliente de Gemini (creándolo la primera vez) o None si no hay clave."""
+    global _client, _client_ready
+    if _client_ready:
+        return _client
+    with _client_lock:
+        if not _client_ready:
+            api_key = get_settings().gemini_api_key
+            try:
+                if api_key:
+                    from google import genai
+                    _client = genai.Client(api_key=api_key)
+                else:
+                    print("ADVERTENCIA: GEMINI_API_KEY no encontrada. La IA usará un mensaje de fallback.")
+            except Exception as e:
+                print(f"Error inicializando el cliente Gemini: {e}")
+            _client_ready = True
+    return _client
+
+
+def set_client(client) -> None:
+    """Reemplaza el cliente de Gemini (p. ej. por uno simulado en los benchmarks)."""
+    global _client, _client_ready
+    with _client_lock:
+        _client = client
+        _client_ready = True
+
+# Límite de peticiones por minuto compartido por todos los hilos que llaman al modelo
+_rate_limiter = TokenBucket(NARRATIVE_REQUESTS_PER_MINUTE / 60.0, capacity=NARRATIVE_MAX_WORKERS)
 
 # --- DOCUMENTACIÓN DEL USUARIO (Plan de Prevención Limpio) ---
 # Este texto actúa como la 'memoria' de la IA para las recomendaciones
@@ -78,42 +118,63 @@ PROTOCOLO_4_NOMBRE: Botiquín de Emergencia
 PROTOCOLO_4_ACCION: Mantener sales de rehidratación oral y electrolitos disponibles para la atención inmediata de animales postrados o deshidratados severamente.
 CONCLUSION: Ejecutar estas medidas de forma proactiva garantiza sostener los niveles productivos y mitigar pérdidas bajo condiciones ambientales adversas."""
 
-def generate_risk_narrative(df_forecast: pd.DataFrame, user_type: str, ith_threshold: float, farm_name: str) -> Tuple[str, str]:
+# --- INSTRUCCIONES DEL MODELO ---
+SYSTEM_INSTRUCTION = (
+    "Eres un Analista de Datos Agrícola experto en Estrés Térmico (ITH). "
+    "Tu tarea es generar una alerta de correo electrónico proactiva, profesional y fácil de entender usando las etiquetas <p>. "
+    "Formatea tu respuesta de esta manera EXACTA: '1. ASUNTO: [Tu Asunto]\n2. CUERPO: [Tu Cuerpo]'. "
+    "La información más importante son las horas de ALERTA/MODERADA y las recomendaciones específicas del 'CONTEXTO' para el tipo de ganado con 3 recomendaciones especificas."
+    "El mensaje debe ser claro, conciso y accionable no muy largo señalando en HTML las horas criticas de hoy y mañana en negruilla."
+    "No incluyas saludos ni despedidas en el cuerpo del mensaje."
+    "No uses h1 ni h2 en el cuerpo del mensaje."
+    "Haz un salto de línea cada vez que haya una alerta de ITH."
+    "Al final da una recomendación general para el usuario si sobre el mejor momento para la reproducción."
+    f"Cuando menciones el nombre de la granja escribe exactamente {FARM_NAME_PLACEHOLDER}."
+)
+
+# Variante por lotes: la misma instrucción, pero con la respuesta como arreglo JSON
+BATCH_SYSTEM_INSTRUCTION = SYSTEM_INSTRUCTION.replace(
+    "Formatea tu respuesta de esta manera EXACTA: '1. ASUNTO: [Tu Asunto]\n2. CUERPO: [Tu Cuerpo]'. ",
+    "Recibirás los datos de VARIAS granjas, cada una con un ID. Responde ÚNICAMENTE con un arreglo JSON "
+    "con un objeto por granja: [{\"id\": \"<ID>\", \"asunto\": \"<Tu Asunto>\", \"cuerpo\": \"<Tu Cuerpo en HTML>\"}]. "
+)
+
+
+def _section_instruction(user_type: str) -> str:
+    return (
+        f"El cuerpo debe tener 3 secciones:\n"
+        f"I. Resumen: Riesgo general y ITH máximo.\n"
+        f"II. HOY (Acción Inmediata): Menciona y discute las HORAS CRÍTICAS de HOY (listadas arriba) y proporciona las recomendaciones de manejo del 'CONTEXTO' que apliquen a esas horas y al ganado '{user_type}'.\n"
+        f"III. MAÑANA (Planificación): Menciona las HORAS CRÍTICAS de MAÑANA y ofrece consejos de preparación. "
+        f"Si solo hay riesgo MODERADO, usa un tono de 'Advertencia de Prevención'."
+    )
+
+
+def _critical_episodes(forecast: ForecastBlock) -> pd.DataFrame:
+    episodes = encode_risk_episodes(forecast)
+    return episodes[episodes['level'] >= RISK_MODERATE]
+
+
+def _prepare_narrative_context(forecast: Union[ForecastBlock, pd.DataFrame], user_type: str, ith_threshold: float,
+                               max_ith: float) -> Dict:
     """
-    Genera el asunto y el cuerpo del correo utilizando el modelo de Gemini.
+    Resume las horas críticas de hoy y mañana y arma el bloque de datos de la
+    granja (con el marcador en lugar del nombre) y su firma para la caché.
     """
-    # === FIX 1: Verificación de cliente de Gemini ===
-    if client is None:
-        subject = f"ALERTA TEMP. - {farm_name} ({user_type})"
-        body = (f"El sistema de Inteligencia Artificial no está activo (GEMINI_API_KEY es inválida o falta).\n"
-                f"REPORTE MANUAL: Umbral de riesgo: {ith_threshold:.2f}. Máximo ITH pronosticado: {df_forecast['ITH'].max():.2f}\n"
-                f"Horas de ALTO riesgo (ITH > {ith_threshold:.2f}):\n"
-                f"{df_forecast[df_forecast['risk'].str.contains('ALTO')][['time', 'ITH']].to_string(index=False)}\n"
-                f"Por favor, active su clave API de Gemini para recibir las recomendaciones personalizadas.")
-        return subject, body
-
     # 1. Preparar los datos del pronóstico (Hoy y Mañana)
     now = pd.Timestamp(datetime.now().strftime('%Y-%m-%d'), tz='America/Bogota')
     
-    # Filtrar hoy y mañana
-    df_today = df_forecast[df_forecast['time'].dt.date == now.date()]
-    df_tomorrow = df_forecast[df_forecast['time'].dt.date == (now + pd.Timedelta(days=1)).date()]
-
-    # --- CAMBIO CLAVE: FILTRAR RIESGO ALTO Y MODERADO ---
-    # Esto filtra todas las filas que contengan 'ALTO' o 'MODERADO' en la columna 'risk'
-    df_risk_today_filtered = df_today[df_today['risk'].str.contains('ALTO|MODERADO', case=False, na=False)]
-    df_risk_tomorrow_filtered = df_tomorrow[df_tomorrow['risk'].str.contains('ALTO|MODERADO', case=False, na=False)]
-
-    # Formatear las horas críticas (concatenando ITH para mejor contexto)
-    risk_summary_today = "\n".join([
-        f"{row['time'].strftime('%H:%M')} (ITH: {row['ITH']:.1f}, {row['risk']})" 
-        for _, row in df_risk_today_filtered.iterrows()
-    ])
-    
-    risk_summary_tomorrow = "\n".join([
-        f"{row['time'].strftime('%H:%M')} (ITH: {row['ITH']:.1f}, {row['risk']})" 
-        for _, row in df_risk_tomorrow_filtered.iterrows()
-    ])
+    # Filtrar hoy y mañana (día de cada hora comparado como entero, sin accesores .dt)
+    forecast = as_forecast_block(forecast)
+    days = forecast.days()
+    today = np.datetime64(now.date().isoformat(), 'D').astype(np.int64)
+    forecast_today = forecast.take(days == today)
+    forecast_tomorrow = forecast.take(days == today + 1)
+
+    # Episodios (tramos de horas consecutivas con el mismo nivel) con riesgo ALTO o MODERADO:
+    # una línea por tramo en lugar de una por hora
+    risk_summary_today = describe_risk_episodes(_critical_episodes(forecast_today))
+    risk_summary_tomorrow = describe_risk_episodes(_critical_episodes(forecast_tomorrow))
     
     # Si no hay riesgo, usar un mensaje claro
     if not risk_summary_today:
@@ -121,53 +182,150 @@ def generate_risk_narrative(df_forecast: pd.DataFrame, user_type: str, ith_thres
     if not risk_summary_tomorrow:
         risk_summary_tomorrow = "No se proyecta riesgo MODERADO o ALTO para mañana."
 
-    # 2. Construir el Prompt
-    system_instruction = (
-        "Eres un Analista de Datos Agrícola experto en Estrés Térmico (ITH). "
-        "Tu tarea es generar una alerta de correo electrónico proactiva, profesional y fácil de entender usando las etiquetas <p>. "
-        "Formatea tu respuesta de esta manera EXACTA: '1. ASUNTO: [Tu Asunto]\n2. CUERPO: [Tu Cuerpo]'. "
-        "La información más importante son las horas de ALERTA/MODERADA y las recomendaciones específicas del 'CONTEXTO' para el tipo de ganado con 3 recomendaciones especificas."
-        "El mensaje debe ser claro, conciso y accionable no muy largo señalando en HTML las horas criticas de hoy y mañana en negruilla."
-        "No incluyas saludos ni despedidas en el cuerpo del mensaje."
-        "No uses h1 ni h2 en el cuerpo del mensaje."
-        "Haz un salto de línea cada vez que haya una alerta de ITH."
-        "Al final da una recomendación general para el usuario si sobre el mejor momento para la reproducción."
-        
+    data_block = (
+        f"Granja: {FARM_NAME_PLACEHOLDER}, Tipo: {user_type}, Umbral Histórico (P75): {ith_threshold:.2f}\n"
+        f"Máximo ITH pronosticado en 48h: {max_ith:.2f}\n\n"
+        f"RESUMEN DE HORAS CRÍTICAS (MODERADO o superior, por episodios: inicio–fin, ITH máximo y nivel):\n"
+        f"HOY:\n{risk_summary_today}\n\n"
+        f"MAÑANA:\n{risk_summary_tomorrow}\n\n"
     )
+    # Caché por contenido: fincas con el mismo tipo y el mismo resumen de riesgo
+    # comparten la narrativa; el nombre de la finca se sustituye al recuperarla.
+    signature = narrative_signature(user_type, risk_summary_today, risk_summary_tomorrow,
+                                    ith_threshold, max_ith, now.date().isoformat())
+    return {'data_block': data_block, 'signature': signature}
+
+
+class Narrative(NamedTuple):
+    """
+    Asunto y cuerpo de una alerta. `from_model` es False cuando el texto no salió del
+    modelo (error de la API o Gemini no configurado): esa alerta no cuenta como
+    notificación del perfil de riesgo y la finca se vuelve a alertar en la próxima corrida.
+    """
+    subject: str
+    body: str
+    from_model: bool = True
+
+
+def _fill_farm_name(narrative: Tuple[str, str], farm_name: str) -> Narrative:
+    return Narrative(narrative[0].replace(FARM_NAME_PLACEHOLDER, farm_name),
+                     narrative[1].replace(FARM_NAME_PLACEHOLDER, farm_name),
+                     getattr(narrative, 'from_model', True))
+
+
+def _fallback_without_ai(forecast: Union[ForecastBlock, pd.DataFrame], user_type: str, ith_threshold: float,
+                        farm_name: str, max_ith: float) -> Narrative:
+    subject = f"ALERTA TEMP. - {farm_name} ({user_type})"
+    episodes = encode_risk_episodes(forecast)
+    high_episodes = episodes[episodes['level'] >= RISK_HIGH]
+    body = (f"El sistema de Inteligencia Artificial no está activo (GEMINI_API_KEY es inválida o falta).\n"
+            f"REPORTE MANUAL: Umbral de riesgo: {ith_threshold:.2f}. Máximo ITH pronosticado: {max_ith:.2f}\n"
+            f"Episodios de riesgo ALTO o superior (ITH > {ith_threshold:.2f} o bandas del plan):\n"
+            f"{describe_risk_episodes(high_episodes, time_format='%d/%m %H:%M') or 'Ninguno.'}\n"
+            f"Por favor, active su clave API de Gemini para recibir las recomendaciones personalizadas.")
+    return Narrative(subject, body, from_model=False)
 
+
+def generate_risk_narrative(forecast: Union[ForecastBlock, pd.DataFrame], user_type: str, ith_threshold: float,
+                            farm_name: str, max_ith: Optional[float] = None) -> Narrative:
+    """
+    Genera el asunto y el cuerpo del correo utilizando el modelo de Gemini.
+    `forecast` es el ForecastBlock analizado de la celda (o un DataFrame con 'ITH' y 'risk').
+    `max_ith` permite reutilizar el máximo ya calculado en el análisis por lotes.
+    """
+    forecast = as_forecast_block(forecast)
+    if max_ith is None:
+        max_ith = forecast.max_ith()
+
+    # === FIX 1: Verificación de cliente de Gemini ===
+    if get_client() is None:
+        increment('narrative_fallback_no_ai')
+        return _fallback_without_ai(forecast, user_type, ith_threshold, farm_name, max_ith)
+
+    context = _prepare_narrative_context(forecast, user_type, ith_threshold, max_ith)
+    narrative_cache = get_narrative_cache()
+
+    # 2. Construir el Prompt
     prompt = (
-        f"{system_instruction}\n\n"
+        f"{SYSTEM_INSTRUCTION}\n\n"
         f"{PREVENTION_DOCUMENTATION}\n\n"
         f"DATOS DE ANÁLISIS:\n"
-        f"Granja: {farm_name}, Tipo: {user_type}, Umbral Histórico (P75): {ith_threshold:.2f}\n"
-        f"Máximo ITH pronosticado en 48h: {df_forecast['ITH'].max():.2f}\n\n"
-        f"RESUMEN DE HORAS CRÍTICAS (MODERADO y ALTO):\n"
-        f"HOY:\n{risk_summary_today}\n\n"
-        f"MAÑANA:\n{risk_summary_tomorrow}\n\n"
-        f"INSTRUCCIÓN: Genera el ASUNTO y CUERPO de la alerta. El cuerpo debe tener 3 secciones:\n"
-        f"I. Resumen: Riesgo general y ITH máximo.\n"
-        f"II. HOY (Acción Inmediata): Menciona y discute las HORAS CRÍTICAS de HOY (listadas arriba) y proporciona las recomendaciones de manejo del 'CONTEXTO' que apliquen a esas horas y al ganado '{user_type}'.\n"
-        f"III. MAÑANA (Planificación): Menciona las HORAS CRÍTICAS de MAÑANA y ofrece consejos de preparación. "
-        f"Si solo hay riesgo MODERADO, usa un tono de 'Advertencia de Prevención'."
-        
+        f"{context['data_block']}"
+        f"INSTRUCCIÓN: Genera el ASUNTO y CUERPO de la alerta. {_section_instruction(user_type)}"
+    )
+
+    if narrative_cache is None:
+        return _generate_with_model(prompt, farm_name)
+
+    # Solo una llamada al modelo por firma, aunque varias fincas se generen a la vez
+    signature = context['signature']
+    with narrative_cache.inflight_lock(signature):
+        cached = narrative_cache.get(signature)
+        if cached is None:
+            return _generate_with_model(prompt, farm_name, narrative_cache, signature)
+    increment('narrative_cache_hits')
+    return _fill_farm_name(cached, farm_name)
+
+
+def _is_quota_error(error: Exception) -> bool:
+    """Errores de cuota/limite de tasa de Gemini (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    return getattr(error, 'code', None) == 429 or 'RESOURCE_EXHAUSTED' in str(error) or '429' in str(error)
+
+
+def _call_model(prompt: str, system_instruction: str = SYSTEM_INSTRUCTION, json_output: bool = False) -> str:
+    """
+    Llamada al modelo respetando el límite de peticiones por minuto compartido.
+    Reintenta con espera exponencial + jitter ante errores de cuota y registra la
+    latencia de cada intento en el histograma 'gemini_call_seconds' y los tokens
+    usados en los contadores 'gemini_prompt_tokens' / 'gemini_output_tokens'.
+    """
+    from google.genai import types
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json" if json_output else None
     )
+    for attempt in range(NARRATIVE_MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = get_client().models.generate_content(
+                model="gemini-2.5-flash",
+                contents=prompt,
+                config=config
+            )
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                increment('gemini_prompt_tokens', getattr(usage, 'prompt_token_count', None) or 0)
+                increment('gemini_output_tokens', getattr(usage, 'candidates_token_count', None) or 0)
+            return response.text
+        except Exception as e:
+            if not _is_quota_error(e) or attempt == NARRATIVE_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, base=NARRATIVE_RETRY_BASE_SECONDS)
+            print(f"  --- ALERTA Cuota de Gemini agotada. Reintentando en {delay:.1f}s (intento {attempt + 1}).")
+            increment('gemini_quota_retries')
+            time.sleep(delay)
+        finally:
+            get_histogram('gemini_call_seconds').observe(time.perf_counter() - started)
+
 
+def _generate_with_model(prompt: str, farm_name: str, narrative_cache=None, signature: Optional[str] = None) -> Narrative:
+    """
+    Llama al modelo y separa el asunto y el cuerpo. Si hay caché, guarda la
+    respuesta estructurada (con el marcador del nombre) bajo `signature`.
+    """
     try:
         # Llama al modelo
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(system_instruction=system_instruction)
-        )
+        response_text = _call_model(prompt)
         
         # === FIX 2: Separación robusta del Asunto y Cuerpo ===
         # Se busca el delimitador "1. ASUNTO:"
-        if not response.text:
+        if not response_text:
             raise ValueError("Respuesta de la IA vacía.")
 
         # Separar por el patrón de asunto
-        if "1. ASUNTO:" in response.text:
-            parts = response.text.split("1. ASUNTO:", 1)
+        if "1. ASUNTO:" in response_text:
+            parts = response_text.split("1. ASUNTO:", 1)
             full_content = parts[1].strip()
             
             # Separar el cuerpo que empieza con "2. CUERPO:"
@@ -175,14 +333,163 @@ def generate_risk_narrative(df_forecast: pd.DataFrame, user_type: str, ith_thres
                 subject_raw, body = full_content.split("2. CUERPO:", 1)
                 subject = subject_raw.strip().split('\n')[0].strip() # Tomar solo la primera línea del asunto
                 body = body.strip()
-                return subject, body
+                if narrative_cache is not None:
+                    narrative_cache.set(signature, subject, body)
+                return _fill_farm_name((subject, body), farm_name)
         
         # Fallback si el formato de la IA no es el esperado
         print("ADVERTENCIA: La IA no siguió el formato de respuesta esperado (1. ASUNTO: / 2. CUERPO:).")
+        increment('narrative_unstructured')
         subject = f"ALERTA IA NO ESTRUCTURADA - {farm_name}"
-        return subject, response.text 
+        return Narrative(subject, response_text.replace(FARM_NAME_PLACEHOLDER, farm_name))
 
     except Exception as e:
         print(f"--- ERROR CRÍTICO en la llamada a la API de Gemini: {e}")
+        increment('narrative_failures')
+        log_event('narrative_failure', error=str(e))
         # Retorna el mensaje de fallback en caso de cualquier excepción de la API.
-        return "ALERTA FALLIDA (Error API)", f"Error al generar la narrativa de la IA. Mensaje: {e}"
\ No newline at end of file
+        return Narrative("ALERTA FALLIDA (Error API)", f"Error al generar la narrativa de la IA. Mensaje: {e}",
+                         from_model=False)
+
+
+# --- GENERACIÓN CONCURRENTE (POOL DE HILOS) ---
+
+def generate_narratives_concurrently(jobs: List[Dict], max_workers: int = NARRATIVE_MAX_WORKERS) -> List[Narrative]:
+    """
+    Genera las narrativas de varias fincas en un pool de hilos que comparte el
+    cliente de Gemini. Cada job son los argumentos de generate_risk_narrative.
+    La concurrencia la acota `max_workers` y la tasa, el limitador de peticiones
+    por minuto. Los resultados se devuelven en el mismo orden de `jobs`.
+    """
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+        return list(executor.map(lambda job: generate_risk_narrative(**job), jobs))
+
+
+# --- GENERACIÓN POR LOTES (VARIAS GRANJAS POR PETICIÓN) ---
+
+def _parse_batch_response(response_text: str, expected_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Valida la respuesta JSON del lote. Devuelve {id: (asunto, cuerpo)} solo con
+    los elementos bien formados; los que falten se generan luego por separado.
+    """
+    text = (response_text or "").strip()
+    # Algunos modelos envuelven el JSON en un bloque ```json ... ```
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find('['):] if '[' in text else text
+    try:
+        items = json.loads(text)
+    except ValueError:
+        print("ADVERTENCIA: La respuesta del lote no es JSON válido.")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(expected_ids)
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        item_id, subject, body = item.get('id'), item.get('asunto'), item.get('cuerpo')
+        if (str(item_id) in expected and isinstance(subject, str) and isinstance(body, str)
+                and subject.strip() and body.strip()):
+            parsed[str(item_id)] = (subject.strip().split('\n')[0].strip(), body.strip())
+    return parsed
+
+
+def _generate_batch(items: List[Tuple[str, Dict]]) -> Dict[str, Tuple[str, str]]:
+    """
+    Una sola petición para K granjas: el plan de prevención y la instrucción de
+    sistema se envían una vez y cada granja aporta solo su bloque de datos.
+    `items` son pares (firma, job); devuelve {firma: (asunto, cuerpo)} con marcador.
+    """
+    ids = [f"G{i + 1}" for i in range(len(items))]
+    farm_blocks = "\n".join(
+        f"--- ID: {item_id} ---\n{job['context']['data_block']}"
+        for item_id, (_, job) in zip(ids, items)
+    )
+    user_types = sorted({str(job['user_type']) for _, job in items})
+    prompt = (
+        f"{BATCH_SYSTEM_INSTRUCTION}\n\n"
+        f"{PREVENTION_DOCUMENTATION}\n\n"
+        f"DATOS DE ANÁLISIS ({len(items)} granjas):\n"
+        f"{farm_blocks}\n"
+        f"INSTRUCCIÓN: Para CADA granja genera el ASUNTO y CUERPO de su alerta. "
+        f"{_section_instruction(' / '.join(user_types))} Usa el tipo de ganado indicado en los datos de cada granja."
+    )
+    try:
+        parsed = _parse_batch_response(_call_model(prompt, BATCH_SYSTEM_INSTRUCTION, json_output=True), ids)
+    except Exception as e:
+        print(f"--- ERROR en la llamada por lotes a Gemini ({len(items)} granjas): {e}")
+        increment('narrative_batch_failures')
+        log_event('narrative_batch_failure', farms=len(items), error=str(e))
+        return {}
+    return {signature: parsed[item_id] for item_id, (signature, _) in zip(ids, items) if item_id in parsed}
+
+
+def generate_narratives_batched(jobs: List[Dict], batch_size: int = NARRATIVE_BATCH_SIZE,
+                                max_workers: int = NARRATIVE_MAX_WORKERS) -> List[Narrative]:
+    """
+    Modo por lotes: agrupa las granjas (sin repetir firmas ni las que ya están en
+    caché) de a `batch_size` por petición y ejecuta los lotes en el pool de hilos.
+    Los elementos que el modelo omita o devuelva mal formados se generan con una
+    llamada individual. Devuelve los resultados en el orden de `jobs`.
+    """
+    if not jobs:
+        return []
+    if get_client() is None:
+        return generate_narratives_concurrently(jobs, max_workers)
+
+    narrative_cache = get_narrative_cache()
+    resolved: Dict[str, Tuple[str, str]] = {}
+    pending: Dict[str, Dict] = {}
+    contexts: Dict[Tuple, Dict] = {}
+    prepared = []
+    for job in jobs:
+        max_ith = job.get('max_ith')
+        if max_ith is None:
+            max_ith = as_forecast_block(job['forecast']).max_ith()
+        job = dict(job, max_ith=max_ith)
+        # Las fincas de una misma celda comparten el bloque: el resumen se arma una vez
+        context_key = (id(job['forecast']), job['user_type'], job['ith_threshold'], max_ith)
+        if context_key not in contexts:
+            contexts[context_key] = _prepare_narrative_context(job['forecast'], job['user_type'], job['ith_threshold'], max_ith)
+        job['context'] = contexts[context_key]
+        signature = job['context']['signature']
+        prepared.append(job)
+        if signature in resolved or signature in pending:
+            continue
+        cached = narrative_cache.get(signature) if narrative_cache is not None else None
+        if cached is not None:
+            increment('narrative_cache_hits')
+            resolved[signature] = cached
+        else:
+            pending[signature] = job
+
+    # 1. Lotes de K granjas por petición, en paralelo
+    pending_items = list(pending.items())
+    batches = [pending_items[i:i + batch_size] for i in range(0, len(pending_items), batch_size)]
+    if batches:
+        print(f"    > {len(pending_items)} narrativas distintas en {len(batches)} peticiones por lotes "
+              f"({len(jobs) - len(pending_items)} resueltas por caché o firma repetida).")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            for batch_result in executor.map(_generate_batch, batches):
+                for signature, narrative in batch_result.items():
+                    resolved[signature] = narrative
+                    if narrative_cache is not None:
+                        narrative_cache.set(signature, *narrative)
+
+    # 2. Fallback: llamada individual para lo que el lote no resolvió
+    failed = [job for signature, job in pending_items if signature not in resolved]
+    if failed:
+        print(f"    > {len(failed)} narrativas no válidas en el lote. Generando por separado...")
+        increment('narrative_batch_fallbacks', len(failed))
+        single_jobs = [{key: job[key] for key in ('forecast', 'user_type', 'ith_threshold', 'max_ith')}
+                       for job in failed]
+        for job, narrative in zip(failed, generate_narratives_concurrently(
+                [dict(single, farm_name=FARM_NAME_PLACEHOLDER) for single in single_jobs], max_workers)):
+            resolved[job['context']['signature']] = narrative
+
+    return [_fill_farm_name(resolved[job['context']['signature']], job['farm_name']) for job in prepared]
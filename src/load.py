@@ -1,51 +1,319 @@
 # src/load.py (CORREGIDO Y COMPLETO PARA HTML)
+import base64
 import smtplib
 import ssl
-from os import getenv
-from dotenv import load_dotenv
+import queue
+import threading
+import uuid
 from email.mime.multipart import MIMEMultipart # Necesario para correos con múltiples formatos
 from email.mime.text import MIMEText           # Necesario para definir el cuerpo como HTML
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from constants import SMTP_POOL_SIZE, SMTP_MAX_MESSAGES_PER_SESSION
+from metrics import increment, log_event
+from settings import get_settings
+
+
+class DeliveryResult(NamedTuple):
+    """Resultado del envío a un destinatario."""
+    recipient: str
+    success: bool
+    error: Optional[str] = None
+
+
+def credentials_configured() -> bool:
+    """True si hay remitente y clave (o un servidor sin autenticación, sin STARTTLS)."""
+    settings = get_settings()
+    return bool(settings.email_user) and (bool(settings.email_pass) or not settings.smtp_starttls)
+
+
+def build_alert_message(recipient_email: str, subject: str, html_body: str) -> str:
+    """
+    Construye el mensaje MIME (HTML) serializado, listo para sendmail.
+    """
+    # 1. Crear el objeto MIME principal
+    message = MIMEMultipart("alternative") # 'alternative' permite que el cliente elija (texto o html)
+    message["From"] = get_settings().email_user
+    message["To"] = recipient_email
+    message["Subject"] = subject
+
+    # 2. Adjuntar la parte HTML
+    html_part = MIMEText(html_body, "html") # <-- Se define el tipo MIME como HTML
+    message.attach(html_part)
+    return message.as_string()
+
+
+# --- MENSAJE MIME PRECOMPILADO (ENVÍO MASIVO) ---
+# Todas las alertas tienen la misma estructura (multipart/alternative con una sola
+# parte HTML en UTF-8/base64), así que el mensaje se arma directamente en bytes a
+# partir de segmentos fijos, sin crear ni serializar objetos MIMEMultipart.
+
+CRLF = "\r\n"
+
+
+def _encode_header(value: str) -> str:
+    """
+    Codifica el asunto según RFC 2047 (palabras base64 en UTF-8 de hasta 45 bytes,
+    sin partir caracteres). Es mucho más barato que email.header.Header en lotes
+    grandes. Los asuntos ASCII cortos van tal cual.
+    """
+    # Sin saltos de línea en el encabezado (el asunto viene del modelo)
+    value = " ".join(str(value).split())
+    if value.isascii() and len(value) < 900:
+        return value
+    encoded = value.encode('utf-8')
+    if len(encoded) <= 45:
+        return f"=?utf-8?b?{base64.b64encode(encoded).decode('ascii')}?="
+    words, chunk, size = [], [], 0
+    for char in value:
+        char_bytes = char.encode('utf-8')
+        if size + len(char_bytes) > 45:
+            words.append(b"".join(chunk))
+            chunk, size = [], 0
+        chunk.append(char_bytes)
+        size += len(char_bytes)
+    words.append(b"".join(chunk))
+    return (CRLF + " ").join(f"=?utf-8?b?{base64.b64encode(word).decode('ascii')}?=" for word in words)
+
+
+def _make_boundary() -> str:
+    """
+    Delimitador MIME con el mismo formato que usa el paquete email ('=' * 15 +
+    token + '=='). La línea delimitadora empieza con '--', y '-' no existe en el
+    alfabeto base64: el cuerpo codificado nunca la contiene.
+    """
+    return f"{'=' * 15}{uuid.uuid4().hex}=="
+
+
+class MessageFrame:
+    """
+    Segmentos estáticos del mensaje (encabezados MIME y delimitadores) calculados
+    una vez. render() solo agrega destinatario, asunto y el cuerpo en base64.
+    """
+
+    def __init__(self, sender: Optional[str] = None, boundary: Optional[str] = None):
+        self.sender = sender if sender is not None else (get_settings().email_user or "")
+        self.boundary = boundary or _make_boundary()
+        self.head = (
+            f'Content-Type: multipart/alternative; boundary="{self.boundary}"{CRLF}'
+            f"MIME-Version: 1.0{CRLF}"
+            f"From: {self.sender}{CRLF}"
+        ).encode('ascii')
+        self.part_head = (
+            f"{CRLF}--{self.boundary}{CRLF}"
+            f'Content-Type: text/html; charset="utf-8"{CRLF}'
+            f"MIME-Version: 1.0{CRLF}"
+            f"Content-Transfer-Encoding: base64{CRLF}{CRLF}"
+        ).encode('ascii')
+        self.tail = f"{CRLF}--{self.boundary}--{CRLF}".encode('ascii')
+
+    def render(self, recipient_email: str, subject: str, html_body: str) -> bytes:
+        # El delimitador usa '=' y '-', que nunca aparecen juntos en base64
+        encoded = base64.b64encode(html_body.encode('utf-8'))
+        body = b"\r\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76)) + b"\r\n"
+        headers = f"To: {recipient_email}{CRLF}Subject: {_encode_header(subject)}{CRLF}".encode('utf-8')
+        return b"".join((self.head, headers, self.part_head, body, self.tail))
+
+
+# --- SESIÓN SMTP REUTILIZABLE ---
+
+class SMTPSession:
+    """
+    Conexión SMTP autenticada y de larga duración.
+
+    Envía muchos mensajes por la misma conexión (un solo STARTTLS + login) y se
+    reconecta de forma transparente si el servidor la cierra o responde 421.
+    Tras SMTP_MAX_MESSAGES_PER_SESSION envíos la recicla para no chocar con los
+    límites por conexión del proveedor.
+    """
+
+    def __init__(self, max_messages: int = SMTP_MAX_MESSAGES_PER_SESSION):
+        self.max_messages = max_messages
+        self._server: Optional[smtplib.SMTP] = None
+        self._sent = 0
+
+    def _connect(self) -> None:
+        settings = get_settings()
+        server = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=30)
+        if settings.smtp_starttls:
+            server.starttls(context=ssl.create_default_context())
+            server.login(settings.email_user, settings.email_pass)
+        self._server = server
+        self._sent = 0
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                # Conexión ya caída: quit() no llega a cerrar el socket
+                self._server.close()
+            self._server = None
+
+    def send(self, recipient_email: str, message) -> None:
+        """
+        Envía un mensaje ya serializado (str, o bytes con fines de línea CRLF). Reintenta una vez con una conexión nueva si
+        la actual se cayó (desconexión o 421, también cuando el 421 llega en RCPT y rechaza a
+        todos los destinatarios); los demás errores se propagan.
+        """
+        for attempt in range(2):
+            if self._server is None or self._sent >= self.max_messages:
+                self.close()
+                self._connect()
+            try:
+                self._server.sendmail(get_settings().email_user, recipient_email, message)
+                self._sent += 1
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                error = e
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    raise
+                error = e
+            except smtplib.SMTPRecipientsRefused as e:
+                # smtplib cierra la conexión al recibir 421 en RCPT: es una sesión caída
+                if not e.recipients or any(code != 421 for code, _ in e.recipients.values()):
+                    raise
+                error = e
+            # La conexión caída se cierra (quit/close ignoran sus errores) antes de soltarla
+            self.close()
+            if attempt == 1:
+                raise error
 
-load_dotenv() 
-EMAIL_SENDER = getenv("EMAIL_USER")
-EMAIL_APP_PASSWORD = getenv("EMAIL_PASS")
 
 def send_email_alert(recipient_email: str, subject: str, html_body: str) -> bool:
     """
     Envía un correo electrónico de alerta con contenido HTML.
     """
-    if not EMAIL_SENDER or not EMAIL_APP_PASSWORD:
+    if not credentials_configured():
         print("---- ERROR: Credenciales de email no configuradas en .env.")
         return False
-        
-    smtp_server = "smtp.gmail.com"
-    port = 587
-    context = ssl.create_default_context()
 
+    session = SMTPSession()
     try:
-        # 1. Crear el objeto MIME principal
-        message = MIMEMultipart("alternative") # 'alternative' permite que el cliente elija (texto o html)
-        message["From"] = EMAIL_SENDER
-        message["To"] = recipient_email
-        message["Subject"] = subject
-
-        # 2. Adjuntar la parte HTML
-        html_part = MIMEText(html_body, "html") # <-- Se define el tipo MIME como HTML
-        message.attach(html_part)
-
-        # 3. Conexión y envío
-        with smtplib.SMTP(smtp_server, port) as server:
-            server.starttls(context=context)
-            server.login(EMAIL_SENDER, EMAIL_APP_PASSWORD)
-            # sendmail ahora usa message.as_string()
-            server.sendmail(EMAIL_SENDER, recipient_email, message.as_string())
-
-            print(f"    --- EXITO Alerta HTML enviada a: {recipient_email}")
-            return True
+        # Conexión y envío
+        session.send(recipient_email, build_alert_message(recipient_email, subject, html_body))
+        print(f"    --- EXITO Alerta HTML enviada a: {recipient_email}")
+        return True
 
     except smtplib.SMTPAuthenticationError:
         print(f"    ---- FALLO DE AUTENTICACIÓN. Revisa tu App Password.")
         return False
     except Exception as e:
         print(f"    ---- ERROR al enviar correo HTML a {recipient_email}: {e}")
-        return False
\ No newline at end of file
+        return False
+    finally:
+        session.close()
+
+
+# --- ENVÍO MASIVO CON POOL DE SESIONES ---
+
+def send_email_batch(messages: Iterable[Tuple[str, str, str]], pool_size: int = SMTP_POOL_SIZE) -> List[DeliveryResult]:
+    """
+    Envía un lote de alertas (destinatario, asunto, html) usando un pequeño pool
+    de sesiones SMTP autenticadas: cada hilo mantiene su propia conexión y envía
+    muchos mensajes por ella.
+
+    Devuelve un DeliveryResult por mensaje, en el mismo orden de entrada.
+    """
+    messages = list(messages)
+    if not credentials_configured():
+        print("---- ERROR: Credenciales de email no configuradas en .env.")
+        return [DeliveryResult(recipient, False, "Credenciales no configuradas") for recipient, _, _ in messages]
+    frame = MessageFrame()
+    return send_rendered_batch(
+        [(recipient, frame.render(recipient, subject, html_body)) for recipient, subject, html_body in messages],
+        pool_size
+    )
+
+
+def send_rendered_batch(messages: Iterable[Tuple[str, bytes]], pool_size: int = SMTP_POOL_SIZE,
+                        before_send: Optional[Callable[[int], None]] = None,
+                        on_result: Optional[Callable[[int, DeliveryResult], None]] = None) -> List[DeliveryResult]:
+    """
+    Igual que send_email_batch, pero con los mensajes ya serializados
+    (destinatario, bytes MIME) por la etapa de renderizado (render.py).
+
+    `before_send(index)` se llama (desde el hilo del pool) justo antes de entregar
+    cada mensaje al servidor y `on_result(index, resultado)` apenas se conoce su
+    resultado; los índices se toman en orden creciente. La bitácora de corridas los
+    usa para no reenviar un mensaje si el proceso se interrumpe.
+    """
+    messages = list(messages)
+    if not credentials_configured():
+        print("---- ERROR: Credenciales de email no configuradas en .env.")
+        return [DeliveryResult(recipient, False, "Credenciales no configuradas") for recipient, _ in messages]
+    if not messages:
+        return []
+
+    results: List[Optional[DeliveryResult]] = [None] * len(messages)
+    pending = queue.Queue()
+    for index in range(len(messages)):
+        pending.put(index)
+    auth_failed = threading.Event()
+
+    def _worker() -> None:
+        session = SMTPSession()
+        try:
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                recipient, message = messages[index]
+                if auth_failed.is_set():
+                    results[index] = DeliveryResult(recipient, False, "Fallo de autenticación SMTP")
+                else:
+                    try:
+                        if before_send is not None:
+                            before_send(index)
+                    except Exception as e:
+                        results[index] = DeliveryResult(recipient, False, str(e))
+                    else:
+                        results[index] = deliver_message(session, recipient, message, auth_failed)
+                if on_result is not None:
+                    on_result(index, results[index])
+        finally:
+            session.close()
+
+    workers = [threading.Thread(target=_worker, daemon=True) for _ in range(max(1, min(pool_size, len(messages))))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    report_delivery(results, auth_failed.is_set())
+    return results
+
+
+def deliver_message(session: SMTPSession, recipient: str, message: bytes,
+                    auth_failed: threading.Event) -> DeliveryResult:
+    """
+    Entrega un mensaje por `session`. Un fallo de autenticación marca `auth_failed`
+    y, desde entonces, los demás mensajes fallan sin volver a intentar el login.
+    """
+    if auth_failed.is_set():
+        return DeliveryResult(recipient, False, "Fallo de autenticación SMTP")
+    try:
+        session.send(recipient, message)
+        return DeliveryResult(recipient, True)
+    except smtplib.SMTPAuthenticationError as e:
+        # Reintentar el login en cada mensaje solo provocaría bloqueos del proveedor
+        auth_failed.set()
+        return DeliveryResult(recipient, False, f"Fallo de autenticación SMTP: {e}")
+    except Exception as e:
+        return DeliveryResult(recipient, False, str(e))
+
+
+def report_delivery(results: List[DeliveryResult], auth_failed: bool) -> None:
+    """Métricas, evento y resumen impreso de un envío masivo."""
+    sent = sum(result.success for result in results)
+    increment('emails_sent', sent)
+    increment('emails_failed', len(results) - sent)
+    log_event('email_batch', sent=sent, failed=len(results) - sent, auth_failed=auth_failed)
+    print(f"    --- EXITO Envío masivo: {sent}/{len(results)} alertas entregadas.")
+    if auth_failed:
+        print(f"    ---- FALLO DE AUTENTICACIÓN. Revisa tu App Password.")
+    for result in results:
+        if not result.success:
+            print(f"    ---- ERROR al enviar correo HTML a {result.recipient}: {result.error}")
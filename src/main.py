@@ -1,117 +1,511 @@
 # src/main.py (ORQUESTADOR FINAL ESCALABLE)
 
 from extract import (
-    fetch_openweather_forecast, 
-    fetch_openmeteo_forecast, 
-    load_historical_data,
+    fetch_forecast_batch,
+    fetch_openmeteo_batch,
     load_user_data
 )
-from transform import standardize_and_clean_data, calculate_ith 
-from analyze import calculate_historical_threshold, assign_risk_category 
-from load import send_email_alert 
-from ia_narrative import generate_risk_narrative # <--- Módulo IA
+from transform import assign_grid_cells
+from forecast_block import decode_openweather, decode_openmeteo_batch
+from analyze import (
+    analyze_forecasts_batch, split_by_location,
+    encode_risk_episodes, describe_risk_episodes, risk_profile_signatures
+)
+from alert_state import open_alert_state, farm_signatures
+from history_cache import get_historical_stats
+from climate_store import open_climate_store
+from load import send_rendered_batch
+from outbox import open_outbox, drain_outbox
+from render import AlertToRender, render_alert_messages
+from ia_narrative import Narrative, generate_narratives_concurrently, generate_narratives_batched # <--- Módulo IA
+from metrics import (
+    get_histogram, all_counters, increment, log_event,
+    stage_timer, stage_durations, write_prometheus_textfile
+)
+from narrative_cache import narrative_cache_stats
+from stream_engine import Stage, StreamPipeline, describe_stream_stats
+from run_journal import (
+    open_run_journal, farm_key, FarmProgress, SendTracker,
+    STAGE_PENDING, STAGE_FETCHED, STAGE_ANALYZED, STAGE_NARRATED, STAGE_RENDERED, STAGE_SENDING, STAGE_SENT
+)
 from constants import (
     URL_OPENWEATHER_FORECAST, 
     URL_OPENMETEO_FORECAST, 
     DATA_FILE_PATH_HISTORICAL,
-    DATA_FILE_PATH_USERS
+    DATA_FILE_PATH_USERS,
+    GRID_RESOLUTION_DEG,
+    USE_MONTH_HOUR_THRESHOLDS,
+    NARRATIVE_BATCH_ENABLED,
+    ALERT_HEARTBEAT_HOURS,
+    FORECAST_HEDGE_ENABLED,
+    FORECAST_HEDGE_DELAY_SECONDS,
+    OUTBOX_DRAIN_INLINE,
+    STREAM_CHUNK_CELLS,
+    STREAM_STAGE_WORKERS
 )
+import argparse
+import threading
+from typing import Iterator, Optional
+import numpy as np
 import pandas as pd 
 
-from templates import generate_alert_html
+from forecast_cache import forecast_cache_stats, has_cached_forecast
+from fetch_engine import hedged_batch
+from provider_health import provider_available
 
 # --- FUNCIONES DE SOPORTE PARA EL PIPELINE ---
 
-def run_single_pipeline(lat: float, lon: float, ith_threshold: float):
+def fetch_cells_forecasts(cells: pd.DataFrame) -> dict:
     """
-    Ejecuta el pipeline E-T-A completo para UNA única coordenada.
+    Ejecuta la parte E-T del pipeline para un lote de celdas de la grilla.
+    Las consultas se hacen en paralelo (OpenWeather primero y Open-Meteo, en lotes
+    multi-ubicación, solo para las celdas que fallaron) y cada pronóstico se
+    decodifica a un ForecastBlock apenas llega. El análisis (A) se hace después,
+    para todas las celdas juntas, con analyze_forecasts_batch.
+    Devuelve {(cell_lat, cell_lon): ForecastBlock}.
     """
-    forecast_data = None
-    
-    # 1. Extracción Resiliente (E)
-    forecast_data = fetch_openweather_forecast(URL_OPENWEATHER_FORECAST, lat, lon)
-    if not forecast_data:
-        forecast_data = fetch_openmeteo_forecast(URL_OPENMETEO_FORECAST, lat, lon)
-    
-    if not forecast_data:
-        return None
+    coords = [((lat, lon), lat, lon) for lat, lon in cells.itertuples(index=False)]
+    cell_forecasts = {}
 
-    # 2. Transformación (T)
-    # Se usa una simple verificación para saber qué fuente estandarizar
-    source = "OpenWeatherMap" if forecast_data.get('city') else "OpenMeteo"
-    df_forecast_standard = standardize_and_clean_data(forecast_data, source)
-    if df_forecast_standard is None or df_forecast_standard.empty:
-        return None
+    # 1. Extracción Resiliente (E): OpenWeather en paralelo, una petición por celda.
+    # Las celdas que ya usaron el fallback en este ciclo (re-ejecución) no reintentan
+    # el primario: su pronóstico de Open-Meteo sale directo de la caché. Con el
+    # circuito de OpenWeather abierto todas las celdas van directo al fallback, y si
+    # se abre a mitad del lote las consultas restantes se rechazan sin esperar.
+    primary = []
+    if provider_available("OpenWeatherMap"):
+        primary = [c for c in coords if not has_cached_forecast("OpenMeteo", c[1], c[2])]
 
-    # 3. Cálculo del ITH y Análisis (T-A)
-    df_forecast_with_ith = calculate_ith(df_forecast_standard, temp_col='temperature_2m', hum_col='relative_humidity_2m')
-    
-    # Asignar riesgo usando el umbral histórico
-    df_final_report = assign_risk_category(df_forecast_with_ith, ith_threshold)
-    
-    return df_final_report
+    def fetch_primary(items):
+        for key, forecast_data in fetch_forecast_batch("OpenWeatherMap", URL_OPENWEATHER_FORECAST, items):
+            # 2. Transformación (T) del pronóstico recién recibido
+            yield key, decode_openweather(forecast_data) if forecast_data else None
+
+    def fetch_fallback(items):
+        increment('forecast_fallback_cells', len(items))
+        for keys, forecast_list in fetch_openmeteo_batch(URL_OPENMETEO_FORECAST, items):
+            if forecast_list:
+                yield from zip(keys, decode_openmeteo_batch(forecast_list))
+
+    hedged = FORECAST_HEDGE_ENABLED and bool(primary)
+    if hedged:
+        # Modo "hedged": las celdas sin respuesta de OpenWeather tras
+        # FORECAST_HEDGE_DELAY_SECONDS se piden también a Open-Meteo y gana la
+        # primera respuesta válida de cada celda.
+        for key, block, _ in hedged_batch(fetch_primary, fetch_fallback, primary, FORECAST_HEDGE_DELAY_SECONDS):
+            cell_forecasts[key] = block
+    else:
+        cell_forecasts.update((key, block) for key, block in fetch_primary(primary) if block is not None)
+
+    # 1.1 Fallback: Open-Meteo multi-ubicación para las celdas que fallaron (en modo
+    # "hedged" las del primario ya pasaron por el respaldo)
+    attempted = {c[0] for c in primary} if hedged else set()
+    pending = [c for c in coords if c[0] not in cell_forecasts and c[0] not in attempted]
+    cell_forecasts.update(fetch_fallback(pending))
+
+    increment('forecast_missing_cells', len(coords) - len(cell_forecasts))
+    return cell_forecasts
+
+
+def report_run_metrics(status: str, **fields) -> None:
+    """
+    Cierre de la corrida: resumen de tiempos por etapa, log JSON con etapas y
+    contadores, y el textfile de Prometheus si está configurado.
+    """
+    durations = stage_durations()
+    if durations:
+        print("  --- Tiempos por etapa: " + " | ".join(f"{stage} {seconds:.2f}s" for stage, seconds in durations.items()))
+    log_event('run_summary', status=status, stages=durations, counters=all_counters(), **fields)
+    path = write_prometheus_textfile()
+    if path:
+        print(f"  --- Métricas escritas en {path}")
+
+
+# --- PIPELINE EN FLUJO: LOTES DE FINCAS Y ETAPAS ---
+
+class FarmBatch:
+    """
+    Fincas de un grupo de celdas que avanzan juntas por las etapas del flujo. Cada
+    etapa completa sus campos. Un lote sin celdas trae fincas ya narradas en una
+    corrida interrumpida: pasa directo al render.
+    """
+
+    __slots__ = ('users', 'cells', 'cell_forecasts', 'location_blocks', 'episode_log', 'signatures',
+                 'alert_users', 'narratives', 'narrative_jobs', 'job_positions', 'outgoing', 'outgoing_keys')
+
+    def __init__(self, users: pd.DataFrame, cells: pd.DataFrame):
+        self.users = users
+        self.cells = cells
+        self.cell_forecasts = {}
+        self.location_blocks = {}
+        self.episode_log = {}
+        self.signatures = {}
+        self.alert_users, self.narratives = [], []
+        self.narrative_jobs, self.job_positions = [], []
+        self.outgoing, self.outgoing_keys = [], []
+
+
+def farm_batches(df_users: pd.DataFrame, cells: pd.DataFrame, chunk_cells: int) -> Iterator[FarmBatch]:
+    """
+    Lotes del flujo: primero las fincas ya narradas (reanudación) y después las que
+    necesitan pronóstico, de a `chunk_cells` celdas (0 = todas en un solo lote).
+    """
+    stage = df_users['stage']
+    resumed = df_users[(stage >= STAGE_NARRATED) & (stage < STAGE_SENDING)]
+    if not resumed.empty:
+        yield FarmBatch(resumed, cells.iloc[:0])
+    if cells.empty:
+        return
+    chunk_cells = chunk_cells or len(cells)
+    chunks = cells.assign(chunk=np.arange(len(cells)) // chunk_cells)
+    pending = df_users[stage < STAGE_NARRATED].merge(chunks, on=['cell_lat', 'cell_lon'])
+    for chunk, users in pending.groupby('chunk', sort=True):
+        yield FarmBatch(users.drop(columns='chunk').reset_index(drop=True),
+                        chunks.loc[chunks['chunk'] == chunk, ['cell_lat', 'cell_lon']])
+
+
+class AlertRun:
+    """
+    Estado compartido de una corrida y las etapas del flujo (cada una recibe y
+    devuelve un FarmBatch; None lo descarta). La bitácora, el estado de alertas y la
+    bandeja de salida son seguros entre hilos; los totales se acumulan bajo un lock.
+    """
+
+    def __init__(self, run_id: str, journal, progress: dict, ith_threshold: float, threshold_table,
+                 cell_baselines: dict, alert_state, outbox, drain: bool):
+        self.run_id = run_id
+        self.journal = journal
+        self.progress = progress
+        self.ith_threshold = ith_threshold
+        self.threshold_table = threshold_table
+        self.cell_baselines = cell_baselines
+        self.alert_state = alert_state
+        self.outbox = outbox
+        self.drain = drain
+        self.totals = dict.fromkeys(('celdas_con_pronostico', 'horas', 'candidatas', 'sin_cambios', 'narrativas',
+                                     'recuperadas', 'alertas', 'encoladas'), 0)
+        self._lock = threading.Lock()
+
+    def _count(self, **values) -> None:
+        with self._lock:
+            for name, value in values.items():
+                self.totals[name] += value
+
+    def extract(self, batch: FarmBatch) -> FarmBatch:
+        """E-T: pronóstico de las celdas del lote, decodificado a ForecastBlock."""
+        if batch.cells.empty:
+            return batch
+        with stage_timer('extraccion'):
+            batch.cell_forecasts = fetch_cells_forecasts(batch.cells)
+        fetched = [key in batch.cell_forecasts for key in zip(batch.users['cell_lat'], batch.users['cell_lon'])]
+        self.journal.advance(self.run_id, batch.users.loc[fetched, 'farm_key'], STAGE_FETCHED)
+        return batch
+
+    def analyze(self, batch: FarmBatch) -> Optional[FarmBatch]:
+        """
+        A: ITH, riesgo y resumen de las celdas del lote en una pasada vectorizada, y
+        alertas incrementales: las fincas cuyo perfil de riesgo no cambió desde su
+        último envío (dentro del latido) no se narran ni se envían.
+        """
+        if batch.cells.empty:
+            for user in batch.users.to_dict('records'):
+                saved = self.progress[user['farm_key']]
+                batch.alert_users.append(user)
+                batch.narratives.append(Narrative(saved.subject, saved.body))
+                if saved.signature is not None:
+                    batch.signatures[user['farm_key']] = saved.signature
+            self._count(recuperadas=len(batch.alert_users))
+            return batch
+
+        with stage_timer('analisis'):
+            df_long, df_summary = analyze_forecasts_batch(batch.cell_forecasts, self.ith_threshold,
+                                                          self.threshold_table, baselines=self.cell_baselines)
+            batch.cell_forecasts = None
+            batch.location_blocks = split_by_location(df_long)
+
+            # Resumen por finca: cada finca hereda el resumen de su celda (merge vectorizado)
+            cell_summary = pd.DataFrame({
+                'cell_lat': [key[0] for key in df_summary['location_key']],
+                'cell_lon': [key[1] for key in df_summary['location_key']],
+                'location_id': df_summary.index.to_numpy(),
+                'max_ith': df_summary['max_ith'].to_numpy(),
+            })
+            users = batch.users.merge(cell_summary, on=['cell_lat', 'cell_lon'], how='left')
+
+            # Firma del perfil de riesgo de cada finca (vectorizada)
+            has_forecast = users['location_id'].notna().to_numpy()
+            signatures = np.zeros(len(users), dtype=np.uint64)
+            if has_forecast.any():
+                cell_signatures = risk_profile_signatures(df_long)
+                signatures[has_forecast] = farm_signatures(
+                    cell_signatures.reindex(users.loc[has_forecast, 'location_id'].astype(np.int64)).to_numpy(),
+                    users.loc[has_forecast, 'product_type'], users.loc[has_forecast, 'ith_threshold'])
+            unchanged = np.zeros(len(users), dtype=bool)
+            if self.alert_state is not None and has_forecast.any():
+                unchanged[has_forecast] = ~self.alert_state.needs_alert(users.loc[has_forecast, 'farm_key'],
+                                                                        signatures[has_forecast])
+            batch.signatures = dict(zip(users.loc[has_forecast, 'farm_key'], signatures[has_forecast]))
+        self.journal.advance(self.run_id, users.loc[has_forecast, 'farm_key'], STAGE_ANALYZED)
+        self._count(celdas_con_pronostico=len(df_summary), horas=len(df_long),
+                    candidatas=int(has_forecast.sum()), sin_cambios=int(unchanged.sum()))
+
+        # Reutilizar el reporte compartido de la celda de cada finca
+        for user in users[~unchanged].to_dict('records'):
+            forecast = batch.location_blocks.get(user['location_id']) if pd.notna(user['location_id']) else None
+            if forecast is None:
+                print(f"   --- ALERTA Saltando envío para {user['farm_name']} por falta de datos de pronóstico.")
+                increment('farms_without_forecast')
+                continue
+            batch.job_positions.append(len(batch.alert_users))
+            batch.alert_users.append(user)
+            batch.narratives.append(None)
+            batch.narrative_jobs.append({
+                'forecast': forecast,
+                'user_type': user['product_type'],
+                'ith_threshold': user['ith_threshold'],
+                'farm_name': user['farm_name'],
+                'max_ith': user['max_ith'],
+            })
+
+        # Episodios de riesgo de las celdas con alertas (una línea por tramo) para el log
+        batch.episode_log = {
+            location_id: describe_risk_episodes(encode_risk_episodes(batch.location_blocks[location_id]),
+                                                separator='; ', time_format='%d/%m %H:%M')
+            for location_id in {user['location_id'] for user in batch.alert_users}
+        }
+        return batch if batch.alert_users else None
+
+    def narrate(self, batch: FarmBatch) -> FarmBatch:
+        """
+        Narrativas IA del lote (pool de hilos propio). Si el proceso muere en esta
+        etapa, las ya generadas se recuperan de la caché sin volver a llamar al modelo.
+        """
+        if not batch.narrative_jobs:
+            return batch
+        with stage_timer('narrativas'):
+            if NARRATIVE_BATCH_ENABLED:
+                generated = generate_narratives_batched(batch.narrative_jobs)
+            else:
+                generated = generate_narratives_concurrently(batch.narrative_jobs)
+            keys = [batch.alert_users[position]['farm_key'] for position in batch.job_positions]
+            for position, key, narrative in zip(batch.job_positions, keys, generated):
+                batch.narratives[position] = narrative
+                # Un texto de respaldo (error de la API, sin Gemini) no notifica el perfil
+                # de riesgo: sin firma no se registra como enviado y la próxima corrida
+                # vuelve a alertar a la finca
+                if not narrative.from_model:
+                    batch.signatures.pop(key, None)
+            self.journal.record_narratives(self.run_id, [
+                (key, narrative.subject, narrative.body, batch.signatures.get(key))
+                for key, narrative in zip(keys, generated)
+            ])
+        self._count(narrativas=len(generated))
+        batch.narrative_jobs = batch.location_blocks = None
+        return batch
+
+    def render(self, batch: FarmBatch) -> FarmBatch:
+        """Plantilla HTML y MIME precompilados -> mensajes listos para enviar."""
+        to_render = []
+        for user, narrative in zip(batch.alert_users, batch.narratives):
+            subject, ai_generated_body = narrative.subject, narrative.body
+            print(f"\n  > Finca: {user['farm_name']} ({user['product_type']}) - Lat:{user['latitude']:.2f}, Lon:{user['longitude']:.2f}")
+            print(f"    > Episodios de riesgo: {batch.episode_log.get(user.get('location_id'), 'narrativa recuperada de la bitácora')}")
+            print(f"    > Asunto generado: {subject}")
+            to_render.append(AlertToRender(user['email'], subject, user['farm_name'], user['product_type'],
+                                           user['ith_threshold'], ai_generated_body))
+        with stage_timer('render'):
+            batch.outgoing = render_alert_messages(to_render)
+        batch.outgoing_keys = [user['farm_key'] for user in batch.alert_users]
+        self.journal.advance(self.run_id, batch.outgoing_keys, STAGE_RENDERED)
+        return batch
+
+    def send(self, batch: FarmBatch) -> None:
+        """
+        L: los mensajes se encolan en la bandeja de salida duradera (una transacción)
+        y el emisor la vacía: en línea o con `python src/outbox.py drain`. Sin bandeja,
+        envío directo con cada envío reclamado en la bitácora (por ventanas) antes de
+        hacerlo, así una finca nunca se envía dos veces en la misma corrida.
+        """
+        self._count(alertas=len(batch.outgoing))
+        if self.outbox is not None:
+            with stage_timer('encolado'):
+                queued = self.outbox.enqueue(self.run_id, (
+                    (key, recipient, message, batch.signatures.get(key))
+                    for key, (recipient, message) in zip(batch.outgoing_keys, batch.outgoing)))
+                self.journal.advance(self.run_id, batch.outgoing_keys, STAGE_SENDING)
+            self._count(encoladas=queued)
+            if self.drain:
+                with stage_timer('envio'):
+                    drain_outbox(self.outbox, self.journal, self.alert_state)
+            return None
+
+        print(f"    > Enviando {len(batch.outgoing)} alertas del lote...")
+        with stage_timer('envio'):
+            record_sent = None
+            if self.alert_state is not None:
+                record_sent = lambda keys: self.alert_state.record_sent(
+                    (key, batch.signatures[key]) for key in keys if key in batch.signatures)
+            tracker = SendTracker(self.journal, self.run_id, batch.outgoing_keys, on_delivered=record_sent)
+            try:
+                send_rendered_batch(batch.outgoing, before_send=tracker.before_send, on_result=tracker.on_result)
+            finally:
+                tracker.close()
+        return None
 
 
 # --- FUNCIÓN ORQUESTADORA ESCALABLE ---
 
-def run_scalable_pipeline():
+def run_scalable_pipeline(run_id: str = None, new_run: bool = False, enqueue_only: bool = False):
+    """
+    Corre el pipeline completo. Sin `run_id` se reanuda la última corrida
+    interrumpida (si la hay); con `new_run=True` siempre empieza una corrida nueva.
+    Con `enqueue_only=True` las alertas quedan en la bandeja de salida para el emisor.
+    """
     print("--- INICIO DEL PROCESO ESCALABLE E-T-A-L ---")
     
     # 0. Cargar datos base (Usuarios e Histórico)
-    df_users = load_user_data(DATA_FILE_PATH_USERS)
-    df_historical = load_historical_data(DATA_FILE_PATH_HISTORICAL)
-    
-    if df_users.empty or df_historical.empty:
-        print("--- FALLO: Base de usuarios o Histórico vacíos. Deteniendo.")
+    with stage_timer('usuarios'):
+        df_users = load_user_data(DATA_FILE_PATH_USERS)
+    if df_users.empty:
+        print("--- FALLO: Base de usuarios vacía. Deteniendo.")
+        report_run_metrics('sin_usuarios')
         return
 
-    # 1. Calcular Umbral Histórico GLOBAL
-    df_historical_ith = calculate_ith(df_historical, temp_col='temperature_2m', hum_col='relative_humidity_2m')
-    ith_threshold = calculate_historical_threshold(df_historical_ith)
-    
-    if ith_threshold is None:
+    # 1. Umbral Histórico GLOBAL (desde el artefacto en caché; se recalcula solo si el CSV cambió)
+    with stage_timer('historico'):
+        historical_stats = get_historical_stats(DATA_FILE_PATH_HISTORICAL)
+    if historical_stats is None:
         print("--- FALLO: No se pudo calcular el umbral histórico. Deteniendo.")
+        report_run_metrics('sin_historico')
         return
+    ith_threshold = historical_stats['p75']
+    # Umbral por mes y hora del día (mismo P75, calibrado por estacionalidad)
+    threshold_table = None
+    if USE_MONTH_HOUR_THRESHOLDS and historical_stats.get('threshold_table') is not None:
+        threshold_table = np.asarray(historical_stats['threshold_table'], dtype=np.float64)
 
-    print(f"\n2. Iniciando Bucle de Envío para {len(df_users)} fincas (Umbral Global: {ith_threshold:.2f})...")
-    
-    # 2. BUCLÉ DE ESCALABILIDAD (Iterar sobre cada usuario)
-    for index, user in df_users.iterrows():
-        print(f"\n  > Procesando Finca: {user['farm_name']} ({user['product_type']}) - Lat:{user['latitude']:.2f}, Lon:{user['longitude']:.2f}")
-
-        # 2.1 E-T-A: Ejecutar pipeline para las coordenadas de la finca
-        df_alert = run_single_pipeline(
-            lat=user['latitude'], 
-            lon=user['longitude'], 
-            ith_threshold=ith_threshold
-        )
-        
-        if df_alert is None:
-            print(f"   --- ALERTA Saltando envío para {user['farm_name']} por falta de datos de pronóstico.")
-            continue
-            
-        # 2.2 Generar Contenido (NARRATIVA IA)
-        print("    > Generando narrativa con IA...")
-        subject, ai_generated_body = generate_risk_narrative(
-            df_alert, 
-            user_type=user['product_type'], 
-            ith_threshold=ith_threshold, 
-            farm_name=user['farm_name']
-        )
-        print(f"    > Asunto generado: {subject}")
-
-        #Llama a la función del template para construir el HTML ---
-        html_body = generate_alert_html(
-            farm_name=user['farm_name'],
-            product_type=user['product_type'],
-            ith_threshold=ith_threshold,
-            ai_generated_body=ai_generated_body
-        )
-
-        # 2.3 Carga (L): Envío de correo
-        send_email_alert(user['email'], subject, html_body)
+    # 1.1 Bitácora de la corrida: lo que ya se hizo en una ejecución interrumpida no se repite
+    journal = open_run_journal()
+    run_id, resumed = journal.start_run(run_id, new_run)
+    df_users['farm_key'] = [farm_key(email, name) for email, name in zip(df_users['email'], df_users['farm_name'])]
+    duplicated = df_users['farm_key'].duplicated()
+    if duplicated.any():
+        print(f"  --- ADVERTENCIA: {int(duplicated.sum())} fincas repetidas (mismo correo y nombre); se alertan una sola vez.")
+        df_users = df_users[~duplicated].reset_index(drop=True)
+    progress = journal.progress(run_id)
+    no_progress = FarmProgress(STAGE_PENDING)
+    df_users['stage'] = [progress.get(key, no_progress).stage for key in df_users['farm_key']]
+    if resumed:
+        print(f"--- Reanudando corrida {run_id}: " + (", ".join(
+            f"{count} {stage}" for stage, count in journal.stage_counts(run_id).items()) or "sin progreso registrado"))
+    else:
+        print(f"--- Corrida {run_id}")
+
+    # 2. AGRUPACIÓN ESPACIAL: Una sola consulta E-T-A por celda de la grilla.
+    # Solo se consultan las celdas de fincas que todavía no tienen narrativa.
+    df_users = assign_grid_cells(df_users, GRID_RESOLUTION_DEG)
+
+    # 2.1 Línea base por celda: en las celdas que cubre el almacén climático su P75
+    # (y su tabla mes x hora) reemplaza al umbral del histórico global
+    cell_baselines = {}
+    with stage_timer('historico'):
+        climate_store = open_climate_store()
+        if climate_store is not None:
+            all_cells = df_users[['cell_lat', 'cell_lon']].dropna().drop_duplicates()
+            cell_baselines = climate_store.baselines(all_cells.itertuples(index=False, name=None),
+                                                     with_tables=USE_MONTH_HOUR_THRESHOLDS)
+            print(f"  --- EXITO Histórico por celda: {len(cell_baselines)}/{len(all_cells)} celdas con línea base "
+                  f"propia; el resto usa el umbral global.")
+    df_users['ith_threshold'] = [cell_baselines.get(key, (ith_threshold,))[0]
+                                 for key in zip(df_users['cell_lat'], df_users['cell_lon'])]
+
+    # 2.2 Las fincas ya enviadas se saltan y las ya narradas reutilizan la narrativa de la bitácora
+    already_sent = int((df_users['stage'] == STAGE_SENT).sum())
+    uncertain = int((df_users['stage'] == STAGE_SENDING).sum())
+    increment('farms_already_sent', already_sent)
+    increment('sends_uncertain', uncertain)
+    if already_sent or uncertain:
+        print(f"    > {already_sent} fincas ya alertadas en esta corrida; {uncertain} en la bandeja de salida o con "
+              f"envío incierto (interrumpido durante el envío) no se vuelven a generar.")
+    needs_forecast = df_users['stage'] < STAGE_NARRATED
+    # Sin coordenadas no hay celda: la finca no entra en ningún lote (farm_batches)
+    no_coords = needs_forecast & (df_users['cell_lat'].isna() | df_users['cell_lon'].isna())
+    if no_coords.any():
+        increment('farms_skipped_no_coords', int(no_coords.sum()))
+        print(f"  --- ADVERTENCIA: {int(no_coords.sum())} fincas sin latitud/longitud válidas no se alertan: "
+              f"{', '.join(df_users.loc[no_coords, 'farm_name'].astype(str).head(10))}"
+              f"{' ...' if no_coords.sum() > 10 else ''}")
+    cells =df_users.loc[needs_forecast, ['cell_lat', 'cell_lon']].dropna().drop_duplicates()
+
+    # 3. PIPELINE EN FLUJO: lotes de celdas por extracción -> análisis -> narrativas ->
+    # render -> envío, con colas acotadas entre etapas (ver stream_engine.py)
+    outbox = open_outbox()
+    alert_run = AlertRun(run_id, journal, progress, ith_threshold, threshold_table, cell_baselines,
+                         open_alert_state(), outbox, drain=OUTBOX_DRAIN_INLINE and not enqueue_only)
+    resumed_farms = int(((df_users['stage'] >= STAGE_NARRATED) & (df_users['stage'] < STAGE_SENDING)).sum())
+    print(f"\n2. Procesando en flujo {int(needs_forecast.sum())} fincas de {len(cells)} celdas y {resumed_farms} ya narradas "
+          f"(resolución {GRID_RESOLUTION_DEG}°, lotes de {STREAM_CHUNK_CELLS or len(cells)} celdas, "
+          f"Umbral Global: {ith_threshold:.2f})...")
+    pipeline = StreamPipeline([
+        Stage(name, fn, STREAM_STAGE_WORKERS.get(name, 1)) for name, fn in (
+            ('extraccion', alert_run.extract), ('analisis', alert_run.analyze), ('narrativas', alert_run.narrate),
+            ('render', alert_run.render), ('envio', alert_run.send))
+    ])
+    try:
+        stream_stats = pipeline.run(farm_batches(df_users, cells, STREAM_CHUNK_CELLS))
+        # Lo que quedó en la bandeja (reintentos vencidos, corridas interrumpidas) sale aunque no haya lotes nuevos
+        if outbox is not None and alert_run.drain:
+            with stage_timer('envio'):
+                drain_outbox(outbox, journal, alert_run.alert_state)
+        if outbox is not None:
+            print("  --- Bandeja de salida: " + ", ".join(
+                f"{count} {status}" for status, count in outbox.counts().items()))
+    finally:
+        if outbox is not None:
+            outbox.close()
+        if alert_run.alert_state is not None:
+            alert_run.alert_state.close()
+    totals = alert_run.totals
+
+    print(f"\n  --- Pronóstico disponible para {totals['celdas_con_pronostico']}/{len(cells)} celdas "
+          f"({totals['horas']} horas analizadas).")
+    cache_stats = forecast_cache_stats()
+    if cache_stats:
+        print(f"  --- Caché de pronósticos: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos, "
+              f"{cache_stats['entries']} entradas ({cache_stats['bytes'] / 1024:.0f} KB).")
+    if alert_run.alert_state is not None:
+        increment('farms_unchanged', totals['sin_cambios'])
+        print(f"  --- Alertas incrementales: {totals['sin_cambios']}/{totals['candidatas']} fincas sin cambios en su "
+              f"perfil de riesgo desde el último envío (latido: {ALERT_HEARTBEAT_HOURS} h); no se notifican.")
+    increment('narratives_resumed', totals['recuperadas'])
+    print(f"  --- Narrativas: {totals['narrativas']} generadas con IA, {totals['recuperadas']} recuperadas de la bitácora.")
+    print(f"    > {get_histogram('gemini_call_seconds').summary()}")
+    counters = all_counters()
+    if counters.get('gemini_prompt_tokens'):
+        print(f"    > Tokens Gemini: {counters['gemini_prompt_tokens']:.0f} de entrada, "
+              f"{counters.get('gemini_output_tokens', 0):.0f} de salida.")
+    if outbox is not None:
+        print(f"  --- EXITO {totals['encoladas']} alertas nuevas en la bandeja de salida "
+              f"({totals['alertas'] - totals['encoladas']} ya estaban encoladas).")
+    print("  --- Etapas del flujo:\n" + "\n".join(f"    > {line}" for line in describe_stream_stats(stream_stats)))
+
+    narrative_stats = narrative_cache_stats()
+    if narrative_stats:
+        print(f"  --- Caché de narrativas: {narrative_stats['hits']} aciertos, {narrative_stats['misses']} llamadas al modelo.")
 
+    journal.finish_run(run_id, 'completado')
+    print(f"  --- Bitácora de la corrida {run_id}: " + ", ".join(
+        f"{count} {stage}" for stage, count in journal.stage_counts(run_id).items()))
+    journal.close()
+    report_run_metrics('completado', run_id=run_id, farms=len(df_users), cells=len(cells), alerts=totals['alertas'],
+                       unchanged=totals['sin_cambios'])
     print("\n--- PROCESO DE ALERTA FINALIZADO ---")
 
 if __name__ == "__main__":
-    run_scalable_pipeline()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Pipeline de alertas de estrés calórico (ITH).")
+    parser.add_argument('--run-id', help="Corrida a reanudar (por defecto, la última interrumpida).")
+    parser.add_argument('--new-run', action='store_true', help="Empezar una corrida nueva aunque haya una interrumpida.")
+    parser.add_argument('--enqueue-only', action='store_true',
+                        help="Solo encolar las alertas; las envía el emisor (python src/outbox.py drain).")
+    args = parser.parse_args()
+    run_scalable_pipeline(args.run_id, args.new_run, args.enqueue_only)
\ No newline at end of file
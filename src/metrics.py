@@ -0,0 +1,213 @@
+# src/metrics.py
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, List, Optional, Sequence
+
+from constants import METRICS_ENABLED, METRICS_JSON_LOGS, METRICS_PROMETHEUS_TEXTFILE
+
+# Capa de instrumentación del pipeline: histogramas de latencia, contadores,
+# temporizadores por etapa (E/T/A/narrativas/render/envío), logs estructurados en
+# JSON y volcado opcional en formato textfile de Prometheus. Con METRICS_ENABLED
+# en False los temporizadores y contadores no hacen nada (costo despreciable).
+
+# =======================================================================
+# HISTOGRAMAS DE LATENCIA
+# =======================================================================
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """
+    Histograma acumulativo de latencias (en segundos) con límites fijos, seguro
+    para varios hilos. Guarda conteo, suma y máximo para el resumen.
+    """
+
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # el último es +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil aproximado: límite superior del bucket donde cae (o el máximo)."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            cumulative = 0
+            for bound, count in zip(self.buckets + (self.max,), self.counts):
+                cumulative += count
+                if cumulative >= rank:
+                    return min(bound, self.max)
+            return self.max
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return f"{self.name}: sin observaciones"
+        return (f"{self.name}: n={self.count} media={self.total / self.count:.2f}s "
+                f"p50≤{self.quantile(0.5):.2f}s p95≤{self.quantile(0.95):.2f}s máx={self.max:.2f}s")
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_registry_lock = threading.Lock()
+
+
+def get_histogram(name: str) -> LatencyHistogram:
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = LatencyHistogram(name)
+        return _histograms[name]
+
+
+def all_histograms() -> List[LatencyHistogram]:
+    with _registry_lock:
+        return list(_histograms.values())
+
+
+# =======================================================================
+# CONTADORES
+# =======================================================================
+
+_counters: Dict[str, float] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    if not METRICS_ENABLED:
+        return
+    with _registry_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def all_counters() -> Dict[str, float]:
+    with _registry_lock:
+        return dict(_counters)
+
+
+# =======================================================================
+# TEMPORIZADORES POR ETAPA
+# =======================================================================
+
+_stage_seconds: Dict[str, float] = {}
+_NULL_TIMER = nullcontext()
+
+
+@contextmanager
+def _stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _registry_lock:
+            _stage_seconds[stage] = _stage_seconds.get(stage, 0.0) + elapsed
+        log_event('stage', stage=stage, seconds=round(elapsed, 4))
+
+
+def stage_timer(stage: str):
+    """
+    Context manager que mide una etapa del pipeline:
+        with stage_timer('extraccion'):
+            ...
+    Acumula la duración por etapa y emite un log JSON (si están activos).
+    """
+    return _stage_timer(stage) if METRICS_ENABLED else _NULL_TIMER
+
+
+def timed_stage(stage: str):
+    """Decorador equivalente a stage_timer para funciones completas."""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage_durations() -> Dict[str, float]:
+    with _registry_lock:
+        return dict(_stage_seconds)
+
+
+# =======================================================================
+# LOGS ESTRUCTURADOS (JSON) Y EXPORTACIÓN PROMETHEUS
+# =======================================================================
+
+def log_event(event: str, **fields) -> None:
+    """
+    Emite una línea JSON en stderr ({"ts", "event", ...campos}) si
+    METRICS_JSON_LOGS está activo. Los prints del pipeline no cambian.
+    """
+    if not METRICS_JSON_LOGS:
+        return
+    record = {'ts': round(time.time(), 3), 'event': event}
+    record.update(fields)
+    sys.stderr.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def _metric_name(name: str) -> str:
+    return "agri_alerta_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus() -> str:
+    """Contadores, duraciones por etapa e histogramas en formato de texto de Prometheus."""
+    lines = []
+    for name, value in sorted(all_counters().items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value:g}"]
+
+    durations = stage_durations()
+    if durations:
+        metric = _metric_name("stage_duration_seconds")
+        lines.append(f"# TYPE {metric} gauge")
+        lines += [f'{metric}{{stage="{stage}"}} {seconds:.6f}' for stage, seconds in sorted(durations.items())]
+
+    for histogram in all_histograms():
+        metric = _metric_name(histogram.name)
+        lines.append(f"# TYPE {metric} histogram")
+        with histogram._lock:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum {histogram.total:.6f}")
+            lines.append(f"{metric}_count {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(path: Optional[str] = METRICS_PROMETHEUS_TEXTFILE) -> Optional[str]:
+    """
+    Escribe las métricas de la corrida para el textfile collector de node_exporter
+    (escritura atómica). No hace nada si no hay ruta configurada.
+    """
+    if not path or not METRICS_ENABLED:
+        return None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return path
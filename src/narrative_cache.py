@@ -0,0 +1,145 @@
+# src/narrative_cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache_store import SQLiteTTLCache
+from constants import (
+    NARRATIVE_CACHE_ENABLED,
+    NARRATIVE_CACHE_PATH,
+    NARRATIVE_CACHE_MAX_BYTES,
+    NARRATIVE_CACHE_TTL_SECONDS,
+    NARRATIVE_CACHE_MEMORY_ENTRIES,
+    NARRATIVE_THRESHOLD_BUCKET
+)
+
+# --- CACHÉ DE NARRATIVAS POR CONTENIDO ---
+# Fincas de la misma celda y del mismo tipo de producción generan prompts que solo
+# difieren en el nombre de la finca. El prompt se construye con un marcador en lugar
+# del nombre, la respuesta del modelo se guarda bajo una firma normalizada del
+# contenido y el nombre real se sustituye después de recuperarla.
+
+FARM_NAME_PLACEHOLDER = "[[FINCA]]"
+SIGNATURE_VERSION = 1
+
+
+def narrative_signature(user_type: str, risk_summary_today: str, risk_summary_tomorrow: str,
+                        ith_threshold: float, max_ith: float, date: str) -> str:
+    """
+    Firma del contenido que determina la narrativa: tipo de producción normalizado,
+    resumen de horas críticas, umbral y máximo ITH por intervalos, y fecha.
+    """
+    def bucket(value: float) -> float:
+        return round(round(float(value) / NARRATIVE_THRESHOLD_BUCKET) * NARRATIVE_THRESHOLD_BUCKET, 4)
+
+    payload = json.dumps([
+        SIGNATURE_VERSION,
+        " ".join(str(user_type).lower().split()),
+        risk_summary_today,
+        risk_summary_tomorrow,
+        bucket(ith_threshold),
+        bucket(max_ith),
+        date,
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class NarrativeCache:
+    """
+    Dos niveles: LRU en memoria (acotado por número de entradas) delante de la
+    caché persistente en SQLite (con TTL). Guarda (asunto, cuerpo) con el marcador
+    FARM_NAME_PLACEHOLDER en lugar del nombre de la finca.
+    """
+
+    def __init__(self, persistent: Optional[SQLiteTTLCache], max_entries: int = NARRATIVE_CACHE_MEMORY_ENTRIES):
+        self.persistent = persistent
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Firma -> [lock, hilos que lo usan]; la entrada se elimina con el último hilo
+        self._inflight: Dict[str, List] = {}
+
+    def _remember(self, signature: str, value: Tuple[str, str]) -> None:
+        # Se llama con el lock tomado
+        self._memory[signature] = value
+        self._memory.move_to_end(signature)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, signature: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            value = self._memory.get(signature)
+            if value is not None:
+                self._memory.move_to_end(signature)
+                self.hits += 1
+                return value
+        stored = self.persistent.get_json(signature) if self.persistent is not None else None
+        with self._lock:
+            if stored is None:
+                self.misses += 1
+                return None
+            value = (stored[0], stored[1])
+            self._remember(signature, value)
+            self.hits += 1
+            return value
+
+    def set(self, signature: str, subject: str, body: str) -> None:
+        with self._lock:
+            self._remember(signature, (subject, body))
+        if self.persistent is not None:
+            self.persistent.set_json(signature, [subject, body], ttl=NARRATIVE_CACHE_TTL_SECONDS)
+
+    @contextmanager
+    def inflight_lock(self, signature: str) -> Iterator[None]:
+        """
+        Lock por firma: con generación concurrente, la primera finca de una firma
+        llama al modelo y las demás esperan y la recuperan de la caché.
+        El lock se descarta cuando lo suelta el último hilo que lo esperaba, así el
+        diccionario solo contiene las firmas en curso.
+        """
+        with self._lock:
+            entry = self._inflight.setdefault(signature, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._inflight[signature]
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self._memory)}
+
+
+_cache: Optional[NarrativeCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_narrative_cache() -> Optional[NarrativeCache]:
+    """
+    Devuelve (creándola la primera vez) la caché de narrativas. Si la capa
+    persistente no se puede abrir se sigue solo con la LRU en memoria.
+    """
+    global _cache
+    if not NARRATIVE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                persistent = SQLiteTTLCache(NARRATIVE_CACHE_PATH, NARRATIVE_CACHE_MAX_BYTES)
+            except Exception as e:
+                print(f"  --- ADVERTENCIA: No se pudo abrir la caché persistente de narrativas ({e}). Solo se usará memoria.")
+                persistent = None
+            _cache = NarrativeCache(persistent)
+        return _cache
+
+
+def narrative_cache_stats() -> Optional[Dict[str, int]]:
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,405 @@
+# src/outbox.py
+"""
+Bandeja de salida duradera de las alertas renderizadas y su emisor.
+
+Uso (desde la raíz del repositorio):
+    python src/outbox.py drain                       # envía lo pendiente y termina
+    python src/outbox.py drain --loop --interval 30  # emisor permanente
+    python src/outbox.py status
+    python src/outbox.py requeue-dead                # reintenta los mensajes muertos
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from constants import (
+    OUTBOX_ENABLED,
+    OUTBOX_PATH,
+    OUTBOX_CLAIM_BATCH,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+    OUTBOX_CLAIM_TIMEOUT_SECONDS,
+    OUTBOX_HEARTBEAT_SECONDS,
+    OUTBOX_SEND_RATE_PER_SEC,
+    OUTBOX_RETENTION_DAYS,
+    SMTP_POOL_SIZE
+)
+from alert_state import from_stored_signature, to_stored_signature
+from load import DeliveryResult, SMTPSession, credentials_configured, deliver_message, report_delivery
+from metrics import increment, log_event
+from ratelimit import TokenBucket, backoff_delay
+
+# =======================================================================
+# BANDEJA DE SALIDA (COLA SQLITE DURADERA)
+# =======================================================================
+# El pipeline deja cada mensaje MIME ya renderizado en la bandeja (una transacción
+# por lote) y sigue; el emisor la vacía a su ritmo. Un fallo SMTP no pierde nada: el
+# mensaje vuelve a la cola con espera exponencial y, tras OUTBOX_MAX_ATTEMPTS
+# intentos, queda como mensaje muerto para revisarlo y reencolarlo a mano.
+#
+# Envío a lo sumo una vez: cada sesión SMTP reclama de a OUTBOX_CLAIM_BATCH mensajes en
+# una transacción IMMEDIATE (varios emisores no toman el mismo mensaje) y un reclamo que
+# nunca se confirmó (emisor caído) no se reenvía solo: pasa a muerto como incierto.
+#
+# Un mensaje nuevo para una finca reemplaza a los que otras corridas anteriores
+# dejaron sin enviar (pendientes, en reintento o muertos): la finca recibe solo la
+# alerta vigente, nunca dos a la vez.
+
+STATUS_PENDING = 'pendiente'
+STATUS_SENDING = 'enviando'
+STATUS_SENT = 'enviado'
+STATUS_DEAD = 'muerto'
+STATUS_SUPERSEDED = 'reemplazado'
+
+
+class OutboxMessage(NamedTuple):
+    """Mensaje reclamado para envío."""
+    id: int
+    run_id: str
+    farm_key: str
+    recipient: str
+    message: bytes
+    signature: Optional[int]
+    attempts: int
+
+
+class Outbox:
+    """
+    Cola de mensajes en SQLite (modo WAL). Varios procesos pueden usarla a la vez;
+    dentro de un proceso es segura entre hilos (una conexión protegida por un lock).
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path) if path != ":memory:" else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, farm_key TEXT NOT NULL, recipient TEXT NOT NULL,"
+            " signature INTEGER, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL, claimed_at REAL, last_error TEXT, created_at REAL NOT NULL, sent_at REAL,"
+            " UNIQUE (run_id, farm_key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_farm ON messages (farm_key)")
+        # El cuerpo MIME va aparte: SQLite reescribe la fila completa en cada UPDATE y
+        # los cambios de estado no deben copiar decenas de KB por mensaje
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bodies (id INTEGER PRIMARY KEY, message BLOB NOT NULL)")
+
+    def enqueue(self, run_id: str, messages: Iterable[Tuple[str, str, bytes, Optional[int]]]) -> int:
+        """
+        Encola (finca, destinatario, mensaje MIME, firma de alerta o None) en una sola
+        transacción. Una finca ya encolada en la misma corrida no se duplica, y sus
+        mensajes sin enviar de corridas anteriores se marcan como reemplazados.
+        Devuelve cuántos mensajes nuevos quedaron en la bandeja.
+        """
+        now = time.time()
+        queued, first_id = 0, None
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for key, recipient, message, signature in messages:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO messages (run_id, farm_key, recipient, signature, status,"
+                    " next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, key, recipient, to_stored_signature(signature), STATUS_PENDING, now, now)
+                )
+                if cursor.rowcount:
+                    self._conn.execute("INSERT INTO bodies (id, message) VALUES (?, ?)", (cursor.lastrowid, message))
+                    first_id = cursor.lastrowid if first_id is None else first_id
+                    queued += 1
+            superseded = []
+            if first_id is not None:
+                # Las fincas recién encoladas (id >= first_id) reemplazan a sus mensajes
+                # sin enviar de otras corridas, todos anteriores (id menor)
+                superseded = self._conn.execute(
+                    "UPDATE messages SET status = ?, last_error = ? WHERE status IN (?, ?) AND run_id <> ? AND id < ?"
+                    " AND farm_key IN (SELECT farm_key FROM messages WHERE run_id = ? AND id >= ?) RETURNING id",
+                    (STATUS_SUPERSEDED, f"Reemplazado por la corrida {run_id}", STATUS_PENDING, STATUS_DEAD,
+                     run_id, first_id, run_id, first_id)
+                ).fetchall()
+                self._conn.executemany("DELETE FROM bodies WHERE id = ?", superseded)
+        if superseded:
+            increment('outbox_superseded', len(superseded))
+            print(f"  --- {len(superseded)} mensajes sin enviar de corridas anteriores reemplazados por su alerta vigente.")
+        return queued
+
+    def claim(self, limit: int = OUTBOX_CLAIM_BATCH, now: Optional[float] = None) -> List[OutboxMessage]:
+        """Reclama hasta `limit` mensajes vencidos (en orden de llegada) para este emisor."""
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "UPDATE messages SET status = ?, claimed_at = ? WHERE id IN ("
+                " SELECT id FROM messages WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?)"
+                " RETURNING id, run_id, farm_key, recipient, signature, attempts",
+                (STATUS_SENDING, now, STATUS_PENDING, now, limit)
+            ).fetchall()
+            if not rows:
+                return []
+            ids = [row[0] for row in rows]
+            bodies = dict(self._conn.execute(
+                f"SELECT id, message FROM bodies WHERE id IN ({','.join('?' * len(ids))})", ids))
+        return sorted((OutboxMessage(*row[:4], bodies[row[0]], from_stored_signature(row[4]), row[5]) for row in rows),
+                      key=lambda message: message.id)
+
+    def complete(self, messages: List[OutboxMessage], results: List[DeliveryResult],
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> Tuple[List[OutboxMessage], int, List[OutboxMessage]]:
+        """
+        Confirma un lote reclamado en una transacción. Los entregados se marcan como
+        enviados, los fallidos vuelven a la cola con espera
+        exponencial y los que agotaron los intentos pasan a muertos.
+        Devuelve (entregados, reintentos, muertos).
+        """
+        now = time.time()
+        delivered, retried, dead = [], [], []
+        for message, result in zip(messages, results):
+            if result.success:
+                delivered.append(message)
+            elif message.attempts + 1 >= max_attempts:
+                dead.append((message, result.error))
+            else:
+                delay = max(OUTBOX_RETRY_BASE_SECONDS,
+                            backoff_delay(message.attempts, OUTBOX_RETRY_BASE_SECONDS, OUTBOX_RETRY_MAX_SECONDS))
+                retried.append((STATUS_PENDING, now + delay, result.error, message.id))
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE messages SET status = ?, sent_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(STATUS_SENT, now, message.id) for message in delivered]
+            )
+            self._conn.executemany(
+                "UPDATE messages SET status = ?, next_attempt_at = ?, last_error = ?, attempts = attempts + 1"
+                " WHERE id = ?", retried
+            )
+            self._conn.executemany(
+                "UPDATE messages SET status = ?, last_error = ?, attempts = attempts + 1 WHERE id = ?",
+                [(STATUS_DEAD, error, message.id) for message, error in dead]
+            )
+        return delivered, len(retried), [message for message, _ in dead]
+
+    def heartbeat(self, ids: List[int], now: Optional[float] = None) -> None:
+        """
+        Renueva `claimed_at` de mensajes que este emisor sigue enviando: un lote lento
+        (límite de tasa, reconexiones) no se confunde con el de un emisor caído.
+        """
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                f"UPDATE messages SET claimed_at = ? WHERE status = ? AND id IN ({','.join('?' * len(ids))})",
+                (time.time() if now is None else now, STATUS_SENDING, *ids))
+
+    def release_stale(self, timeout: float = OUTBOX_CLAIM_TIMEOUT_SECONDS) -> int:
+        """
+        Reclamos nunca confirmados (el emisor murió a mitad del envío): no se sabe si
+        el correo salió, así que pasan a muertos como inciertos en lugar de reenviarse.
+        Los emisores vivos renuevan sus reclamos (heartbeat) cada
+        OUTBOX_HEARTBEAT_SECONDS, muy por debajo de `timeout`.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            return self._conn.execute(
+                "UPDATE messages SET status = ?, last_error = ? WHERE status = ? AND claimed_at < ?",
+                (STATUS_DEAD, "Envío incierto: el emisor se interrumpió antes de confirmar", STATUS_SENDING,
+                 time.time() - timeout)
+            ).rowcount
+
+    def requeue_dead(self) -> int:
+        """Devuelve los mensajes muertos a la cola con los intentos en cero."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            return self._conn.execute(
+                "UPDATE messages SET status = ?, attempts = 0, next_attempt_at = ? WHERE status = ?",
+                (STATUS_PENDING, time.time(), STATUS_DEAD)
+            ).rowcount
+
+    def next_due_at(self) -> Optional[float]:
+        """Momento del próximo reintento pendiente (None si la cola está vacía)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM messages WHERE status = ?", (STATUS_PENDING,)).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM messages GROUP BY status ORDER BY status"))
+
+    def purge_sent(self, retention_days: float = OUTBOX_RETENTION_DAYS) -> None:
+        """
+        Libera los cuerpos de los mensajes ya enviados (se hace al abrir la bandeja y
+        no durante el envío, donde costaba tanto como el propio SMTP) y borra los
+        registros de los enviados (y de los reemplazados) de hace más de
+        `retention_days` días.
+        """
+        cutoff = time.time() - retention_days * 86400
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM bodies WHERE id IN (SELECT id FROM messages WHERE status = ?)",
+                               (STATUS_SENT,))
+            self._conn.execute("DELETE FROM messages WHERE status = ? AND sent_at < ?", (STATUS_SENT, cutoff))
+            self._conn.execute("DELETE FROM messages WHERE status = ? AND created_at < ?", (STATUS_SUPERSEDED, cutoff))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_outbox() -> Optional[Outbox]:
+    """
+    Abre la bandeja de salida. Si está desactivada o no se puede abrir devuelve
+    None y el pipeline envía directo, como antes.
+    """
+    if not OUTBOX_ENABLED:
+        return None
+    try:
+        outbox = Outbox(OUTBOX_PATH)
+        outbox.purge_sent()
+        return outbox
+    except Exception as e:
+        print(f"  --- ADVERTENCIA: No se pudo abrir la bandeja de salida ({e}). Se envía directo.")
+        return None
+
+
+# =======================================================================
+# EMISOR (VACIADO DE LA BANDEJA)
+# =======================================================================
+
+def _confirm_delivered(delivered: List[OutboxMessage], journal=None, alert_state=None) -> None:
+    """Lleva los entregados a la bitácora de su corrida y al estado de alertas."""
+    by_run: Dict[str, List[str]] = {}
+    for message in delivered:
+        by_run.setdefault(message.run_id, []).append(message.farm_key)
+    if journal is not None:
+        for run_id, keys in by_run.items():
+            journal.record_deliveries(run_id, keys, [])
+    if alert_state is not None:
+        alert_state.record_sent((message.farm_key, message.signature) for message in delivered
+                                if message.signature is not None)
+
+
+def drain_outbox(outbox: Outbox, journal=None, alert_state=None, pool_size: int = SMTP_POOL_SIZE,
+                 rate_per_sec: float = OUTBOX_SEND_RATE_PER_SEC, claim_batch: int = OUTBOX_CLAIM_BATCH) -> Dict[str, int]:
+    """
+    Envía todo lo vencido en la bandeja con `pool_size` sesiones SMTP. Cada sesión
+    reclama su propio lote de `claim_batch` mensajes, lo envía y lo confirma (en la
+    bandeja, la bitácora de corridas y el estado de alertas) sin esperar a las demás.
+    Devuelve {'enviados', 'reintentos', 'muertos', 'inciertos'}.
+    """
+    totals = {'enviados': 0, 'reintentos': 0, 'muertos': 0, 'inciertos': 0}
+    if not credentials_configured():
+        print("---- ERROR: Credenciales de email no configuradas en .env. La bandeja queda pendiente.")
+        return totals
+
+    totals['inciertos'] = outbox.release_stale()
+    if totals['inciertos']:
+        increment('outbox_uncertain', totals['inciertos'])
+        print(f"  --- ALERTA {totals['inciertos']} mensajes reclamados por un emisor interrumpido pasan a "
+              f"muertos (envío incierto; `python src/outbox.py requeue-dead` los reintenta).")
+
+    bucket = TokenBucket(rate_per_sec) if rate_per_sec > 0 else None
+    auth_failed = threading.Event()
+    results: List[DeliveryResult] = []
+    totals_lock = threading.Lock()
+
+    def _worker() -> None:
+        session = SMTPSession()
+        try:
+            # Tras un fallo de autenticación no se reclama más: fallaría todo el lote
+            while not auth_failed.is_set():
+                batch = outbox.claim(claim_batch)
+                if not batch:
+                    return
+                batch_results = []
+                last_beat = time.monotonic()
+                for position, message in enumerate(batch):
+                    if bucket is not None and not auth_failed.is_set():
+                        bucket.acquire()
+                    if time.monotonic() - last_beat >= OUTBOX_HEARTBEAT_SECONDS:
+                        # El lote sigue vivo: lo que falta enviar no es un reclamo abandonado
+                        outbox.heartbeat([pending.id for pending in batch[position:]])
+                        last_beat = time.monotonic()
+                    batch_results.append(deliver_message(session, message.recipient, message.message, auth_failed))
+                delivered, retried, dead = outbox.complete(batch, batch_results)
+                _confirm_delivered(delivered, journal, alert_state)
+                with totals_lock:
+                    results.extend(batch_results)
+                    totals['enviados'] += len(delivered)
+                    totals['reintentos'] += retried
+                    totals['muertos'] += len(dead)
+        finally:
+            session.close()
+
+    workers = [threading.Thread(target=_worker, daemon=True) for _ in range(max(1, pool_size))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if results:
+        report_delivery(results, auth_failed.is_set())
+    increment('outbox_retries', totals['reintentos'])
+    increment('outbox_dead', totals['muertos'])
+    log_event('outbox_drain', **totals)
+    if totals['reintentos'] or totals['muertos']:
+        print(f"  --- ADVERTENCIA: {totals['reintentos']} mensajes quedan en la bandeja para reintentarse y "
+              f"{totals['muertos']} pasaron a muertos tras {OUTBOX_MAX_ATTEMPTS} intentos.")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bandeja de salida de alertas: emisor y mantenimiento.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    drain = commands.add_parser('drain', help="Envía los mensajes pendientes.")
+    drain.add_argument('--loop', action='store_true', help="No terminar: seguir vaciando la bandeja.")
+    drain.add_argument('--interval', type=float, default=30.0, help="Espera máxima (s) entre vaciados con --loop.")
+    drain.add_argument('--rate', type=float, default=OUTBOX_SEND_RATE_PER_SEC, help="Correos por segundo (0 = sin límite).")
+    drain.add_argument('--pool-size', type=int, default=SMTP_POOL_SIZE, help="Sesiones SMTP simultáneas.")
+    commands.add_parser('status', help="Mensajes por estado.")
+    commands.add_parser('requeue-dead', help="Devuelve los mensajes muertos a la cola.")
+    args = parser.parse_args()
+
+    outbox = open_outbox()
+    if outbox is None:
+        print("--- ERROR: La bandeja de salida está desactivada o no se pudo abrir.")
+        return 1
+    try:
+        if args.command == 'status':
+            print(", ".join(f"{count} {status}" for status, count in outbox.counts().items()) or "Bandeja vacía.")
+        elif args.command == 'requeue-dead':
+            print(f"  --- EXITO {outbox.requeue_dead()} mensajes muertos devueltos a la cola.")
+        else:
+            # Importados aquí: solo el emisor necesita la bitácora y el estado de alertas
+            from alert_state import open_alert_state
+            from run_journal import open_run_journal
+            journal, alert_state = open_run_journal(), open_alert_state()
+            try:
+                while True:
+                    drain_outbox(outbox, journal, alert_state, args.pool_size, args.rate)
+                    if not args.loop:
+                        break
+                    next_due = outbox.next_due_at()
+                    wait = args.interval if next_due is None else min(args.interval, max(0.0, next_due - time.time()))
+                    time.sleep(max(1.0, wait))
+            except KeyboardInterrupt:
+                print("--- Emisor detenido.")
+            finally:
+                journal.close()
+                if alert_state is not None:
+                    alert_state.close()
+    finally:
+        outbox.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# src/provider_health.py
+import threading
+import time
+from typing import Dict
+
+import requests
+
+from constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_PROBE_INTERVAL_SECONDS
+from metrics import increment, log_event
+
+# =======================================================================
+# SALUD DE LOS PROVEEDORES (CIRCUIT BREAKER)
+# =======================================================================
+# Tras CIRCUIT_FAILURE_THRESHOLD fallos consecutivos el circuito de un proveedor se
+# ABRE: sus peticiones se rechazan al instante (sin esperar el timeout) y el
+# pipeline va directo al proveedor de respaldo. Cada CIRCUIT_PROBE_INTERVAL_SECONDS
+# se deja pasar UNA petición de sondeo (SEMIABIERTO): si responde bien el circuito
+# se CIERRA de nuevo; si falla, vuelve a abrirse.
+
+CLOSED = "CERRADO"
+OPEN = "ABIERTO"
+HALF_OPEN = "SEMIABIERTO"
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Petición rechazada sin enviarse porque el circuito del proveedor está abierto."""
+
+
+class CircuitBreaker:
+    """
+    Estado de salud de un proveedor, compartido entre hilos.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 probe_interval: float = CIRCUIT_PROBE_INTERVAL_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._next_probe = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True si el proveedor se debe saltar (abierto y sin sondeo pendiente)."""
+        with self._lock:
+            return self.state == HALF_OPEN or (self.state == OPEN and time.monotonic() < self._next_probe)
+
+    def allow_request(self) -> bool:
+        """
+        Indica si una petición puede salir. Con el circuito abierto y el sondeo
+        vencido, la primera petición pasa como sondeo y las demás se rechazan
+        hasta conocer su resultado.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self._next_probe:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            previous = self.state
+            self.state = CLOSED
+            self.consecutive_failures = 0
+        if previous != CLOSED:
+            print(f"  --- EXITO {self.name} respondió al sondeo. Circuito {CLOSED}.")
+            log_event('circuit_state', provider=self.name, state=CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CLOSED and self.consecutive_failures < self.failure_threshold:
+                return
+            if self.state == OPEN:
+                # Peticiones que ya estaban en vuelo cuando se abrió: no cambian nada
+                return
+            reopened = self.state == HALF_OPEN
+            self.state = OPEN
+            self._next_probe = time.monotonic() + self.probe_interval
+        self._report_open("falló el sondeo" if reopened else f"{self.consecutive_failures} fallos consecutivos")
+
+    def trip(self, reason: str) -> None:
+        """Abre el circuito de inmediato (p. ej. falta la API key: fallaría siempre)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() < self._next_probe:
+                return
+            self.state = OPEN
+            self._next_probe = time.monotonic() + self.probe_interval
+        self._report_open(reason)
+
+    def _report_open(self, reason: str) -> None:
+        increment(f"provider_circuit_open_{self.name.lower()}")
+        log_event('circuit_state', provider=self.name, state=OPEN, reason=reason)
+        print(f"  --- ALERTA Circuito de {self.name} {OPEN} ({reason}). Se usa el proveedor de respaldo; "
+              f"próximo sondeo en {self.probe_interval:.0f}s.")
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Devuelve (creándolo la primera vez) el circuit breaker compartido del proveedor."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def provider_available(name: str) -> bool:
+    """True si vale la pena intentar el proveedor (circuito cerrado o sondeo vencido)."""
+    return not get_breaker(name).is_open()
@@ -0,0 +1,74 @@
+# src/quantile_sketch.py
+from typing import Optional
+
+import numpy as np
+
+# =======================================================================
+# SKETCH DE CUANTILES CON HISTOGRAMA DE BINS FIJOS (Memoria Acotada)
+# =======================================================================
+
+class HistogramSketch:
+    """
+    Histograma de bins fijos sobre [lower, upper) para estimar cuantiles en streaming.
+
+    - Memoria constante: slots x bins contadores int64, sin importar cuántos datos entren.
+    - Mergeable: dos sketches con la misma configuración se combinan sumando contadores
+      (útil para procesar bloques o archivos por separado).
+    - `slots` permite llevar varias distribuciones a la vez (p. ej. 12 x 24 = mes x hora).
+
+    Cota de error: para valores dentro de [lower, upper) el cuantil estimado cae en
+    el mismo bin que la observación de rango floor(q * (n - 1)), así que difiere de
+    ella en a lo sumo `bin_width`. El cuantil exacto (interpolación 'linear' de
+    pandas) está entre esa observación y la siguiente, que en series horarias densas
+    son prácticamente iguales. Los valores fuera del rango se acumulan en el
+    primer/último bin.
+    """
+
+    def __init__(self, lower: float, upper: float, bin_width: float, slots: int = 1):
+        self.lower = float(lower)
+        self.bin_width = float(bin_width)
+        self.n_bins = int(np.ceil((upper - lower) / bin_width))
+        self.slots = slots
+        self.counts = np.zeros((slots, self.n_bins), dtype=np.int64)
+
+    @property
+    def error_bound(self) -> float:
+        return self.bin_width
+
+    def update(self, values: np.ndarray, slot: Optional[np.ndarray] = None) -> None:
+        """
+        Agrega un bloque de valores (los NaN se ignoran). `slot` indica, para cada
+        valor, en cuál de las distribuciones cae (por defecto la 0).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        bins = np.clip(((values[valid] - self.lower) / self.bin_width).astype(np.int64), 0, self.n_bins - 1)
+        if slot is not None:
+            bins = np.asarray(slot, dtype=np.int64)[valid] * self.n_bins + bins
+        self.counts += np.bincount(bins, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other: "HistogramSketch") -> "HistogramSketch":
+        if (other.lower, other.bin_width, other.counts.shape) != (self.lower, self.bin_width, self.counts.shape):
+            raise ValueError("Los sketches deben tener el mismo rango, ancho de bin y número de slots.")
+        self.counts += other.counts
+        return self
+
+    def count(self, slot: Optional[int] = None) -> int:
+        return int(self.counts.sum() if slot is None else self.counts[slot].sum())
+
+    def quantile(self, q: float, slot: Optional[int] = None) -> Optional[float]:
+        """
+        Cuantil q (0-1) de un slot, o de todos los slots combinados si slot es None.
+        Devuelve None si no hay datos.
+        """
+        counts = self.counts.sum(axis=0) if slot is None else self.counts[slot]
+        total = counts.sum()
+        if total == 0:
+            return None
+        cumulative = np.cumsum(counts)
+        # Misma convención que pandas/NumPy ('linear'): posición q * (n - 1), base 0
+        rank = q * (total - 1)
+        index = int(np.searchsorted(cumulative, rank, side='right'))
+        below = cumulative[index - 1] if index > 0 else 0
+        fraction = (rank - below + 0.5) / counts[index]
+        return self.lower + (index + min(max(fraction, 0.0), 1.0)) * self.bin_width
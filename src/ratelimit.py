@@ -0,0 +1,53 @@
+# src/ratelimit.py
+import random
+import threading
+import time
+from typing import Optional
+
+# --- 1. LIMITADOR DE TASA (TOKEN BUCKET) ---
+
+class TokenBucket:
+    """
+    Limitador de tasa tipo 'token bucket' compartido entre hilos.
+
+    Se reponen `rate` tokens por segundo hasta un máximo de `capacity` (ráfaga).
+    Cada llamada a acquire() consume un token y bloquea hasta que haya uno disponible.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate: float) -> None:
+        """Ajusta la tasa de reposición (usado por el control adaptativo ante HTTP 429)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# --- 2. ESPERA EXPONENCIAL CON JITTER ---
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Tiempo de espera para el reintento número `attempt` (0, 1, 2...):
+    exponencial con 'full jitter' para no sincronizar a todos los hilos.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
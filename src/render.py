@@ -0,0 +1,63 @@
+# src/render.py
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from constants import RENDER_PROCESSES, RENDER_CHUNK_SIZE
+from load import MessageFrame
+from templates import render_alert_html_batch
+
+# =======================================================================
+# ETAPA DE RENDERIZADO (HTML + MIME SERIALIZADO)
+# =======================================================================
+# Convierte las alertas ya narradas en mensajes listos para sendmail (bytes).
+# La plantilla HTML y los segmentos MIME están precompilados, así que el costo por
+# correo es formatear los campos dinámicos y codificar el cuerpo en base64.
+# Para lotes muy grandes el trabajo se reparte en bloques entre procesos.
+
+
+class AlertToRender(NamedTuple):
+    """Datos de una alerta para la etapa de renderizado."""
+    recipient: str
+    subject: str
+    farm_name: str
+    product_type: str
+    ith_threshold: float
+    ai_generated_body: str
+
+
+def _render_chunk(alerts: Sequence[AlertToRender], sender: str, boundary: str, year: int) -> List[Tuple[str, bytes]]:
+    frame = MessageFrame(sender, boundary)
+    html_bodies = render_alert_html_batch(
+        ((a.farm_name, a.product_type, a.ith_threshold, a.ai_generated_body) for a in alerts), year
+    )
+    return [(alert.recipient, frame.render(alert.recipient, alert.subject, html))
+            for alert, html in zip(alerts, html_bodies)]
+
+
+def render_alert_messages(alerts: Sequence[AlertToRender], processes: Optional[int] = None,
+                          chunk_size: int = RENDER_CHUNK_SIZE) -> List[Tuple[str, bytes]]:
+    """
+    Renderiza un lote de alertas a (destinatario, mensaje MIME en bytes), en el
+    mismo orden de entrada. Con `processes` > 1 (por defecto RENDER_PROCESSES) los
+    bloques de `chunk_size` alertas se renderizan en un pool de procesos.
+    """
+    alerts = list(alerts)
+    if not alerts:
+        return []
+    if processes is None:
+        processes = RENDER_PROCESSES
+
+    # Delimitador y año comunes a todo el lote (los procesos hijos no los recalculan)
+    frame = MessageFrame()
+    year = datetime.now().year
+    if processes <= 1 or len(alerts) <= chunk_size:
+        return _render_chunk(alerts, frame.sender, frame.boundary, year)
+
+    chunks = [alerts[i:i + chunk_size] for i in range(0, len(alerts), chunk_size)]
+    rendered: List[Tuple[str, bytes]] = []
+    with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as executor:
+        for chunk_result in executor.map(_render_chunk, chunks, [frame.sender] * len(chunks),
+                                         [frame.boundary] * len(chunks), [year] * len(chunks)):
+            rendered.extend(chunk_result)
+    return rendered
@@ -0,0 +1,279 @@
+# src/run_journal.py
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from alert_state import from_stored_signature, to_stored_signature
+from constants import (
+    RUN_JOURNAL_ENABLED,
+    RUN_JOURNAL_PATH,
+    RUN_JOURNAL_RETENTION_DAYS,
+    RUN_JOURNAL_SEND_WINDOW
+)
+
+# =======================================================================
+# BITÁCORA DE CORRIDAS (REANUDACIÓN Y ENVÍOS IDEMPOTENTES)
+# =======================================================================
+# Registra en SQLite (modo WAL) hasta qué etapa llegó cada finca dentro de una
+# corrida. Si el proceso muere a mitad de camino, la siguiente ejecución del mismo
+# día reanuda la misma corrida: no vuelve a consultar ni a narrar lo que ya estaba
+# hecho y nunca envía dos veces la misma alerta dentro de un mismo run_id.
+#
+# Las etapas solo avanzan (se guarda el máximo) y cada llamada de RunJournal es una
+# única transacción sobre un lote de fincas, así que la bitácora no agrega un
+# commit por finca.
+
+STAGE_PENDING = 0
+STAGE_FETCHED = 1
+STAGE_ANALYZED = 2
+STAGE_NARRATED = 3
+STAGE_RENDERED = 4
+# Reclamada para envío: se confirma ANTES de entregar el mensaje al servidor SMTP.
+# Si el proceso muere en ese intervalo no se sabe si el correo salió, y la finca no
+# se reenvía (a lo sumo una vez por run_id); se reporta como envío incierto.
+# Con la bandeja de salida (outbox.py) la finca queda aquí mientras su mensaje espera
+# en la cola; el emisor la pasa a enviada al confirmar la entrega.
+STAGE_SENDING = 5
+STAGE_SENT = 6
+
+STAGE_NAMES = ('pendiente', 'pronostico', 'analizada', 'narrada', 'renderizada', 'enviando', 'enviada')
+
+
+class FarmProgress(NamedTuple):
+    """
+    Estado de una finca en la corrida. Desde la etapa narrada trae asunto, cuerpo y
+    la firma del perfil de riesgo narrado (para el estado de alertas al reanudar).
+    """
+    stage: int
+    subject: Optional[str] = None
+    body: Optional[str] = None
+    signature: Optional[int] = None
+
+
+def farm_key(email: str, farm_name: str) -> str:
+    """Identidad de una finca dentro de la bitácora (destinatario + nombre)."""
+    return f"{str(email).strip().lower()}|{str(farm_name).strip()}"
+
+
+class RunJournal:
+    """
+    Progreso por finca de cada corrida, persistido en un archivo SQLite.
+    Con path=":memory:" funciona igual pero no sobrevive al proceso (bitácora desactivada).
+    Es segura para usarse desde varios hilos (una conexión protegida por un lock).
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path) if path != ":memory:" else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id TEXT PRIMARY KEY, started_at REAL NOT NULL, finished_at REAL, status TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS farms ("
+            " run_id TEXT NOT NULL, farm_key TEXT NOT NULL, stage INTEGER NOT NULL,"
+            " subject TEXT, body TEXT, signature INTEGER, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (run_id, farm_key))"
+        )
+        # Bitácoras creadas antes de guardar la firma junto a la narrativa
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(farms)")}
+        if 'signature' not in columns:
+            self._conn.execute("ALTER TABLE farms ADD COLUMN signature INTEGER")
+
+    def _transaction(self, sql: str, rows: Iterable[tuple]) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(sql, rows)
+        return len(rows)
+
+    # --- CORRIDAS ---
+
+    def start_run(self, run_id: Optional[str] = None, new_run: bool = False) -> Tuple[str, bool]:
+        """
+        Devuelve (run_id, reanudada). Sin run_id explícito se reanuda la última
+        corrida sin terminar iniciada hoy (fecha local): sus narrativas hablan de
+        "hoy" y "mañana". Las corridas sin terminar de días anteriores se marcan
+        abandonadas. Si no hay ninguna vigente (o new_run=True) se crea una nueva.
+        """
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        with self._lock:
+            if run_id is None and not new_run:
+                stale = [row[0] for row in self._conn.execute(
+                    "SELECT run_id FROM runs WHERE finished_at IS NULL AND started_at < ?", (today,))]
+                if stale:
+                    self._conn.executemany(
+                        "UPDATE runs SET finished_at = ?, status = 'abandonada' WHERE run_id = ?",
+                        ((time.time(), stale_id) for stale_id in stale))
+                    print(f"  --- ADVERTENCIA: {len(stale)} corrida(s) sin terminar de días anteriores "
+                          f"({', '.join(stale)}) se marcan abandonadas; no se reanudan.")
+                row = self._conn.execute(
+                    "SELECT run_id FROM runs WHERE finished_at IS NULL ORDER BY started_at DESC LIMIT 1"
+                ).fetchone()
+                run_id = row[0] if row else None
+            if run_id is None:
+                run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+
+            existing = self._conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if existing:
+                self._conn.execute("UPDATE runs SET finished_at = NULL, status = 'en_curso' WHERE run_id = ?", (run_id,))
+            else:
+                self._conn.execute("INSERT INTO runs (run_id, started_at, status) VALUES (?, ?, 'en_curso')",
+                                   (run_id, time.time()))
+        return run_id, existing is not None
+
+    def finish_run(self, run_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?",
+                               (time.time(), status, run_id))
+
+    def purge_finished(self, retention_days: float = RUN_JOURNAL_RETENTION_DAYS) -> None:
+        """Borra las corridas terminadas hace más de `retention_days` días."""
+        cutoff = time.time() - retention_days * 86400
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            old_runs = [row for row in self._conn.execute(
+                "SELECT run_id FROM runs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))]
+            self._conn.executemany("DELETE FROM farms WHERE run_id = ?", old_runs)
+            self._conn.executemany("DELETE FROM runs WHERE run_id = ?", old_runs)
+
+    # --- PROGRESO POR FINCA ---
+
+    def progress(self, run_id: str) -> Dict[str, FarmProgress]:
+        """Estado registrado de cada finca de la corrida (las ausentes están pendientes)."""
+        with self._lock:
+            return {
+                key: FarmProgress(stage, subject, body, from_stored_signature(signature))
+                for key, stage, subject, body, signature in self._conn.execute(
+                    "SELECT farm_key, stage, subject, body, signature FROM farms WHERE run_id = ?", (run_id,))
+            }
+
+    def advance(self, run_id: str, keys: Iterable[str], stage: int) -> int:
+        """Lleva las fincas a `stage` (nunca retrocede) en una sola transacción."""
+        now = time.time()
+        return self._transaction(
+            "INSERT INTO farms (run_id, farm_key, stage, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(run_id, farm_key) DO UPDATE SET"
+            " stage = MAX(stage, excluded.stage), updated_at = excluded.updated_at",
+            ((run_id, key, stage, now) for key in keys)
+        )
+
+    def record_narratives(self, run_id: str, narratives: Iterable[Tuple[str, str, str, Optional[int]]]) -> int:
+        """
+        Guarda (finca, asunto, cuerpo, firma uint64 o None) y marca las fincas como
+        narradas. La firma es la del perfil de riesgo narrado: al reanudar, la entrega
+        de la narrativa guardada actualiza el estado de alertas con ella.
+        """
+        now = time.time()
+        return self._transaction(
+            "INSERT INTO farms (run_id, farm_key, stage, subject, body, signature, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(run_id, farm_key) DO UPDATE SET"
+            " stage = MAX(stage, excluded.stage), subject = excluded.subject, body = excluded.body,"
+            " signature = excluded.signature, updated_at = excluded.updated_at",
+            ((run_id, key, STAGE_NARRATED, subject, body, to_stored_signature(signature), now)
+             for key, subject, body, signature in narratives)
+        )
+
+    def record_deliveries(self, run_id: str, delivered: Iterable[str], failed: Iterable[str]) -> None:
+        """
+        Cierra un lote reclamado con STAGE_SENDING: las entregadas pasan a enviadas y
+        las rechazadas vuelven a renderizadas (se reintentan en la próxima ejecución).
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE farms SET stage = ?, updated_at = ? WHERE run_id = ? AND farm_key = ?",
+                [(STAGE_SENT, now, run_id, key) for key in delivered]
+            )
+            self._conn.executemany(
+                "UPDATE farms SET stage = ?, updated_at = ? WHERE run_id = ? AND farm_key = ? AND stage = ?",
+                [(STAGE_RENDERED, now, run_id, key, STAGE_SENDING) for key in failed]
+            )
+
+    def stage_counts(self, run_id: str) -> Dict[str, int]:
+        with self._lock:
+            return {
+                STAGE_NAMES[stage]: count
+                for stage, count in self._conn.execute(
+                    "SELECT stage, COUNT(*) FROM farms WHERE run_id = ? GROUP BY stage ORDER BY stage", (run_id,))
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SendTracker:
+    """
+    Enlaza el envío masivo (load.send_rendered_batch) con la bitácora: antes de
+    entregar un mensaje reclama por adelantado una ventana de `window` fincas
+    (STAGE_SENDING) y confirma los resultados en transacciones de `window` fincas.
+    Si el proceso muere, solo la ventana reclamada y sin confirmar queda incierta.
+    `on_delivered(fincas)` recibe las entregadas de cada confirmación (p. ej. para
+    actualizar el estado de alertas en la misma cadencia).
+    """
+
+    def __init__(self, journal: RunJournal, run_id: str, keys: List[str], window: int = RUN_JOURNAL_SEND_WINDOW,
+                 on_delivered: Optional[Callable[[List[str]], None]] = None):
+        self.journal = journal
+        self.run_id = run_id
+        self.keys = keys
+        self.window = max(1, window)
+        self.on_delivered = on_delivered
+        self._claimed = 0
+        self._delivered: List[str] = []
+        self._failed: List[str] = []
+        self._lock = threading.Lock()
+
+    def before_send(self, index: int) -> None:
+        with self._lock:
+            while index >= self._claimed:
+                self.journal.advance(self.run_id, self.keys[self._claimed:self._claimed + self.window], STAGE_SENDING)
+                self._claimed += self.window
+
+    def on_result(self, index: int, result) -> None:
+        with self._lock:
+            (self._delivered if result.success else self._failed).append(self.keys[index])
+            if len(self._delivered) + len(self._failed) >= self.window:
+                self._flush()
+
+    def close(self) -> None:
+        """Confirma los resultados que quedaron en el búfer."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        # Se llama con el lock tomado
+        self.journal.record_deliveries(self.run_id, self._delivered, self._failed)
+        if self.on_delivered is not None and self._delivered:
+            self.on_delivered(self._delivered)
+        self._delivered, self._failed = [], []
+
+
+def open_run_journal() -> RunJournal:
+    """
+    Abre la bitácora persistente. Si está desactivada o no se puede abrir se usa
+    una en memoria: el pipeline funciona igual, pero sin reanudación.
+    """
+    if RUN_JOURNAL_ENABLED:
+        try:
+            journal = RunJournal(RUN_JOURNAL_PATH)
+            journal.purge_finished()
+            return journal
+        except Exception as e:
+            print(f"  --- ADVERTENCIA: No se pudo abrir la bitácora de corridas ({e}). No habrá reanudación.")
+    return RunJournal(":memory:")
+
@@ -0,0 +1,42 @@
+# src/settings.py
+from functools import lru_cache
+from os import getenv
+from typing import NamedTuple, Optional
+
+# =======================================================================
+# CONFIGURACIÓN DE ENTORNO (.env) — SE CARGA UNA SOLA VEZ, EN EL PRIMER USO
+# =======================================================================
+# Importar los módulos del pipeline no lee archivos ni variables de entorno:
+# las credenciales se resuelven la primera vez que algún módulo las necesita.
+
+
+class Settings(NamedTuple):
+    openweather_api_key: Optional[str]
+    gemini_api_key: Optional[str]
+    email_user: Optional[str]
+    email_pass: Optional[str]
+    # Servidor SMTP (por defecto Gmail). Para pruebas locales se puede apuntar a un
+    # servidor de prueba como aiosmtpd: SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0
+    smtp_host: str
+    smtp_port: int
+    # Sin STARTTLS (servidor local de pruebas) tampoco se hace login
+    smtp_starttls: bool
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Carga el .env (sin pisar las variables ya definidas en el entorno) y devuelve
+    la configuración. Las llamadas siguientes reutilizan el mismo resultado.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    return Settings(
+        openweather_api_key=getenv("OPENWEATHER_API_KEY"),
+        gemini_api_key=getenv("GEMINI_API_KEY"),
+        email_user=getenv("EMAIL_USER"),
+        email_pass=getenv("EMAIL_PASS"),
+        smtp_host=getenv("SMTP_HOST", "smtp.gmail.com"),
+        smtp_port=int(getenv("SMTP_PORT", "587")),
+        smtp_starttls=getenv("SMTP_STARTTLS", "1") not in ("0", "false", "False"),
+    )
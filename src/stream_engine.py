@@ -0,0 +1,216 @@
+# src/stream_engine.py
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from constants import STREAM_QUEUE_SIZE, STREAM_REPORT_INTERVAL_SECONDS
+from metrics import increment, log_event
+
+# =======================================================================
+# PIPELINE EN FLUJO (ETAPAS CONECTADAS POR COLAS ACOTADAS)
+# =======================================================================
+# Cada etapa tiene sus propios hilos y lee de una cola acotada que llena la etapa
+# anterior. Mientras una etapa espera a la red (proveedores de pronóstico, Gemini,
+# SMTP) las demás siguen trabajando con otros lotes, y una cola llena frena a la
+# etapa que la alimenta (contrapresión): en memoria hay a lo sumo
+# `queue_size` lotes por etapa más los que se están procesando.
+#
+# Por etapa se mide: lotes procesados, tiempo ocupado, espera de entrada (la etapa
+# anterior no da abasto), espera de salida (la siguiente no da abasto) y la
+# profundidad de su cola de entrada al llegar cada lote. La etapa con mayor
+# ocupación es el cuello de botella.
+
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    """Etapa del pipeline: `fn(lote) -> lote` (None descarta el lote) con `workers` hilos."""
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = STREAM_QUEUE_SIZE
+
+
+class StageStats:
+    """Estadísticas de una etapa (las actualizan sus hilos bajo un lock)."""
+
+    def __init__(self, stage: Stage):
+        self.name = stage.name
+        self.workers = max(1, stage.workers)
+        self.queue_size = stage.queue_size
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def sample_depth(self, depth: int) -> None:
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_sum += depth
+        self._depth_samples += 1
+
+    @property
+    def mean_depth(self) -> float:
+        return self._depth_sum / self._depth_samples if self._depth_samples else 0.0
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def utilization(self) -> float:
+        """Fracción del tiempo en que los hilos de la etapa estuvieron trabajando."""
+        wall = self.wall_seconds
+        return self.busy_seconds / (wall * self.workers) if wall > 0 else 0.0
+
+    @property
+    def throughput(self) -> float:
+        wall = self.wall_seconds
+        return self.items / wall if wall > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'stage': self.name, 'workers': self.workers, 'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 4), 'starved_seconds': round(self.starved_seconds, 4),
+            'blocked_seconds': round(self.blocked_seconds, 4), 'utilization': round(self.utilization, 3),
+            'throughput': round(self.throughput, 3), 'max_queue_depth': self.max_depth,
+            'mean_queue_depth': round(self.mean_depth, 2),
+        }
+
+
+class StreamPipeline:
+    """
+    Ejecuta `stages` en flujo sobre los lotes de `source`:
+        pipeline = StreamPipeline([Stage('extraccion', fetch, 2), Stage('analisis', analyze)])
+        pipeline.run(lotes)
+    Si una etapa lanza una excepción, el resto de los lotes se descarta (las colas se
+    vacían para no bloquear a nadie) y run() la relanza al terminar.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self.stats = [StageStats(stage) for stage in stages]
+        self._queues = [queue.Queue(maxsize=max(1, stage.queue_size)) for stage in stages]
+        self._lock = threading.Lock()
+        self._remaining = [stat.workers for stat in self.stats]
+        self._failed = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _put(self, index: int, item, producer: Optional[StageStats]) -> None:
+        # La profundidad se mide al llegar cada lote a la cola de la etapa `index`
+        started = time.perf_counter()
+        self._queues[index].put(item)
+        depth = self._queues[index].qsize()
+        with self._lock:
+            self.stats[index].sample_depth(depth)
+            if producer is not None:
+                producer.blocked_seconds += time.perf_counter() - started
+
+    def _close_stage(self, index: int) -> None:
+        # El último hilo de la etapa avisa a todos los hilos de la siguiente
+        with self._lock:
+            self._remaining[index] -= 1
+            last = self._remaining[index] == 0
+            if last:
+                self.stats[index].finished_at = time.perf_counter()
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stats[index + 1].workers):
+                self._queues[index + 1].put(_DONE)
+
+    def _worker(self, index: int) -> None:
+        stage, stats, inbox = self.stages[index], self.stats[index], self._queues[index]
+        last_stage = index + 1 == len(self.stages)
+        try:
+            while True:
+                waited = time.perf_counter()
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                with self._lock:
+                    stats.starved_seconds += time.perf_counter() - waited
+                if self._failed.is_set():
+                    continue
+                started = time.perf_counter()
+                try:
+                    result = stage.fn(item)
+                except BaseException as e:
+                    with self._lock:
+                        if self._error is None:
+                            self._error = e
+                    self._failed.set()
+                    continue
+                with self._lock:
+                    stats.items += 1
+                    stats.busy_seconds += time.perf_counter() - started
+                if result is not None and not last_stage:
+                    self._put(index + 1, result, stats)
+        finally:
+            self._close_stage(index)
+
+    def _feed(self, source: Iterable) -> None:
+        try:
+            for item in source:
+                if self._failed.is_set():
+                    break
+                self._put(0, item, None)
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._failed.set()
+        finally:
+            for _ in range(self.stats[0].workers):
+                self._queues[0].put(_DONE)
+
+    def snapshot(self) -> str:
+        """Estado actual en una línea: lotes hechos y profundidad de cada cola."""
+        return " | ".join(f"{stat.name} {stat.items} lotes, cola {queue_.qsize()}/{stat.queue_size}"
+                          for stat, queue_ in zip(self.stats, self._queues))
+
+    def _monitor(self, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            print(f"  --- Flujo: {self.snapshot()}")
+
+    def run(self, source: Iterable, report_interval: float = STREAM_REPORT_INTERVAL_SECONDS) -> List[StageStats]:
+        started = time.perf_counter()
+        for stat in self.stats:
+            stat.started_at = started
+        threads = [threading.Thread(target=self._feed, args=(source,), daemon=True, name="flujo-origen")]
+        for index, stat in enumerate(self.stats):
+            threads += [threading.Thread(target=self._worker, args=(index,), daemon=True,
+                                         name=f"flujo-{stat.name}-{n}") for n in range(stat.workers)]
+        stop_monitor = threading.Event()
+        if report_interval > 0:
+            threading.Thread(target=self._monitor, args=(report_interval, stop_monitor), daemon=True).start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop_monitor.set()
+
+        for stat in self.stats:
+            increment(f'stream_{stat.name}_items', stat.items)
+            increment(f'stream_{stat.name}_busy_seconds', stat.busy_seconds)
+            log_event('stream_stage', **stat.as_dict())
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+
+def describe_stream_stats(stats: List[StageStats]) -> List[str]:
+    """Una línea por etapa para el log, marcando el cuello de botella (mayor ocupación)."""
+    bottleneck = max(stats, key=lambda stat: stat.utilization, default=None)
+    return [
+        f"{stat.name:<11} {stat.workers} hilo(s) | {stat.items} lotes, {stat.throughput:.2f} lotes/s | "
+        f"ocupación {stat.utilization:.0%} | cola máx {stat.max_depth}/{stat.queue_size} (media {stat.mean_depth:.1f}) | "
+        f"espera entrada {stat.starved_seconds:.2f}s, salida {stat.blocked_seconds:.2f}s"
+        + ("  <- cuello de botella" if stat is bottleneck and len(stats) > 1 else "")
+        for stat in stats
+    ]
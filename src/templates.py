@@ -1,17 +1,42 @@
 # src/templates.py (CÓDIGO CORREGIDO Y COMPLETO)
 from datetime import datetime
+from string import Formatter
+from typing import Dict, Iterable, List, Optional
 
-def generate_alert_html(farm_name: str, product_type: str, ith_threshold: float, ai_generated_body: str) -> str:
+
+class CompiledTemplate:
     """
-    Genera la estructura HTML completa y estilizada del correo de alerta.
+    Plantilla separada una sola vez en segmentos estáticos y campos dinámicos
+    (sintaxis de str.format). Renderizar es solo formatear los campos y unir las
+    partes, sin volver a construir el texto estático en cada correo.
     """
-    
-    # 1. Preparar el contenido de la IA (Corregir saltos de línea)
-    # Reemplazamos los \n por la etiqueta <br> para que el formato se respete en HTML.
-    html_content = ai_generated_body.replace('\n', '<br>')
 
-    # 2. Estructura HTML (Usando f-string de Python)
-    html = f"""
+    def __init__(self, source: str):
+        self.static: List[str] = []
+        self.fields: List[tuple] = []
+        literal_parts: List[str] = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            literal_parts.append(literal)
+            if field is None:
+                continue
+            if conversion:
+                raise ValueError(f"Conversión '!{conversion}' no soportada en la plantilla.")
+            self.static.append("".join(literal_parts))
+            self.fields.append((field, spec or ""))
+            literal_parts = []
+        self.static.append("".join(literal_parts))
+
+    def render(self, values: Dict) -> str:
+        parts = [self.static[0]]
+        for (field, spec), literal in zip(self.fields, self.static[1:]):
+            value = values[field]
+            parts.append(format(value, spec) if spec else str(value))
+            parts.append(literal)
+        return "".join(parts)
+
+
+# Estructura HTML del correo de alerta (los {{ }} son llaves literales del CSS)
+ALERT_HTML_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -77,11 +102,43 @@ def generate_alert_html(farm_name: str, product_type: str, ith_threshold: float,
                 <p style="margin-top: 25px; text-align: center; font-weight: bold; color: #2E7D32;">¡La prevención es el camino a la máxima eficiencia!</p>
             </div>
             <div class="footer">
-                <p>&copy; {datetime.now().year} Agri-Alerta. Plataforma de Mitigación de Estrés Térmico.</p>
+                <p>&copy; {year} Agri-Alerta. Plataforma de Mitigación de Estrés Térmico.</p>
                 <p style="margin: 5px 0 0 0; font-size: 10px;">Este correo es automático. Por favor, no responda a este email.</p>
             </div>
         </div>
     </body>
     </html>
     """
-    return html
\ No newline at end of file
+
+_alert_template = CompiledTemplate(ALERT_HTML_TEMPLATE)
+
+
+def _alert_values(farm_name: str, product_type: str, ith_threshold: float, ai_generated_body: str, year: int) -> Dict:
+    return {
+        'farm_name': farm_name,
+        'product_type': product_type,
+        'ith_threshold': ith_threshold,
+        # Reemplazamos los \n por la etiqueta <br> para que el formato se respete en HTML.
+        'html_content': ai_generated_body.replace('\n', '<br>'),
+        'year': year,
+    }
+
+
+def generate_alert_html(farm_name: str, product_type: str, ith_threshold: float, ai_generated_body: str,
+                        year: Optional[int] = None) -> str:
+    """
+    Genera la estructura HTML completa y estilizada del correo de alerta.
+    """
+    if year is None:
+        year = datetime.now().year
+    return _alert_template.render(_alert_values(farm_name, product_type, ith_threshold, ai_generated_body, year))
+
+
+def render_alert_html_batch(alerts: Iterable[tuple], year: Optional[int] = None) -> List[str]:
+    """
+    Renderiza un lote de correos (farm_name, product_type, ith_threshold, cuerpo IA)
+    con la plantilla precompilada; el año se calcula una vez por lote.
+    """
+    if year is None:
+        year = datetime.now().year
+    return [_alert_template.render(_alert_values(*alert, year)) for alert in alerts]
@@ -1,10 +1,13 @@
 # src/transform.py
-from turtle import st
 import numpy as np
 import pandas as pd
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
+
+from forecast_block import decode_forecast
 
 # --- 1. FUNCIÓN DE LIMPIEZA / PREPARACIÓN DE DATOS (LISKOV) ---
+# La decodificación vive en forecast_block: el JSON del proveedor se convierte
+# directo a arreglos (ForecastBlock) sin pasar por un DataFrame por pronóstico.
 
 def standardize_and_clean_data(raw_data: Dict, source: str) -> Optional[pd.DataFrame]:
     """
@@ -13,43 +16,8 @@ def standardize_and_clean_data(raw_data: Dict, source: str) -> Optional[pd.DataF
     
     Columnas Objetivo (Target): ['time', 'temperature_2m', 'relative_humidity_2m']
     """
-    if not raw_data:
-        return None
-        
-    if source == "OpenWeatherMap":
-        # Mapeo de datos de OpenWeather a nuestro estándar
-        list_data = raw_data.get('list', [])
-        records = []
-        for item in list_data:
-            records.append({
-                'time': item.get('dt_txt'),
-                'temperature_2m': item.get('main', {}).get('temp'),
-                'relative_humidity_2m': item.get('main', {}).get('humidity')
-            })
-        df = pd.DataFrame(records)
-        
-    elif source == "OpenMeteo":
-        # Mapeo de datos de OpenMeteo a nuestro estándar
-        hourly_data = raw_data.get('hourly', {})
-        df = pd.DataFrame({
-            'time': hourly_data.get('time', []),
-            'temperature_2m': hourly_data.get('temperature_2m', []),
-            'relative_humidity_2m': hourly_data.get('relative_humidity_2m', [])
-        })
-
-    else:
-        print(f"Advertencia: Fuente de datos desconocida: {source}")
-        return None
-
-    # Limpieza básica y garantía de tipo de dato
-    df['time'] = pd.to_datetime(df['time'], errors='coerce')
-    df['temperature_2m'] = pd.to_numeric(df['temperature_2m'], errors='coerce')
-    df['relative_humidity_2m'] = pd.to_numeric(df['relative_humidity_2m'], errors='coerce')
-    
-    # Eliminar filas con valores nulos generados por errores de conversión
-    df.dropna(subset=['time', 'temperature_2m', 'relative_humidity_2m'], inplace=True)
-    
-    return df
+    block = decode_forecast(raw_data, source)
+    return block.to_frame() if block is not None else None
 
 
 # --- 2. FUNCIÓN DE CÁLCULO DE ITH ---
@@ -64,16 +32,40 @@ def calculate_ith(df, temp_col , hum_col: str) -> pd.DataFrame:
         print("Advertencia: DataFrame vacío o columnas ITH faltantes. Retornando sin ITH.")
         return df
 
-    # 1. Extraer los arrays de NumPy
-    temp_c = df[temp_col].values
-    hum_rel = df[hum_col].values
-
-    # 2. CALCULAR EL ITH CON LA FÓRMULA CORREGIDA
+    # 1. Extraer los arrays de NumPy y calcular el ITH
+    df['ITH'] = ith_from_arrays(df[temp_col].values, df[hum_col].values)
     
+    return df
+
+
+def ith_from_arrays(temp_c: np.ndarray, hum_rel: np.ndarray) -> np.ndarray:
+    """
+    ITH sobre arreglos de NumPy (misma fórmula que calculate_ith). Se calcula en
+    float64 y conserva el tipo de la temperatura (float32 en un ForecastBlock).
+    """
+    temp_c = np.asarray(temp_c)
+    t = temp_c.astype(np.float64)
     # Paréntesis 1: (1.8 * T + 32)
-    ith = (1.8 * temp_c + 32) - (0.55 - 0.55 * hum_rel / 100) * (1.8 * temp_c - 26)
+    ith = (1.8 * t + 32) - (0.55 - 0.55 * np.asarray(hum_rel, dtype=np.float64) / 100) * (1.8 * t - 26)
+    return ith.astype(temp_c.dtype if temp_c.dtype == np.float32 else np.float64, copy=False)
 
-    
-    df['ITH'] = ith
-    
-    return df
+
+# --- 3. FUNCIÓN DE AGRUPACIÓN ESPACIAL (CELDAS DE PRONÓSTICO) ---
+
+def snap_to_grid(lat: float, lon: float, resolution: float) -> Tuple[float, float]:
+    """
+    Redondea una coordenada al centro de la celda de la grilla de pronóstico.
+    """
+    return (round(round(lat / resolution) * resolution, 6),
+            round(round(lon / resolution) * resolution, 6))
+
+
+def assign_grid_cells(df_users: pd.DataFrame, resolution: float) -> pd.DataFrame:
+    """
+    Agrega las columnas 'cell_lat' y 'cell_lon' con la celda de la grilla a la que
+    pertenece cada finca. Las fincas de una misma celda comparten el pronóstico,
+    así que el número de consultas escala con las celdas y no con los usuarios.
+    """
+    df_users['cell_lat'] = (np.round(df_users['latitude'] / resolution) * resolution).round(6)
+    df_users['cell_lon'] = (np.round(df_users['longitude'] / resolution) * resolution).round(6)
+    return df_users
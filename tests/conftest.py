@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Los módulos viven planos en src/ y se importan por nombre (como en main.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
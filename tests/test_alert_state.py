@@ -0,0 +1,61 @@
+# tests/test_alert_state.py
+import numpy as np
+import pytest
+
+from alert_state import AlertStateStore, from_stored_signature, to_stored_signature
+
+HOUR = 3600.0
+
+
+@pytest.fixture
+def store(tmp_path):
+    state = AlertStateStore(str(tmp_path / "alert_state.sqlite"))
+    yield state
+    state.close()
+
+
+def _signatures(*values):
+    return np.array(values, dtype=np.uint64)
+
+
+def test_stored_signature_round_trip():
+    for signature in (0, 1, 2 ** 63 - 1, 2 ** 63, 2 ** 64 - 1):
+        assert from_stored_signature(to_stored_signature(signature)) == signature
+    assert to_stored_signature(None) is None
+
+
+def test_new_farms_need_alert(store):
+    assert store.needs_alert(["a", "b"], _signatures(1, 2), heartbeat_hours=24).tolist() == [True, True]
+
+
+def test_unchanged_signature_within_heartbeat_is_skipped(store):
+    store.record_sent([("a", 2 ** 64 - 1), ("b", 2)], sent_at=1000.0)
+    mask = store.needs_alert(["a", "b", "c"], _signatures(2 ** 64 - 1, 3, 4), heartbeat_hours=24, now=1000.0 + HOUR)
+    assert mask.tolist() == [False, True, True]
+
+
+def test_heartbeat_resends_unchanged_signature(store):
+    store.record_sent([("a", 1)], sent_at=1000.0)
+    assert store.needs_alert(["a"], _signatures(1), heartbeat_hours=24, now=1000.0 + 23 * HOUR).tolist() == [False]
+    assert store.needs_alert(["a"], _signatures(1), heartbeat_hours=24, now=1000.0 + 24 * HOUR).tolist() == [True]
+
+
+def test_heartbeat_disabled_alerts_everyone(store):
+    store.record_sent([("a", 1)], sent_at=1000.0)
+    assert store.needs_alert(["a"], _signatures(1), heartbeat_hours=0, now=1000.0).tolist() == [True]
+
+
+def test_record_sent_replaces_previous_signature(store):
+    store.record_sent([("a", 1)], sent_at=1000.0)
+    store.record_sent([("a", 2)], sent_at=2000.0)
+    mask = store.needs_alert(["a", "a"], _signatures(1, 2), heartbeat_hours=24, now=2000.0)
+    assert mask.tolist() == [True, False]
+
+
+def test_needs_alert_reads_keys_in_chunks(store):
+    keys = [f"finca-{index}" for index in range(2000)]
+    store.record_sent([(key, index) for index, key in enumerate(keys)], sent_at=1000.0)
+    signatures = np.arange(2000, dtype=np.uint64)
+    signatures[1500] += 1
+    mask = store.needs_alert(keys, signatures, heartbeat_hours=24, now=1000.0)
+    assert np.flatnonzero(mask).tolist() == [1500]
@@ -0,0 +1,32 @@
+# tests/test_analyze.py
+import numpy as np
+import pytest
+
+from analyze import RISK_HIGH, RISK_LOW, RISK_MODERATE, RISK_NO_DATA, risk_codes
+from constants import RISK_BANDS
+
+# Umbral histórico por encima de todas las bandas: solo actúan las bandas
+NO_THRESHOLD = 1000.0
+
+
+@pytest.mark.parametrize('edge_index', range(len(RISK_BANDS)))
+def test_band_edge_belongs_to_upper_band(edge_index):
+    edge = RISK_BANDS[edge_index]
+    codes = risk_codes(np.array([np.nextafter(edge, -np.inf), edge, np.nextafter(edge, np.inf)]), NO_THRESHOLD)
+    assert codes.tolist() == [RISK_LOW + edge_index, RISK_LOW + edge_index + 1, RISK_LOW + edge_index + 1]
+
+
+def test_edge_values():
+    codes = risk_codes(np.array([71.9, 72.0, 75.0, 79.0, 84.0, 90.0]), NO_THRESHOLD)
+    assert codes.tolist() == [RISK_LOW, RISK_MODERATE, RISK_HIGH, RISK_HIGH + 1, RISK_HIGH + 2, RISK_HIGH + 2]
+
+
+def test_threshold_raises_to_high_only_when_exceeded():
+    codes = risk_codes(np.array([70.0, 70.5, 80.0]), 70.0)
+    assert codes.tolist() == [RISK_LOW, RISK_HIGH, RISK_HIGH + 1]
+
+
+def test_missing_ith_is_no_data():
+    codes = risk_codes(np.array([np.nan, 73.0]), 70.0)
+    assert codes.tolist() == [RISK_NO_DATA, RISK_HIGH]
+    assert codes.dtype == np.uint8
@@ -0,0 +1,57 @@
+# tests/test_load.py
+import base64
+import re
+from email.header import decode_header, make_header
+
+from load import CRLF, _encode_header, _make_boundary
+
+ENCODED_WORD = re.compile(r"^=\?utf-8\?b\?([A-Za-z0-9+/=]+)\?=$")
+
+
+def _words(header):
+    return header.split(CRLF + " ")
+
+
+def _decode(header):
+    return str(make_header(decode_header(header)))
+
+
+def test_short_ascii_subject_is_unchanged():
+    assert _encode_header("Alerta de calor en Finca 1") == "Alerta de calor en Finca 1"
+
+
+def test_line_breaks_are_removed():
+    assert _encode_header("Alerta\r\nBcc: x@example.com") == "Alerta Bcc: x@example.com"
+
+
+def test_short_non_ascii_subject_is_one_encoded_word():
+    header = _encode_header("Estrés calórico 🐄")
+    assert len(_words(header)) == 1
+    assert _decode(header) == "Estrés calórico 🐄"
+
+
+def test_long_non_ascii_subject_is_split_on_character_boundaries():
+    subject = "Alerta de estrés térmico: ñandú " * 6 + "🟥🟪⬛" * 5
+    header = _encode_header(subject)
+    words = _words(header)
+    assert len(words) > 1
+    for word in words:
+        payload = base64.b64decode(ENCODED_WORD.match(word).group(1))
+        assert len(payload) <= 45
+        # Ninguna palabra parte un carácter multibyte
+        payload.decode("utf-8")
+    assert _decode(header) == " ".join(subject.split())
+
+
+def test_long_ascii_subject_is_encoded():
+    subject = "Alerta " * 200
+    header = _encode_header(subject)
+    assert all(ENCODED_WORD.match(word) for word in _words(header))
+    assert _decode(header) == " ".join(subject.split())
+
+
+def test_boundary_is_unique_and_outside_base64_alphabet():
+    first, second = _make_boundary(), _make_boundary()
+    assert first != second
+    assert first.startswith("=" * 15)
+    assert "-" not in first
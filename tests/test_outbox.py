@@ -0,0 +1,95 @@
+# tests/test_outbox.py
+import time
+
+import pytest
+
+from load import DeliveryResult
+from outbox import (
+    STATUS_DEAD,
+    STATUS_PENDING,
+    STATUS_SENDING,
+    STATUS_SENT,
+    STATUS_SUPERSEDED,
+    Outbox,
+)
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.sqlite"))
+    yield box
+    box.close()
+
+
+def _messages(*keys):
+    return [(key, f"{key}@example.com", f"mensaje {key}".encode(), 2 ** 63 + index) for index, key in enumerate(keys)]
+
+
+def test_claim_takes_each_message_once(outbox):
+    assert outbox.enqueue("r1", _messages("a", "b", "c")) == 3
+    first = outbox.claim(limit=2)
+    second = outbox.claim(limit=2)
+    assert [m.farm_key for m in first] == ["a", "b"]
+    assert [m.farm_key for m in second] == ["c"]
+    assert outbox.claim() == []
+    assert first[0].message == b"mensaje a"
+    assert first[0].signature == 2 ** 63
+    assert outbox.counts() == {STATUS_SENDING: 3}
+
+
+def test_enqueue_same_run_does_not_duplicate(outbox):
+    outbox.enqueue("r1", _messages("a"))
+    assert outbox.enqueue("r1", _messages("a")) == 0
+    assert outbox.counts() == {STATUS_PENDING: 1}
+
+
+def test_enqueue_supersedes_unsent_messages_of_previous_runs(outbox):
+    outbox.enqueue("r1", _messages("a", "b"))
+    outbox.enqueue("r2", _messages("a"))
+    assert outbox.counts() == {STATUS_PENDING: 2, STATUS_SUPERSEDED: 1}
+    assert sorted((m.run_id, m.farm_key) for m in outbox.claim()) == [("r1", "b"), ("r2", "a")]
+
+
+def test_complete_marks_sent_retry_and_dead(outbox):
+    outbox.enqueue("r1", _messages("a", "b", "c"))
+    claimed = outbox.claim()
+    results = [DeliveryResult(m.recipient, success) for m, success in zip(claimed, (True, False, False))]
+    delivered, retried, dead = outbox.complete(claimed[:2], results[:2], max_attempts=3)
+    assert [m.farm_key for m in delivered] == ["a"]
+    assert (retried, dead) == (1, [])
+    delivered, retried, dead = outbox.complete(claimed[2:], results[2:], max_attempts=1)
+    assert [m.farm_key for m in dead] == ["c"]
+    assert outbox.counts() == {STATUS_DEAD: 1, STATUS_PENDING: 1, STATUS_SENT: 1}
+    # El reintento espera su turno
+    assert outbox.claim() == []
+    assert [m.farm_key for m in outbox.claim(now=time.time() + 3600)] == ["b"]
+
+
+def test_release_stale_only_frees_abandoned_claims(outbox):
+    outbox.enqueue("r1", _messages("a", "b"))
+    abandoned, live = outbox.claim()
+    long_ago = time.time() - 3600
+    outbox.heartbeat([abandoned.id, live.id], now=long_ago)
+    # El emisor vivo renueva su reclamo; el caído no
+    outbox.heartbeat([live.id])
+    assert outbox.release_stale(timeout=600) == 1
+    assert outbox.counts() == {STATUS_DEAD: 1, STATUS_SENDING: 1}
+    assert outbox.release_stale(timeout=600) == 0
+
+
+def test_heartbeat_does_not_touch_completed_messages(outbox):
+    outbox.enqueue("r1", _messages("a"))
+    claimed = outbox.claim()
+    outbox.complete(claimed, [DeliveryResult(claimed[0].recipient, True)])
+    outbox.heartbeat([claimed[0].id], now=time.time() - 3600)
+    assert outbox.release_stale(timeout=600) == 0
+    assert outbox.counts() == {STATUS_SENT: 1}
+
+
+def test_requeue_dead(outbox):
+    outbox.enqueue("r1", _messages("a"))
+    claimed = outbox.claim()
+    outbox.complete(claimed, [DeliveryResult(claimed[0].recipient, False, "550")], max_attempts=1)
+    assert outbox.requeue_dead() == 1
+    requeued = outbox.claim()
+    assert [m.attempts for m in requeued] == [0]
@@ -0,0 +1,66 @@
+# tests/test_provider_health.py
+from provider_health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("prueba", failure_threshold=3, probe_interval=3600)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker("prueba", failure_threshold=2, probe_interval=3600)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_single_probe_when_interval_elapsed():
+    breaker = CircuitBreaker("prueba", failure_threshold=1, probe_interval=0)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    # Mientras el sondeo está en curso, el resto se rechaza
+    assert not breaker.allow_request()
+    assert breaker.is_open()
+
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker("prueba", failure_threshold=1, probe_interval=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.consecutive_failures == 0
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens():
+    breaker = CircuitBreaker("prueba", failure_threshold=1, probe_interval=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_failures_in_flight_keep_circuit_open():
+    breaker = CircuitBreaker("prueba", failure_threshold=1, probe_interval=3600)
+    breaker.record_failure()
+    probe_at = breaker._next_probe
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker._next_probe == probe_at
+
+
+def test_trip_opens_immediately():
+    breaker = CircuitBreaker("prueba", failure_threshold=5, probe_interval=3600)
+    breaker.trip("falta la API key")
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()